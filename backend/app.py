@@ -1,13 +1,24 @@
-from chalice import Chalice, Response, UnauthorizedError, BadRequestError
-from chalicelib import storage_service, textract_service
+from chalice import Chalice, Response, UnauthorizedError, BadRequestError, NotFoundError
+from chalicelib import storage_service, textract_service, telemetry, image_processing
+from chalicelib.job_registry import JobRegistry, IN_PROGRESS, COMPLETING, SUCCEEDED, FAILED, claim_expired
+from chalicelib.textract_service import TextractJobFailed, PARSER_VERSION
+from chalicelib.extraction_cache import ExtractionCache
+from chalicelib.storage_service import ObjectNotFound
+from chalicelib.invoice_store import InvoiceStore, invoice_id_for, summarize
+from chalicelib.rate_limiter import RateLimiter
+from chalicelib.reminder_index import ReminderDueIndex
+from chalicelib.spending_summary import SpendingSummary
+from chalicelib.search_index import SearchIndex, document_text, matching_lines
+from chalicelib.reminders import build_reminder
 from chalicelib.user_service import UserService
 from chalicelib.token_utils import verify_token
 import base64
 import uuid
-import boto3
-from urllib.parse import unquote
+from urllib.parse import quote, unquote
 import json
-from datetime import datetime, timedelta, timezone
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from chalice import CORSConfig
 
 app = Chalice(app_name='cloudcomputingproject')
@@ -22,17 +33,75 @@ cors_config = CORSConfig(
 
 # Reworked Setup
 BUCKET_NAME = 'contentcen301247017.aws.ai'
-s3 = boto3.client('s3')
+
+# Batch ingest. Textract's default AnalyzeDocument quota is a handful of TPS
+# per account, so batch workers share one limiter. A batch has to answer
+# within API Gateway's 29 s integration timeout: items are capped to what
+# TEXTRACT_TPS gets through in BATCH_TIME_BUDGET, and an item is only started
+# while it can still finish within the budget if it takes BATCH_ITEM_BUDGET
+# (its turn at the shared limiter plus one AnalyzeDocument call and the S3
+# writes). The rest are handed back as DEFERRED for the client to resend.
+BATCH_WORKERS = 8
+TEXTRACT_TPS = 5
+BATCH_TIME_BUDGET = 20
+BATCH_ITEM_BUDGET = BATCH_WORKERS / TEXTRACT_TPS + 5
+MAX_BATCH_ITEMS = TEXTRACT_TPS * BATCH_TIME_BUDGET // 2
+DEFERRED = 'DEFERRED'
+
+# Direct-to-S3 uploads. Presigned PUTs land under incoming/ so the S3 event
+# only fires for them, not for everything the app writes under uploads/.
+# Abandoned ones should be expired by a bucket lifecycle rule on incoming/.
+INCOMING_PREFIX = 'incoming/'
+DOCUMENT_EXTENSIONS = ('pdf', 'jpg', 'jpeg', 'png', 'tif', 'tiff')
+DIRECT_UPLOAD_METADATA = {'ingest': 'direct'}
+PRESIGNED_URL_EXPIRY = 900
+MULTIPART_THRESHOLD = 16 * 1024 * 1024
+MULTIPART_PART_SIZE = 8 * 1024 * 1024
+
+# Textract publishes PDF job completion to this topic. The name must start
+# with "AmazonTextract" for the managed Textract service role to publish.
+TEXTRACT_SNS_TOPIC = 'AmazonTextractJobComplete'
+TEXTRACT_SNS_TOPIC_ARN = os.environ.get('TEXTRACT_SNS_TOPIC_ARN')
+TEXTRACT_SNS_ROLE_ARN = os.environ.get('TEXTRACT_SNS_ROLE_ARN')
 
 # Services
 storage_service = storage_service.StorageService(BUCKET_NAME)
-textract_service = textract_service.TextractService(storage_service)
+textract_service = textract_service.TextractService(
+    storage_service,
+    notification_channel={
+        'SNSTopicArn': TEXTRACT_SNS_TOPIC_ARN,
+        'RoleArn': TEXTRACT_SNS_ROLE_ARN
+    } if TEXTRACT_SNS_TOPIC_ARN and TEXTRACT_SNS_ROLE_ARN else None,
+    cache=ExtractionCache(storage_service, PARSER_VERSION),
+    rate_limiter=RateLimiter(TEXTRACT_TPS)
+)
+job_registry = JobRegistry(storage_service)
+spending_summary = SpendingSummary(storage_service)
+search_index = SearchIndex(storage_service)
+invoice_store = InvoiceStore(storage_service, spending=spending_summary, search=search_index)
+reminder_due_index = ReminderDueIndex(storage_service)
 
 user_service = UserService(
     user_pool_id='us-east-1_uQZV1V7mr',
     client_id='1ssdk8buoi35c58r0hlaggrk6e'
 )
 
+
+# Every invocation (routes, S3 and SNS events) runs inside a telemetry trace,
+# which logs its duration and the AWS calls it made as one EMF record
+@app.middleware('all')
+def record_timing(event, get_response):
+    if hasattr(event, 'method'):
+        name = f"{event.method} {event.context.get('resourcePath')}"
+    else:
+        name = type(event).__name__
+    with telemetry.trace(name) as current:
+        response = get_response(event)
+        status = getattr(response, 'status_code', None)
+        if status is not None:
+            current.properties['Status'] = status
+        return response
+
 # Ensure the user is logged in
 def get_authenticated_user_id():
     auth_header = app.current_request.headers.get('Authorization')
@@ -50,19 +119,19 @@ def get_authenticated_user_id():
 #  User nows needs to be authenicated 
 @app.route('/extract-invoice/{file_name}', cors=True)
 def extract_invoice(file_name):
-    from urllib.parse import unquote
     file_name = unquote(file_name) 
 
     user_id = get_authenticated_user_id()
     expected_prefix = f"uploads/{user_id}/"
 
-    print("Decoded file_name:", file_name)
-    print("Expected prefix:", expected_prefix)
+    telemetry.debug(f"extract-invoice {file_name} (expected prefix {expected_prefix})")
 
     if not file_name.startswith(expected_prefix):
         raise UnauthorizedError("You do not have permission to access this file.")
 
-    data = textract_service.analyze_document(file_name)
+    data, pending_job = analyze_or_start_job(user_id, file_name, 'extract')
+    if pending_job:
+        return pending_job
     return {
         "fileName": file_name,
         "extractedData": data
@@ -72,8 +141,6 @@ def extract_invoice(file_name):
 # When uploading an image, we use Base64
 @app.route('/upload-image', methods=['POST'], cors=True)
 def upload_image():
-    from datetime import datetime, timedelta, timezone
-
     user_id = get_authenticated_user_id()
     body = app.current_request.json_body
 
@@ -88,100 +155,453 @@ def upload_image():
     except Exception:
         raise BadRequestError("Invalid base64 string.")
 
-    # Generate unique file name
-    file_name = f"uploads/{user_id}/{uuid.uuid4()}.{file_ext}"
-    content_type = 'application/pdf' if file_ext == 'pdf' else f'image/{file_ext}'
-
-    # Upload to S3
-    s3.put_object(
-        Bucket=BUCKET_NAME,
-        Key=file_name,
-        Body=binary_data,
-        ContentType=content_type,
-        ACL='private'
-    )
+    # Upload to S3, shrunk for Textract if it's a large image
+    file_name = store_upload(user_id, binary_data, file_ext)
 
-    # Analyze with Textract
-    extracted_data = textract_service.analyze_document(file_name)
+    # Analyze with Textract. PDFs go through the async API: hand back a job
+    # id right away and finish the record once the job completes.
+    extracted_data, pending_job = analyze_or_start_job(user_id, file_name, 'upload')
+    if pending_job:
+        return pending_job
+    saved = save_invoice(user_id, file_name, extracted_data)
 
-    # Record to save in data.json
-    new_record = {
+    return {
+        "message": "Upload successful",
         "file_name": file_name,
-        "extracted": extracted_data,
-        "created_at": datetime.now(timezone.utc).isoformat(),
-        "reminders_enabled": True
+        "extractedData": extracted_data,
+        **saved
     }
 
-    data_file_key = f"uploads/{user_id}/data.json"
 
-    # Load existing invoice metadata
-    try:
-        existing_obj = s3.get_object(Bucket=BUCKET_NAME, Key=data_file_key)
-        existing_data = json.loads(existing_obj['Body'].read())
-    except s3.exceptions.NoSuchKey:
-        existing_data = []
-
-    existing_data.append(new_record)
-
-    # Save updated invoice metadata
-    s3.put_object(
-        Bucket=BUCKET_NAME,
-        Key=data_file_key,
-        Body=json.dumps(existing_data).encode('utf-8'),
-        ContentType='application/json',
-        ACL='private'
+# Batch ingest. Body: {"items": [...]} where each item is either
+# {"image": <base64>, "extension": "jpg"} or {"file_name": "uploads/{user}/..."}
+# for a document that is already in S3. Items are analyzed concurrently
+# (Textract calls share one rate limiter); images are then committed with
+# one invoice index update and one reminders.json write. PDFs start
+# Textract jobs and finish like single uploads. Invalid items fail on their
+# own without affecting the rest.
+@app.route('/upload-batch', methods=['POST'], cors=True)
+def upload_batch():
+    user_id = get_authenticated_user_id()
+    body = app.current_request.json_body or {}
+    items = body.get('items') if isinstance(body, dict) else None
+
+    if not isinstance(items, list) or not items:
+        raise BadRequestError("Missing 'items' list.")
+    if len(items) > MAX_BATCH_ITEMS:
+        raise BadRequestError(f"At most {MAX_BATCH_ITEMS} items per batch.")
+    start_by = time.monotonic() + BATCH_TIME_BUDGET - BATCH_ITEM_BUDGET
+
+    def ingest(item):
+        if not isinstance(item, dict):
+            return {"status": FAILED, "error": "Item must be an object with 'image' or 'file_name'."}
+        file_name = item.get('file_name')
+        if time.monotonic() > start_by:
+            return {"file_name": file_name, "status": DEFERRED,
+                    "error": "Batch ran out of time before this item; send it again."}
+        try:
+            if file_name:
+                if not isinstance(file_name, str) or not file_name.startswith(f"uploads/{user_id}/"):
+                    return {"file_name": file_name, "status": FAILED, "error": "Access denied."}
+            elif item.get('image'):
+                file_name = store_upload(
+                    user_id, base64.b64decode(item['image']), item.get('extension', 'jpg').lower()
+                )
+            else:
+                return {"status": FAILED, "error": "Item needs 'image' or 'file_name'."}
+
+            extracted_data, pending_job = analyze_or_start_job(user_id, file_name, 'upload')
+            if pending_job:
+                return {"file_name": file_name, "status": IN_PROGRESS, "job_id": pending_job.body["job_id"]}
+            return {"file_name": file_name, "status": SUCCEEDED, "extractedData": extracted_data}
+        except Exception as e:
+            print(f"[ERROR] Batch item for {user_id}: {e}")
+            return {"file_name": file_name, "status": FAILED, "error": str(e)}
+
+    with ThreadPoolExecutor(max_workers=BATCH_WORKERS) as pool:
+        results = list(pool.map(ingest, items))
+
+    analyzed = [(r["file_name"], r["extractedData"]) for r in results if r["status"] == SUCCEEDED]
+    if analyzed:
+        invoice_store.add_many(user_id, analyzed)
+        reminder_times = add_reminders(user_id, analyzed)
+        for r in results:
+            if r["status"] == SUCCEEDED:
+                r["reminder_time"] = reminder_times.get(r["file_name"])
+
+    for index, r in enumerate(results):
+        r["index"] = index
+    return {
+        "items": results,
+        "succeeded": sum(r["status"] == SUCCEEDED for r in results),
+        "in_progress": sum(r["status"] == IN_PROGRESS for r in results),
+        "failed": sum(r["status"] == FAILED for r in results),
+        "deferred": sum(r["status"] == DEFERRED for r in results)
+    }
+
+
+def new_upload_key(user_id, file_ext, upload_id=None):
+    return f"uploads/{user_id}/{upload_id or uuid.uuid4()}.{file_ext}"
+
+
+# incoming/{user_id}/{id}.{ext}, where a direct upload of uploads/{user_id}/{id}.{ext} is sent
+def incoming_key_for(file_name):
+    return INCOMING_PREFIX + file_name.split('/', 1)[1]
+
+
+def content_type_for(file_ext):
+    return 'application/pdf' if file_ext == 'pdf' else f'image/{file_ext}'
+
+
+# originals/{user_id}/{id}.{ext} for the upload stored at uploads/{user_id}/{id}.*
+def original_key_for(file_name, file_ext):
+    _, user_id, name = file_name.split('/', 2)
+    return f"originals/{user_id}/{name.rsplit('.', 1)[0]}.{file_ext}"
+
+
+# Store an uploaded document and return the key to analyze. The extension
+# comes from the file's magic bytes when they are recognized. Large images
+# are kept as sent under originals/ and a downscaled grayscale copy is
+# stored under uploads/, which is what Textract and the invoice record see.
+# `upload_id` keeps the id a direct upload was given; the extension may still
+# change with the detected or optimized format.
+def store_upload(user_id, data, claimed_ext, upload_id=None):
+    file_ext = image_processing.detect_format(data) or claimed_ext
+    with telemetry.span('image.optimize', bytes_in=len(data)):
+        optimized = image_processing.optimize(data, file_ext)
+
+    if optimized is None:
+        file_name = new_upload_key(user_id, file_ext, upload_id)
+        storage_service.put_bytes(file_name, data, content_type=content_type_for(file_ext))
+        return file_name
+
+    body, optimized_ext = optimized
+    file_name = new_upload_key(user_id, optimized_ext, upload_id)
+    original_key = original_key_for(file_name, file_ext)
+    storage_service.put_bytes(original_key, data, content_type=content_type_for(file_ext))
+    storage_service.put_bytes(
+        file_name, body,
+        content_type=content_type_for(optimized_ext),
+        metadata={'original-key': original_key, 'original-size': str(len(data))}
     )
+    telemetry.debug(f"Stored {file_name}: {len(data)} -> {len(body)} bytes")
+    return file_name
 
-    # Reminder Upload
-    reminder_key = f"uploads/{user_id}/reminders.json"
+
+# Direct uploads: the client asks for presigned URLs, PUTs the document
+# straight to S3 under incoming/, and the S3 event handler below moves it to
+# the returned file_name under uploads/ and does the extraction. Large
+# files get one presigned URL per multipart part so they can be sent in
+# parallel (the bucket's CORS config must expose the ETag header).
+@app.route('/upload-url', methods=['POST'], cors=True)
+def create_upload_url():
+    user_id = get_authenticated_user_id()
+    if not storage_service.supports_direct_uploads:
+        return direct_uploads_unavailable()
+    body = app.current_request.json_body or {}
+
+    file_ext = body.get('extension', 'jpg').lower()
+    if file_ext not in DOCUMENT_EXTENSIONS:
+        raise BadRequestError(f"Unsupported extension '{file_ext}'.")
     try:
-        obj = s3.get_object(Bucket=BUCKET_NAME, Key=reminder_key)
-        reminders = json.loads(obj['Body'].read())
-    except s3.exceptions.NoSuchKey:
-        reminders = []
+        size = int(body.get('size') or 0)
+    except (TypeError, ValueError):
+        raise BadRequestError("size must be a number of bytes.")
+
+    file_name = new_upload_key(user_id, file_ext)
+    upload_key = incoming_key_for(file_name)
+    content_type = content_type_for(file_ext)
+
+    if size > MULTIPART_THRESHOLD:
+        upload_id = storage_service.create_multipart_upload(upload_key, content_type, DIRECT_UPLOAD_METADATA)
+        part_count = -(-size // MULTIPART_PART_SIZE)
+        parts = [
+            {
+                "part_number": part_number,
+                "url": storage_service.presigned_part_url(
+                    upload_key, upload_id, part_number, expires_in=PRESIGNED_URL_EXPIRY
+                )
+            }
+            for part_number in range(1, part_count + 1)
+        ]
+        return {
+            "file_name": file_name,
+            "upload_id": upload_id,
+            "part_size": MULTIPART_PART_SIZE,
+            "parts": parts
+        }
+
+    url = storage_service.presigned_put_url(
+        upload_key, content_type, DIRECT_UPLOAD_METADATA, expires_in=PRESIGNED_URL_EXPIRY
+    )
+    return {
+        "file_name": file_name,
+        "method": "PUT",
+        "url": url,
+        "status_url": f"/upload-status/{quote(file_name, safe='')}",
+        # Signed into the URL, so the PUT must send exactly these
+        "headers": {
+            "Content-Type": content_type,
+            **{f"x-amz-meta-{k}": v for k, v in DIRECT_UPLOAD_METADATA.items()}
+        }
+    }
 
-    if not any(r["file_name"] == file_name for r in reminders):
-        now = datetime.now(timezone.utc)
-        due_date_str = extracted_data.get("DueDate")
 
-        # Try to parse due date from extractedData["DueDate"]
-        try:
-            extracted_due_date = datetime.fromisoformat(due_date_str).replace(tzinfo=timezone.utc)
-        except (TypeError, ValueError):
-            # Fallback to 24h from now
-            extracted_due_date = now + timedelta(days=1)
+@app.route('/complete-upload', methods=['POST'], cors=True)
+def complete_upload():
+    user_id = get_authenticated_user_id()
+    if not storage_service.supports_direct_uploads:
+        return direct_uploads_unavailable()
+    body = app.current_request.json_body or {}
+    file_name = body.get('file_name')
+    upload_id = body.get('upload_id')
+    parts = body.get('parts')
+
+    if not file_name or not upload_id or not parts:
+        raise BadRequestError("file_name, upload_id and parts are required.")
+    if not file_name.startswith(f"uploads/{user_id}/"):
+        raise UnauthorizedError("Access denied.")
+
+    storage_service.complete_multipart_upload(
+        incoming_key_for(file_name), upload_id, sorted((int(p['part_number']), p['etag']) for p in parts)
+    )
+    return {
+        "file_name": file_name,
+        "status": IN_PROGRESS,
+        "status_url": f"/upload-status/{quote(file_name, safe='')}"
+    }
 
-        # Calculate ideal reminder time
-        reminder_time = extracted_due_date - timedelta(hours=24)
 
-        # If ideal time is already in the past, bump to now + 15min
-        if reminder_time < now:
-            reminder_time = now + timedelta(minutes=15)
+# The local storage backend has no URL a browser can PUT to; clients fall
+# back to /upload-image
+def direct_uploads_unavailable():
+    return Response(status_code=501, body={
+        'error': "Direct uploads need the S3 storage backend; use /upload-image instead."
+    })
+
+
+@app.route('/upload-status/{file_name}', methods=['GET'], cors=True)
+def upload_status(file_name):
+    user_id = get_authenticated_user_id()
+    file_name = unquote(file_name)
+    if not file_name.startswith(f"uploads/{user_id}/"):
+        raise UnauthorizedError("Access denied.")
 
-        reminders.append({
+    record = invoice_store.get(user_id, invoice_id_for(file_name))
+    if record is None:
+        # PDFs: move the Textract job along if the SNS handler hasn't
+        job = job_registry.get_for_file(user_id, file_name, 'upload')
+        if job and (job["status"] == IN_PROGRESS or claim_expired(job)):
+            job = poll_job(job)
+        if job and job["status"] == FAILED:
+            return {"file_name": file_name, "status": FAILED, "error": job.get("error")}
+        record = invoice_store.get(user_id, invoice_id_for(file_name))
+
+    if record is None:
+        return Response(status_code=202, body={
             "file_name": file_name,
-            "created_at": now.isoformat(),
-            "due_date": extracted_due_date.isoformat().replace("+00:00", "Z"),
-            "reminder_time": reminder_time.isoformat().replace("+00:00", "Z")
+            "status": IN_PROGRESS,
+            "status_url": f"/upload-status/{quote(file_name, safe='')}"
         })
+    return {
+        "file_name": file_name,
+        "status": SUCCEEDED,
+        "extractedData": record["extracted"]
+    }
 
-        # Save updated reminders
-        s3.put_object(
-            Bucket=BUCKET_NAME,
-            Key=reminder_key,
-            Body=json.dumps(reminders).encode('utf-8'),
-            ContentType='application/json'
-        )
+
+# Runs extraction for documents PUT through a presigned URL: stores them
+# from incoming/ under uploads/, where every other upload lives, and analyzes
+# them there. Images go through store_upload like /upload-image (format
+# detection, original kept under originals/, downscaled copy analyzed), so
+# the stored extension can differ from the one the client was given; the
+# invoice id stays the same. PDFs are copied server-side without reading
+# them. A redelivered event finds the upload already stored.
+@app.on_s3_event(bucket=BUCKET_NAME, prefix=INCOMING_PREFIX, events=['s3:ObjectCreated:*'])
+def process_direct_upload(event):
+    parts = event.key.split('/')
+    if len(parts) != 3 or parts[2].rsplit('.', 1)[-1].lower() not in DOCUMENT_EXTENSIONS:
+        return
+
+    user_id = parts[1]
+    upload_id, claimed_ext = parts[2].rsplit('.', 1)
+    file_name = next(
+        (obj['key'] for obj in storage_service.list(f"uploads/{user_id}/{upload_id}.")), None
+    )
+    if file_name is None:
+        try:
+            if claimed_ext.lower() == 'pdf':
+                file_name = f"uploads/{user_id}/{parts[2]}"
+                if not storage_service.copy(event.key, file_name):
+                    raise ObjectNotFound(event.key)
+            else:
+                data = storage_service.get_bytes(event.key)
+                file_name = store_upload(user_id, data, claimed_ext.lower(), upload_id=upload_id)
+        except ObjectNotFound:
+            print(f"[WARN] Direct upload {event.key} is gone; skipping")
+            return
+    storage_service.delete(event.key)
+
+    extracted_data, pending_job = analyze_or_start_job(user_id, file_name, 'upload')
+    if pending_job:
+        print(f"[INFO] Started Textract job for direct upload {file_name}")
+        return
+    save_invoice(user_id, file_name, extracted_data)
+
+
+# Record an analyzed upload in the invoice store and schedule its reminder
+def save_invoice(user_id, file_name, extracted_data):
+    invoice_store.add(user_id, file_name, extracted_data)
+    reminder_times = add_reminders(user_id, [(file_name, extracted_data)])
 
     return {
-        "message": "Upload successful",
-        "file_name": file_name,
-        "extractedData": extracted_data,
-        "saved_to": data_file_key,
-        "reminder_time": reminder_time.isoformat().replace("+00:00", "Z")
+        "saved_to": invoice_store.record_key(user_id, file_name),
+        "reminder_time": reminder_times.get(file_name)
     }
 
 
+# Schedule reminders for analyzed uploads with a single read-modify-write of
+# reminders.json. `analyzed` is a list of (file_name, extracted_data).
+# Returns {file_name: reminder_time} for the reminders that were added.
+def add_reminders(user_id, analyzed):
+    reminder_key = f"uploads/{user_id}/reminders.json"
+    new_reminders = [
+        build_reminder(file_name, extracted_data.get("DueDate"), vendor=extracted_data.get("Vendor"))
+        for file_name, extracted_data in analyzed
+    ]
+
+    # Conditional write, retried on conflict, so reminders created or
+    # delivered concurrently aren't overwritten
+    added = {}
+    due_times = []
+
+    def append_new(reminders):
+        added.clear()
+        due_times.clear()
+        existing = {r["file_name"] for r in reminders}
+        for reminder, reminder_time in new_reminders:
+            if reminder["file_name"] in existing:
+                continue
+            reminders.append(reminder)
+            existing.add(reminder["file_name"])
+            added[reminder["file_name"]] = reminder["reminder_time"]
+            due_times.append(reminder_time)
+        return bool(added)
+
+    storage_service.update_json(reminder_key, append_new, default=list)
+    for bucket_time in {reminder_due_index.bucket_for(t): t for t in due_times}.values():
+        reminder_due_index.mark(user_id, bucket_time)
+    return added
+
+
+# Serve the extraction from the content cache when possible, otherwise
+# analyze images inline and start a Textract job for PDFs, or hand back the
+# job already running for the same file and purpose.
+# Returns (extracted_data, None) or (None, 202 job response).
+def analyze_or_start_job(user_id, file_name, kind, use_cache=True):
+    if not textract_service.is_async_document(file_name):
+        return textract_service.analyze_document(file_name, use_cache=use_cache), None
+
+    extracted_data = textract_service.cached_analysis(file_name) if use_cache else None
+    if extracted_data is None:
+        running = job_registry.get_for_file(user_id, file_name, kind)
+        if running and running["status"] in (IN_PROGRESS, COMPLETING):
+            return None, job_response(running)
+        return None, start_analysis_job(user_id, file_name, kind)
+    return extracted_data, None
+
+
+# Start an async Textract job for a PDF and register it under the user's
+# prefix. `kind` decides what happens on completion: 'upload' saves the
+# invoice record, anything else just keeps the extracted data on the job.
+def start_analysis_job(user_id, file_name, kind):
+    job_id = textract_service.start_analysis(file_name, job_tag=user_id)
+    return job_response(job_registry.create(user_id, job_id, file_name, kind))
+
+
+def job_response(job):
+    return Response(status_code=202, body={
+        "message": "Analysis started",
+        "fileName": job["file_name"],
+        "file_name": job["file_name"],
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "status_url": f"/jobs/{job['job_id']}"
+    })
+
+
+# Finish a job this handler has claimed. `extracted_data` is passed when the
+# caller already fetched the results.
+def finish_job(job, extracted_data=None):
+    user_id, job_id = job["user_id"], job["job_id"]
+    try:
+        if extracted_data is None:
+            _, extracted_data = textract_service.get_analysis(job_id)
+        textract_service.remember_analysis(job["file_name"], extracted_data)
+        result = {"extractedData": extracted_data}
+        if job["kind"] == 'upload':
+            result.update(save_invoice(user_id, job["file_name"], extracted_data))
+        elif job["kind"] == 'reanalyze':
+            invoice_store.update_extracted(user_id, job["file_name"], extracted_data)
+    except Exception as e:
+        print(f"[ERROR] Completing Textract job {job_id}: {e}")
+        return job_registry.update(user_id, job_id, status=FAILED, error=str(e))
+    return job_registry.update(user_id, job_id, status=SUCCEEDED, **result)
+
+
+# One non-blocking status check against Textract for an IN_PROGRESS job
+def poll_job(job):
+    user_id, job_id = job["user_id"], job["job_id"]
+    try:
+        status, extracted_data = textract_service.get_analysis(job_id)
+    except TextractJobFailed as e:
+        return job_registry.update(user_id, job_id, status=FAILED, error=str(e))
+
+    if status != 'SUCCEEDED':
+        return job
+
+    claimed = job_registry.claim(user_id, job_id)
+    if claimed is None:
+        # Someone else (usually the SNS handler) is finishing it
+        return job_registry.get(user_id, job_id)
+    return finish_job(claimed, extracted_data)
+
+
+@app.route('/jobs/{job_id}', methods=['GET'], cors=True)
+def get_job(job_id):
+    user_id = get_authenticated_user_id()
+    job = job_registry.get(user_id, job_id)
+    if job is None:
+        raise NotFoundError("Job not found.")
+
+    # A claim whose finisher died is retried here once its lease runs out
+    if job["status"] == IN_PROGRESS or claim_expired(job):
+        job = poll_job(job)
+    return job
+
+
+# Textract publishes job completion here when TEXTRACT_SNS_TOPIC_ARN is set
+@app.on_sns_message(topic=TEXTRACT_SNS_TOPIC)
+def textract_job_completed(event):
+    message = json.loads(event.message)
+    job_id = message['JobId']
+    file_name = message['DocumentLocation']['S3ObjectName']
+    user_id = message.get('JobTag') or file_name.split('/')[1]
+
+    if message['Status'] != 'SUCCEEDED':
+        job = job_registry.get(user_id, job_id)
+        if job and job["status"] == IN_PROGRESS:
+            job_registry.update(user_id, job_id, status=FAILED,
+                                error=f"Textract job {message['Status']}")
+        return
+
+    job = job_registry.claim(user_id, job_id)
+    if job is None:
+        print(f"[INFO] Textract job {job_id} already handled or unknown.")
+        return
+    finish_job(job)
+
+
 
 
 @app.route('/signup', methods=['POST'], cors=True)
@@ -219,25 +639,101 @@ def login():
         return Response(status_code=401, body={'error': result['message']})
     
 
+# Query params: limit, cursor, fields (comma separated, e.g.
+# file_name,vendor,amount,due_date), vendor, created_from, created_to,
+# due_from, due_to (YYYY-MM-DD), min_amount, max_amount
 @app.route('/my-invoices', methods=['GET'], cors=True)
 def get_user_invoices():
-
     user_id = get_authenticated_user_id()
-    data_file_key = f"uploads/{user_id}/data.json"
+    params = app.current_request.query_params or {}
+
+    try:
+        limit = min(max(int(params.get('limit', 50)), 1), 200)
+        filters = {
+            key: params[key]
+            for key in ('vendor', 'created_from', 'created_to', 'due_from', 'due_to')
+            if params.get(key)
+        }
+        for key in ('min_amount', 'max_amount'):
+            if params.get(key):
+                filters[key] = float(params[key])
+    except ValueError:
+        raise BadRequestError("limit, min_amount and max_amount must be numbers.")
+
+    fields = [f.strip() for f in params['fields'].split(',') if f.strip()] if params.get('fields') else None
 
     try:
-        # Fetch the existing data.json from S3
-        response = s3.get_object(Bucket=BUCKET_NAME, Key=data_file_key)
-        data = json.loads(response['Body'].read())
-    except s3.exceptions.NoSuchKey:
-        # If the file doesn't exist yet, return empty list
-        data = []
+        invoices, next_cursor = invoice_store.list_page(
+            user_id,
+            limit=limit,
+            cursor=params.get('cursor'),
+            filters=filters,
+            fields=fields
+        )
+    except ValueError as e:
+        raise BadRequestError(str(e))
 
     return {
         "user_id": user_id,
-        "invoices": data
+        "invoices": invoices,
+        "next_cursor": next_cursor
+    }
+
+# Full-text search over the user's invoices. Every word of `q` must match;
+# end a word with '*' to match it as a prefix (`hydr*`). Results are newest
+# first and page with `cursor` like /my-invoices.
+@app.route('/search', methods=['GET'], cors=True)
+def search_invoices():
+    user_id = get_authenticated_user_id()
+    params = app.current_request.query_params or {}
+
+    query = (params.get('q') or '').strip()
+    if not query:
+        raise BadRequestError("Missing search query 'q'.")
+    try:
+        limit = min(max(int(params.get('limit', 20)), 1), 100)
+    except ValueError:
+        raise BadRequestError("limit must be a number.")
+
+    if search_index.is_stale(user_id):
+        records = invoice_store.records(user_id)
+        search_index.rebuild(user_id, [(r["invoice_id"], document_text(r["extracted"])) for r in records])
+    invoice_ids = search_index.search(user_id, query)
+    if not invoice_ids:
+        return {"query": query, "total": 0, "results": [], "next_cursor": None}
+    try:
+        records, next_cursor = invoice_store.list_page(
+            user_id, limit=limit, cursor=params.get('cursor'), filters={'invoice_ids': invoice_ids}
+        )
+    except ValueError as e:
+        raise BadRequestError(str(e))
+
+    return {
+        "query": query,
+        "total": len(invoice_ids),
+        "results": [
+            {**summarize(record), "matches": matching_lines((record.get("extracted") or {}).get("Text"), query)}
+            for record in records
+        ],
+        "next_cursor": next_cursor
     }
 
+
+# The path the dashboard calls
+@app.route('/search-invoices', methods=['GET'], cors=True)
+def search_invoices_legacy():
+    return search_invoices()
+
+
+# Re-index every stored invoice of the user
+@app.route('/search/rebuild', methods=['POST'], cors=True)
+def rebuild_search_index():
+    user_id = get_authenticated_user_id()
+    records = invoice_store.records(user_id)
+    shards = search_index.rebuild(user_id, [(r["invoice_id"], document_text(r["extracted"])) for r in records])
+    return {"user_id": user_id, "indexed": len(records), "shards": shards}
+
+
 @app.route('/reanalyze/{file_name}', methods=['POST'], cors=True)
 def reanalyze_file(file_name):
     user_id = get_authenticated_user_id()
@@ -245,8 +741,12 @@ def reanalyze_file(file_name):
     
     if not file_name.startswith(f"uploads/{user_id}/"):
         raise UnauthorizedError("Access denied.")
-    
-    extracted = textract_service.analyze_document(file_name)
+
+    # The only path that skips the extraction cache; it refreshes it instead
+    extracted, pending_job = analyze_or_start_job(user_id, file_name, 'reanalyze', use_cache=False)
+    if pending_job:
+        return pending_job
+    invoice_store.update_extracted(user_id, file_name, extracted)
 
     return {
         'fileName': file_name,
@@ -254,30 +754,75 @@ def reanalyze_file(file_name):
         'status': 'reanalyzed'
     }
 
+# Totals by vendor, upload month and upcoming due date from the user's
+# materialized spending summary, built from the invoice index on first use
+@app.route('/spending-summary', methods=['GET'], cors=True)
+def get_spending_summary():
+    user_id = get_authenticated_user_id()
+
+    doc = spending_summary.load(user_id)
+    if doc is None:
+        doc = spending_summary.rebuild(user_id, lambda: invoice_store.summaries(user_id))
+    return {"user_id": user_id, **spending_summary.report(doc)}
+
+
+# Recompute the index and the spending summary from the invoice records
+@app.route('/spending-summary/rebuild', methods=['POST'], cors=True)
+def rebuild_spending_summary():
+    user_id = get_authenticated_user_id()
+
+    invoice_store.rebuild_index(user_id)
+    doc = spending_summary.rebuild(user_id, lambda: invoice_store.summaries(user_id))
+    return {"user_id": user_id, **spending_summary.report(doc)}
+
+
 @app.route('/latest-invoice', methods=['GET'], cors=True)
 def latest_invoice():
     user_id = get_authenticated_user_id()
-    prefix = f'uploads/{user_id}/'
-    
-    response = s3.list_objects_v2(Bucket=BUCKET_NAME, Prefix=prefix)
-    files = sorted(
-        [obj for obj in response.get('Contents', []) if not obj['Key'].endswith('data.json')],
-        key=lambda x: x['LastModified'],
-        reverse=True
-    )
 
-    if not files:
+    record = invoice_store.latest(user_id)
+    if record is None:
+        record = find_latest_upload(user_id)
+    if record is None:
         return {'message': 'No invoices uploaded yet.'}
-    
-    latest_file = files[0]['Key']
-    extracted_data = textract_service.analyze_document(latest_file)
-    
+
+    if record.get('extracted') is None:
+        extracted_data, pending_job = analyze_or_start_job(user_id, record['file_name'], 'extract')
+        if pending_job:
+            return pending_job
+        record['extracted'] = extracted_data
+
     return {
-        'fileName': latest_file,
-        'extractedData': extracted_data
+        'fileName': record['file_name'],
+        'extractedData': record['extracted']
     }
 
 
+# Fallback for users without a latest pointer: walk every page of the
+# user's top-level uploads (skipping the .json metadata objects) and pick the
+# newest document. Returns its stored record, or a bare record if it was
+# never saved.
+def find_latest_upload(user_id):
+    prefix = f'uploads/{user_id}/'
+
+    latest = None
+    for page in storage_service.list_pages(prefix, delimiter='/'):
+        for obj in page['objects']:
+            if obj['key'].endswith('.json'):
+                continue
+            if latest is None or obj['last_modified'] > latest['last_modified']:
+                latest = obj
+
+    if latest is None:
+        return None
+
+    record = invoice_store.get(user_id, invoice_id_for(latest['key']))
+    if record is None:
+        return {'file_name': latest['key'], 'extracted': None}
+    invoice_store.update_latest(user_id, record)
+    return record
+
+
 # Reminders
 @app.route('/create-reminder', methods=['POST'], cors=True)
 def create_reminder():
@@ -287,30 +832,26 @@ def create_reminder():
     if not file_name:
         raise BadRequestError("Missing file_name.")
 
+    # Schedule from the invoice's due date when we have one, else the
+    # one the client sent, else a day from now
+    due_date, vendor = body.get("due_date"), None
+    invoice = invoice_store.get(user_id, invoice_id_for(file_name))
+    if invoice:
+        extracted = invoice.get("extracted") or {}
+        due_date, vendor = extracted.get("DueDate") or due_date, extracted.get("Vendor")
+
     reminder_key = f"uploads/{user_id}/reminders.json"
+    reminder, reminder_time = build_reminder(file_name, due_date, vendor=vendor)
 
-    try:
-        obj = s3.get_object(Bucket=BUCKET_NAME, Key=reminder_key)
-        reminders = json.loads(obj['Body'].read())
-    except s3.exceptions.NoSuchKey:
-        reminders = []
+    def append_reminder(reminders):
+        if any(r["file_name"] == file_name for r in reminders):
+            return False
+        reminders.append(reminder)
 
-    if any(reminder["file_name"] == file_name for reminder in reminders):
+    reminders = storage_service.update_json(reminder_key, append_reminder, default=list)
+    if reminder not in reminders:
         return {"message": "Reminder already exists for this file."}
-
-    now = datetime.now(timezone.utc)
-    reminders.append({
-        "file_name": file_name,
-        "created_at": now.isoformat(),
-        "reminder_time": (now + timedelta(hours=24)).isoformat() + "Z"
-    })
-
-    s3.put_object(
-        Bucket=BUCKET_NAME,
-        Key=reminder_key,
-        Body=json.dumps(reminders).encode('utf-8'),
-        ContentType='application/json'
-    )
+    reminder_due_index.mark(user_id, reminder_time)
 
     return {"message": "Reminder created."}
 
@@ -319,13 +860,7 @@ def get_reminders():
     user_id = get_authenticated_user_id()
     reminder_key = f"uploads/{user_id}/reminders.json"
 
-    try:
-        obj = s3.get_object(Bucket=BUCKET_NAME, Key=reminder_key)
-        reminders = json.loads(obj['Body'].read())
-    except s3.exceptions.NoSuchKey:
-        reminders = []
-
-    return {"reminders": reminders}
+    return {"reminders": storage_service.get_json(reminder_key, [])}
 
 @app.route('/delete-reminder', methods=['POST'], cors=True)
 def delete_reminder():
@@ -334,21 +869,17 @@ def delete_reminder():
     file_name = body.get("file_name")
 
     reminder_key = f"uploads/{user_id}/reminders.json"
+    found = []
 
-    try:
-        obj = s3.get_object(Bucket=BUCKET_NAME, Key=reminder_key)
-        reminders = json.loads(obj['Body'].read())
-    except s3.exceptions.NoSuchKey:
-        return {"error": "No reminders found."}
-
-    updated = [r for r in reminders if r["file_name"] != file_name]
+    def remove_reminder(reminders):
+        found[:] = [bool(reminders)]
+        before = len(reminders)
+        reminders[:] = [r for r in reminders if r["file_name"] != file_name]
+        return len(reminders) != before
 
-    s3.put_object(
-        Bucket=BUCKET_NAME,
-        Key=reminder_key,
-        Body=json.dumps(updated).encode('utf-8'),
-        ContentType='application/json'
-    )
+    storage_service.update_json(reminder_key, remove_reminder, default=list)
+    if not found[0]:
+        return {"error": "No reminders found."}
 
     return {"message": "Reminder deleted."}
 
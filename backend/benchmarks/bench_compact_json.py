@@ -0,0 +1,89 @@
+# Benchmark for the compact JSON encoding of stored documents.
+#
+#   python benchmarks/bench_compact_json.py
+#
+# Builds the per-user documents at 100, 1k and 10k invoices: a legacy
+# data.json (full records with the extracted fields and text, from the
+# synthetic Textract responses in benchmarks/corpus), reminders.json and the
+# invoice index entries. For each it reports the size as plain JSON (how
+# they were written before) and in the compact encoding, and the time to
+# encode and to parse both forms.
+import glob
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chalicelib import compact_json  # noqa: E402
+from chalicelib.invoice_store import summarize  # noqa: E402
+from chalicelib.reminders import build_reminder  # noqa: E402
+from chalicelib.textract_service import extract_fields  # noqa: E402
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
+
+
+def load_extractions():
+    extractions = []
+    for path in sorted(glob.glob(os.path.join(CORPUS_DIR, '*.json'))):
+        with open(path, encoding='utf-8') as f:
+            extractions.append(extract_fields(json.load(f)['Blocks']))
+    return extractions
+
+
+def make_documents(size, extractions):
+    now = datetime.now(timezone.utc)
+    records = []
+    reminders = []
+    for i in range(size):
+        invoice_id = str(uuid.uuid4())
+        file_name = f"uploads/bench-user/{invoice_id}.jpg"
+        extracted = extractions[i % len(extractions)]
+        records.append({
+            "invoice_id": invoice_id,
+            "file_name": file_name,
+            "extracted": extracted,
+            "created_at": (now - timedelta(hours=i)).isoformat(),
+            "reminders_enabled": True
+        })
+        reminders.append(build_reminder(file_name, extracted.get("DueDate"), vendor=extracted.get("Vendor"),
+                                        now=now)[0])
+    return {
+        'data.json': records,
+        'reminders.json': reminders,
+        'index entries': [summarize(r) for r in records],
+    }
+
+
+def best_ms(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def main():
+    extractions = load_extractions()
+    print(f"{'document':>15} {'invoices':>8} {'plain KB':>9} {'compact KB':>11} {'ratio':>6} "
+          f"{'encode ms':>10} {'parse plain':>12} {'parse compact':>14}")
+    for size, repeat in ((100, 20), (1_000, 10), (10_000, 3)):
+        for name, doc in make_documents(size, extractions).items():
+            # How put_json wrote documents before
+            plain = json.dumps(doc).encode('utf-8')
+            compact, encoding = compact_json.encode(doc)
+            assert encoding == compact_json.CONTENT_ENCODING and compact_json.decode(compact) == doc
+
+            encode_ms = best_ms(lambda: compact_json.encode(doc), repeat)
+            parse_plain = best_ms(lambda: compact_json.decode(plain), repeat)
+            parse_compact = best_ms(lambda: compact_json.decode(compact), repeat)
+            print(f"{name:>15} {size:>8} {len(plain) / 1024:>9.1f} {len(compact) / 1024:>11.1f} "
+                  f"{len(plain) / len(compact):>6.1f} {encode_ms:>10.2f} {parse_plain:>12.2f} {parse_compact:>14.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+# Benchmark for the invoice field extraction engine.
+#
+#   python benchmarks/bench_field_extraction.py
+#
+# Loads the synthetic Textract AnalyzeDocument responses in benchmarks/corpus
+# (hand-built in Textract's response format, not captured from the service),
+# prints what each one extracts to, then times extraction over batches of
+# 100, 1k and 10k documents (the corpus repeated), one document at a time and
+# through extract_batch(). Block parsing is done up front so only the field
+# mapping is measured.
+import glob
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chalicelib.field_extraction import FieldExtractor  # noqa: E402
+from chalicelib.textract_service import parse_blocks  # noqa: E402
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
+
+
+def load_corpus():
+    documents = {}
+    for path in sorted(glob.glob(os.path.join(CORPUS_DIR, '*.json'))):
+        with open(path, encoding='utf-8') as f:
+            documents[os.path.basename(path)] = json.load(f)['Blocks']
+    return documents
+
+
+def best_of(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def extract_one_by_one(documents):
+    extractor = FieldExtractor()
+    return [extractor.extract(document) for document in documents]
+
+
+def main():
+    corpus = load_corpus()
+    parsed = [parse_blocks(blocks) for blocks in corpus.values()]
+
+    for name, extracted in zip(corpus, FieldExtractor().extract_batch(parsed)):
+        fields = {k: v for k, v in extracted.items() if k != 'Text'}
+        print(f"{name}: {json.dumps(fields, ensure_ascii=False)}")
+    print()
+
+    print(f"{'docs':>7} {'single (ms)':>12} {'batch (ms)':>11} {'us/doc':>8}")
+    for size, repeat in ((100, 20), (1_000, 10), (10_000, 3)):
+        documents = [parsed[i % len(parsed)] for i in range(size)]
+        # Fresh extractors so the label memo starts cold in every timing
+        single = best_of(lambda: extract_one_by_one(documents), repeat)
+        batch = best_of(lambda: FieldExtractor().extract_batch(documents), repeat)
+        print(f"{size:>7} {single * 1000:>12.2f} {batch * 1000:>11.2f} {batch * 1e6 / size:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+# Benchmark for upload image pre-processing.
+#
+#   python benchmarks/bench_image_preprocessing.py [mbps]
+#
+# Renders synthetic phone photos of an invoice page (12, 8 and 3 megapixels,
+# saved as high-quality JPEG like a phone camera would) and, for each, times
+# storing the upload as sent against detecting the format, optimizing and
+# storing both the original and the optimized copy, using the local storage
+# backend in a temp dir. It also reports the bytes Textract has to read and
+# how long moving them takes at `mbps` (default 50). Needs Pillow.
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw, ImageFilter  # noqa: E402
+
+from chalicelib import image_processing  # noqa: E402
+from chalicelib.storage_service import LocalBackend, StorageService  # noqa: E402
+
+SIZES = [(4032, 3024), (3264, 2448), (2048, 1536)]
+RUNS = 5
+
+LINES = [
+    "ACME Hydro Services", "Invoice Number: INV-2024-00917", "Invoice Date: March 3, 2024",
+    "Due Date: April 2, 2024", "Account: 4471-2290-118", "Electricity 812 kWh   $143.22",
+    "Delivery charge   $38.10", "Regulatory charge   $4.87", "HST 13%   $24.14",
+    "Total Amount Due   $210.33",
+]
+
+
+def make_photo(width, height):
+    # Off-white paper on a darker desk, slightly blurred text, sensor noise
+    image = Image.new('RGB', (width, height), (92, 78, 64))
+    draw = ImageDraw.Draw(image)
+    margin = width // 10
+    draw.rectangle([margin, height // 20, width - margin, height - height // 20], fill=(236, 232, 222))
+    step = height // 24
+    for row in range(18):
+        text = LINES[row % len(LINES)]
+        draw.text((margin * 1.5, height // 10 + row * step), text, fill=(30, 30, 36))
+    image = image.filter(ImageFilter.GaussianBlur(1))
+    noise = Image.effect_noise((width, height), 24).convert('RGB')
+    image = Image.blend(image, noise, 0.08)
+    out = io.BytesIO()
+    image.save(out, 'JPEG', quality=95)
+    return out.getvalue()
+
+
+def store_as_sent(storage, data):
+    storage.put_bytes('uploads/bench/doc.jpg', data, content_type='image/jpg')
+    return data
+
+
+def store_optimized(storage, data):
+    file_ext = image_processing.detect_format(data)
+    optimized = image_processing.optimize(data, file_ext)
+    if optimized is None:
+        return store_as_sent(storage, data)
+    body, _ = optimized
+    storage.put_bytes('originals/bench/doc.jpg', data, content_type='image/jpg')
+    storage.put_bytes('uploads/bench/doc.jpg', body, content_type='image/jpg')
+    return body
+
+
+def time_store(store, storage, data):
+    samples = []
+    for _ in range(RUNS):
+        started = time.perf_counter()
+        analyzed = store(storage, data)
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples), len(analyzed)
+
+
+def main():
+    mbps = float(sys.argv[1]) if len(sys.argv) > 1 else 50.0
+    transfer_ms = lambda size: size * 8 / (mbps * 1e6) * 1000  # noqa: E731
+
+    print(f"{'photo':>10} {'mode':>9} {'store (ms)':>11} {'to Textract':>12} "
+          f"{f'@{mbps:g} Mbps (ms)':>17} {'total (ms)':>11}")
+    with tempfile.TemporaryDirectory() as root:
+        storage = StorageService('bench', backend=LocalBackend(os.path.join(root, 'bench')))
+        for width, height in SIZES:
+            data = make_photo(width, height)
+            label = f"{width * height / 1e6:.0f} MP"
+            for mode, store in (('as sent', store_as_sent), ('optimized', store_optimized)):
+                store_ms, analyzed_bytes = time_store(store, storage, data)
+                read_ms = transfer_ms(analyzed_bytes)
+                print(f"{label:>10} {mode:>9} {store_ms:>11.1f} {analyzed_bytes / 1e6:>9.2f} MB "
+                      f"{read_ms:>17.1f} {store_ms + read_ms:>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
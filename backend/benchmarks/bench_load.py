@@ -0,0 +1,424 @@
+# Offline load and latency benchmark for the Chalice app and the reminder
+# Lambda.
+#
+#   python benchmarks/bench_load.py [--users 20] [--history 100] [--concurrency 4]
+#       [--requests 400] [--doc-kb 256] [--s3-ms 8] [--textract-ms 400]
+#       [--cognito-ms 20] [--ses-ms 30] [--due-fraction 0.5] [--json out.json]
+#
+# Seeds `users` accounts with `history` invoices each (built from the
+# synthetic Textract responses in benchmarks/corpus) and reminders that are
+# due for a fraction of them, all in the local storage backend. Then
+# `concurrency` worker processes, each one app instance like a Lambda
+# container with its own share of the users, drive a mix of uploads,
+# listings, search, spending and reminder routes through chalice.test.Client.
+# Finally the reminder Lambda's check_reminders runs once over the same data.
+#
+# S3 is the local backend, Textract replays the corpus, Cognito and SES are
+# in-memory stand-ins and tokens are signed locally against a preloaded JWKS,
+# so nothing touches AWS. Every stand-in sleeps for its configured latency
+# per call. The report has throughput and p50/p95/p99 per route and per
+# downstream call; --json saves it for comparing runs. The backend
+# requirements (chalice, boto3, PyJWT, cryptography) must be installed.
+import argparse
+import base64
+import glob
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+import types
+import uuid
+from datetime import datetime, timedelta, timezone
+from urllib.parse import quote
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
+sys.path.insert(0, BACKEND_DIR)
+
+# Read at import by the app; inherited by the worker processes
+os.environ.setdefault('TELEMETRY_ENABLED', '0')
+os.environ.setdefault('IMAGE_PREPROCESSING', '0')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+BUCKET_NAME = 'contentcen301247017.aws.ai'
+
+VENDORS = [
+    "Northern Hydro Electric", "Maple Mobile", "Bright Path Consulting", "Rheinwerk Bürobedarf",
+    "City Water Services", "Summit Office Supply", "Harbour Freight Lines", "Evergreen Landscaping",
+    "Atlas Cloud Hosting", "Pioneer Insurance", "Lakeside Property Management", "Orbit Telecom",
+]
+SEARCH_QUERIES = ["hydro", "maple mobile", "consult*", "total", "inv*", "water", "gmbh", "statement"]
+
+# (route, weight)
+ROUTE_MIX = [
+    ('POST /upload-image', 2),
+    ('POST /upload-batch', 1),
+    ('GET /my-invoices', 4),
+    ('GET /latest-invoice', 2),
+    ('GET /get-reminders', 2),
+    ('POST /create-reminder', 1),
+    ('GET /search-invoices', 2),
+    ('GET /spending-summary', 2),
+]
+BATCH_ITEMS = 5
+WARMUP_REQUESTS = 2
+
+
+def load_corpus():
+    corpus = []
+    for path in sorted(glob.glob(os.path.join(CORPUS_DIR, '*.json'))):
+        with open(path, encoding='utf-8') as f:
+            corpus.append(json.load(f)['Blocks'])
+    return corpus
+
+
+def percentile(ordered, p):
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+# Stand-ins
+
+# Wraps a stand-in (or the storage backend) so every public method call
+# sleeps for `latency_ms` and is timed into `calls` as "{service}.{method}".
+# Generators (paged listings) pay the latency and are timed per page.
+class Timed:
+    def __init__(self, target, service, latency_ms, calls):
+        self._target = target
+        self._service = service
+        self._latency = latency_ms / 1000
+        self._calls = calls
+
+    def _record(self, name, started):
+        self._calls.setdefault(f"{self._service}.{name}", []).append((time.perf_counter() - started) * 1000)
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            started = time.perf_counter()
+            time.sleep(self._latency)
+            try:
+                result = attr(*args, **kwargs)
+            finally:
+                self._record(name, started)
+            if isinstance(result, types.GeneratorType):
+                return self._pages(name, result)
+            return result
+        return call
+
+    def _pages(self, name, pages):
+        while True:
+            started = time.perf_counter()
+            time.sleep(self._latency)
+            try:
+                page = next(pages)
+            except StopIteration:
+                return
+            finally:
+                self._record(name, started)
+            yield page
+
+
+# Answers AnalyzeDocument (and the async job API) with a synthetic corpus response
+class ReplayTextract:
+    def __init__(self, corpus, seed=0):
+        self.corpus = corpus
+        self.random = random.Random(seed)
+        self.jobs = {}
+
+    def analyze_document(self, **kwargs):
+        return {'Blocks': self.random.choice(self.corpus)}
+
+    def start_document_analysis(self, **kwargs):
+        job_id = uuid.uuid4().hex
+        self.jobs[job_id] = self.random.choice(self.corpus)
+        return {'JobId': job_id}
+
+    def get_document_analysis(self, JobId, **kwargs):
+        return {'JobStatus': 'SUCCEEDED', 'Blocks': self.jobs[JobId]}
+
+
+class StubCognito:
+    def admin_get_user(self, UserPoolId, Username):
+        return {'Username': Username, 'UserAttributes': [{'Name': 'email', 'Value': f"{Username}@example.com"}]}
+
+
+class StubSes:
+    def send_email(self, **kwargs):
+        return {'MessageId': uuid.uuid4().hex}
+
+
+class LambdaContext:
+    def get_remaining_time_in_millis(self):
+        return 900000
+
+
+# Seeding
+
+def make_tokens(user_ids):
+    import jwt
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from chalicelib.token_utils import COGNITO_ISSUER
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(key.public_key()))
+    jwk.update({'kid': 'bench', 'alg': 'RS256', 'use': 'sig'})
+    expires = int(time.time()) + 6 * 3600
+    tokens = {
+        user_id: jwt.encode(
+            {'sub': user_id, 'token_use': 'access', 'iss': COGNITO_ISSUER, 'exp': expires},
+            key, algorithm='RS256', headers={'kid': 'bench'}
+        )
+        for user_id in user_ids
+    }
+    return tokens, json.dumps({'keys': [jwk]})
+
+
+def seed(user_ids, history, due_fraction, corpus, rng):
+    from chalicelib.invoice_store import InvoiceStore
+    from chalicelib.reminder_index import ReminderDueIndex
+    from chalicelib.reminders import build_reminder
+    from chalicelib.search_index import SearchIndex
+    from chalicelib.spending_summary import SpendingSummary
+    from chalicelib.storage_service import StorageService
+    from chalicelib.textract_service import extract_fields
+
+    storage = StorageService(BUCKET_NAME)
+    spending = SpendingSummary(storage)
+    invoice_store = InvoiceStore(storage, spending=spending, search=SearchIndex(storage))
+    due_index = ReminderDueIndex(storage)
+    templates = [extract_fields(blocks) for blocks in corpus]
+    now = datetime.now(timezone.utc)
+
+    for user_id in user_ids:
+        by_month = {}
+        for _ in range(history):
+            extracted = dict(rng.choice(templates))
+            vendor = rng.choice(VENDORS)
+            extracted['Vendor'] = vendor
+            extracted['Amount'] = f"{rng.uniform(20, 2500):.2f}"
+            extracted['DueDate'] = (now + timedelta(days=rng.randint(-60, 45))).date().isoformat()
+            extracted['Text'] = vendor + "\n" + extracted.get('Text', '')
+            created = now - timedelta(days=rng.randint(0, 730))
+            file_name = f"uploads/{user_id}/{uuid.uuid4()}.jpg"
+            by_month.setdefault(created.strftime('%Y-%m-15T12:00:00+00:00'), []).append((file_name, extracted))
+        for created_at, items in sorted(by_month.items()):
+            invoice_store.add_many(user_id, items, created_at=created_at)
+        spending.rebuild(user_id, lambda: invoice_store.summaries(user_id))
+
+        if rng.random() < due_fraction:
+            reminders = []
+            for _ in range(rng.randint(1, 3)):
+                reminder, reminder_time = build_reminder(
+                    f"uploads/{user_id}/{uuid.uuid4()}.jpg", now=now - timedelta(days=2)
+                )
+                reminders.append(reminder)
+                due_index.mark(user_id, reminder_time)
+            storage.put_json(f"uploads/{user_id}/reminders.json", reminders)
+
+
+# Load phase, one process per worker
+
+def run_worker(job):
+    import io
+    import contextlib
+    # Keep the app's logging out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app
+    from chalice.test import Client
+
+    rng = random.Random(job['seed'])
+    calls = {}
+    app.storage_service.backend = Timed(app.storage_service.backend, 's3', job['s3_ms'], calls)
+    app.textract_service.client = Timed(ReplayTextract(load_corpus(), job['seed']), 'textract',
+                                        job['textract_ms'], calls)
+
+    routes, weights = zip(*ROUTE_MIX)
+    users = job['users']
+    tokens = job['tokens']
+    doc_bytes = job['doc_kb'] * 1024
+    uploaded = {}
+    timings = {}
+    errors = {}
+
+    def document():
+        return base64.b64encode(b'\xff\xd8\xff\xe0' + os.urandom(doc_bytes - 4)).decode('ascii')
+
+    def request(client, route, user_id):
+        headers = {'Authorization': f"Bearer {tokens[user_id]}", 'Content-Type': 'application/json'}
+        method, path = route.split(' ', 1)
+        body = None
+        if route == 'POST /upload-image':
+            body = {'image': document(), 'extension': 'jpg'}
+        elif route == 'POST /upload-batch':
+            body = {'items': [{'image': document(), 'extension': 'jpg'} for _ in range(BATCH_ITEMS)]}
+        elif route == 'GET /my-invoices':
+            path += '?limit=50'
+        elif route == 'GET /search-invoices':
+            path += '?q=' + quote(rng.choice(SEARCH_QUERIES))
+        elif route == 'POST /create-reminder':
+            file_name = rng.choice(uploaded.get(user_id) or [f"uploads/{user_id}/{uuid.uuid4()}.jpg"])
+            body = {'file_name': file_name}
+
+        response = client.http.request(
+            method, path, headers=headers, body=json.dumps(body).encode('utf-8') if body else b''
+        )
+        if route == 'POST /upload-image' and response.status_code == 200:
+            uploaded.setdefault(user_id, []).append(json.loads(response.body)['file_name'])
+        return response.status_code
+
+    with Client(app.app) as client, contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(WARMUP_REQUESTS):
+            request(client, 'GET /my-invoices', rng.choice(users))
+        started = time.time()
+        for _ in range(job['requests']):
+            route = rng.choices(routes, weights)[0]
+            request_started = time.perf_counter()
+            status = request(client, route, rng.choice(users))
+            timings.setdefault(route, []).append((time.perf_counter() - request_started) * 1000)
+            if status >= 400:
+                errors[route] = errors.get(route, 0) + 1
+        finished = time.time()
+
+    return {'routes': timings, 'calls': calls, 'errors': errors, 'started': started, 'finished': finished}
+
+
+def run_reminder_lambda(args):
+    import io
+    import contextlib
+    from chalicelib import lambda_function
+
+    calls = {}
+    lambda_function.storage_service.backend = Timed(lambda_function.storage_service.backend, 's3',
+                                                    args.s3_ms, calls)
+    lambda_function.dispatcher.ses = Timed(StubSes(), 'ses', args.ses_ms, calls)
+    lambda_function.email_directory.cognito = Timed(StubCognito(), 'cognito', args.cognito_ms, calls)
+
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        summary = lambda_function.check_reminders({}, LambdaContext())
+    return (time.perf_counter() - started) * 1000, summary, calls
+
+
+# Report
+
+def stats(samples):
+    ordered = sorted(samples)
+    return {
+        'count': len(ordered),
+        'p50': percentile(ordered, 50),
+        'p95': percentile(ordered, 95),
+        'p99': percentile(ordered, 99),
+        'max': ordered[-1] if ordered else 0.0,
+    }
+
+
+# `rows` are (name, stats); routes also carry an error count
+def print_table(title, rows, wall=None):
+    print(title)
+    print(f"{'':<28} {'count':>6} {'errors':>6} {'per s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for name, s in rows:
+        rate = f"{s['count'] / wall:>7.1f}" if wall else f"{'-':>7}"
+        errors = s.get('errors', '-')
+        print(f"{name:<28} {s['count']:>6} {errors:>6} {rate} "
+              f"{s['p50']:>8.1f} {s['p95']:>8.1f} {s['p99']:>8.1f} {s['max']:>8.1f}")
+    print()
+
+
+def merge(results, key):
+    merged = {}
+    for result in results:
+        for name, samples in result[key].items():
+            merged.setdefault(name, []).extend(samples)
+    return merged
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--history', type=int, default=100, help="invoices per user before the run")
+    parser.add_argument('--concurrency', type=int, default=4, help="worker processes (app instances)")
+    parser.add_argument('--requests', type=int, default=400, help="measured requests in total")
+    parser.add_argument('--doc-kb', type=int, default=256, help="size of each uploaded document")
+    parser.add_argument('--s3-ms', type=float, default=8)
+    parser.add_argument('--textract-ms', type=float, default=400)
+    parser.add_argument('--cognito-ms', type=float, default=20)
+    parser.add_argument('--ses-ms', type=float, default=30)
+    parser.add_argument('--due-fraction', type=float, default=0.5, help="users with reminders due")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help="also write the report to this file")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    corpus = load_corpus()
+    user_ids = [f"bench-user-{i:04d}" for i in range(args.users)]
+    concurrency = max(1, min(args.concurrency, args.users))
+
+    with tempfile.TemporaryDirectory() as storage_dir:
+        tokens, jwks = make_tokens(user_ids)
+        os.environ.update(STORAGE_BACKEND='local', LOCAL_STORAGE_DIR=storage_dir, COGNITO_JWKS_JSON=jwks)
+
+        seed_started = time.perf_counter()
+        seed(user_ids, args.history, args.due_fraction, corpus, rng)
+        print(f"Seeded {args.users} users x {args.history} invoices in {time.perf_counter() - seed_started:.1f}s\n")
+
+        # Each worker owns its users, like requests for one user landing on
+        # whichever container is free but never two writers on one process's
+        # storage lock
+        jobs = [
+            {
+                'users': user_ids[i::concurrency],
+                'tokens': tokens,
+                'requests': args.requests // concurrency,
+                'doc_kb': args.doc_kb,
+                's3_ms': args.s3_ms,
+                'textract_ms': args.textract_ms,
+                'seed': args.seed * 1000 + i,
+            }
+            for i in range(concurrency)
+        ]
+        with multiprocessing.get_context('spawn').Pool(concurrency) as pool:
+            results = pool.map(run_worker, jobs)
+
+        wall = max(r['finished'] for r in results) - min(r['started'] for r in results)
+        route_stats = {}
+        for route, samples in merge(results, 'routes').items():
+            route_stats[route] = stats(samples)
+            route_stats[route]['errors'] = sum(r['errors'].get(route, 0) for r in results)
+        total = sum(s['count'] for s in route_stats.values())
+        call_stats = {name: stats(samples) for name, samples in merge(results, 'calls').items()}
+
+        print(f"Load: {total} requests from {concurrency} workers in {wall:.1f}s "
+              f"({total / wall:.1f} req/s)\n")
+        print_table("Routes", sorted(route_stats.items()), wall)
+        print_table("Downstream calls (load)", sorted(call_stats.items()), wall)
+
+        lambda_ms, summary, lambda_calls = run_reminder_lambda(args)
+        lambda_call_stats = {name: stats(samples) for name, samples in lambda_calls.items()}
+        print(f"check_reminders: {lambda_ms:.0f} ms, {summary['users_scanned']} users scanned, "
+              f"{summary['emails_sent']} emails, {summary['reminders_sent']} reminders sent\n")
+        print_table("Downstream calls (check_reminders)", sorted(lambda_call_stats.items()))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'args': vars(args),
+                'throughput': total / wall,
+                'routes': route_stats,
+                'calls': call_stats,
+                'check_reminders': {'ms': lambda_ms, 'summary': summary, 'calls': lambda_call_stats},
+            }, f, indent=2, default=str)
+
+
+if __name__ == '__main__':
+    main()
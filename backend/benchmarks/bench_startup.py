@@ -0,0 +1,95 @@
+# Cold-start benchmark for the Chalice app.
+#
+#   python benchmarks/bench_startup.py [runs]
+#
+# Each run starts a fresh interpreter (like a new Lambda container) and
+# times importing app.py, creating the first AWS client, the first request
+# and a warm request. Requests go through chalice.test.Client against the
+# local storage backend with a locally signed token and a preloaded JWKS, so
+# no AWS account or network is needed; the backend requirements (chalice,
+# boto3, PyJWT, cryptography) must be installed.
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = r"""
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+
+from chalice.test import Client
+from chalicelib.aws_clients import get_client
+headers = {'Authorization': 'Bearer ' + sys.argv[1]}
+with Client(app.app) as client:
+    first_started = time.perf_counter()
+    response = client.http.get('/get-reminders', headers=headers)
+    first_done = time.perf_counter()
+    assert response.status_code == 200, response.body
+    client.http.get('/get-reminders', headers=headers)
+    warm_done = time.perf_counter()
+
+client_started = time.perf_counter()
+get_client('s3')
+client_done = time.perf_counter()
+
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'first_request_ms': (first_done - first_started) * 1000,
+    'warm_request_ms': (warm_done - first_done) * 1000,
+    's3_client_ms': (client_done - client_started) * 1000,
+}))
+"""
+
+
+def make_token():
+    import jwt
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    sys.path.insert(0, BACKEND_DIR)
+    from chalicelib.token_utils import COGNITO_ISSUER
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(key.public_key()))
+    jwk.update({'kid': 'bench', 'alg': 'RS256', 'use': 'sig'})
+    token = jwt.encode(
+        {'sub': 'bench-user', 'token_use': 'access', 'iss': COGNITO_ISSUER, 'exp': int(time.time()) + 3600},
+        key, algorithm='RS256', headers={'kid': 'bench'}
+    )
+    return token, json.dumps({'keys': [jwk]})
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    token, jwks = make_token()
+    samples = []
+    with tempfile.TemporaryDirectory() as storage_dir:
+        env = dict(
+            os.environ,
+            STORAGE_BACKEND='local',
+            LOCAL_STORAGE_DIR=storage_dir,
+            COGNITO_JWKS_JSON=jwks,
+            AWS_ACCESS_KEY_ID='bench',
+            AWS_SECRET_ACCESS_KEY='bench',
+            AWS_DEFAULT_REGION='us-east-1',
+        )
+        for _ in range(runs):
+            output = subprocess.run(
+                [sys.executable, '-c', CHILD, token],
+                cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True
+            ).stdout
+            samples.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"{'phase':>18} {'median (ms)':>12} {'max (ms)':>9}")
+    for phase in ('import_ms', 'first_request_ms', 'warm_request_ms', 's3_client_ms'):
+        values = [s[phase] for s in samples]
+        print(f"{phase[:-3]:>18} {statistics.median(values):>12.1f} {max(values):>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
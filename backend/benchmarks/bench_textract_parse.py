@@ -0,0 +1,66 @@
+# Micro-benchmark for the Textract block parser.
+#
+#   python benchmarks/bench_textract_parse.py
+#
+# Builds synthetic Textract responses of 1k, 10k and 100k blocks and times
+# extract_fields() on each. The per-block cost should stay flat as the
+# response grows.
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chalicelib.textract_service import extract_fields  # noqa: E402
+
+KEY_LABELS = ["Vendor", "Invoice Number", "Due Date", "Total Amount", "PO Number"]
+
+
+def make_blocks(target_size):
+    # Each form field is a KEY block, a VALUE block, two WORDs each and a LINE.
+    blocks = []
+    n = 0
+    while len(blocks) < target_size:
+        key_id, value_id = f"k{n}", f"v{n}"
+        key_words = [f"kw{n}a", f"kw{n}b"]
+        value_words = [f"vw{n}a", f"vw{n}b"]
+        label = KEY_LABELS[n % len(KEY_LABELS)]
+        blocks.append({
+            'Id': key_id, 'BlockType': 'KEY_VALUE_SET', 'EntityTypes': ['KEY'],
+            'Relationships': [
+                {'Type': 'VALUE', 'Ids': [value_id]},
+                {'Type': 'CHILD', 'Ids': key_words},
+            ],
+        })
+        blocks.append({
+            'Id': value_id, 'BlockType': 'KEY_VALUE_SET', 'EntityTypes': ['VALUE'],
+            'Relationships': [{'Type': 'CHILD', 'Ids': value_words}],
+        })
+        blocks.append({'Id': key_words[0], 'BlockType': 'WORD', 'Text': label})
+        blocks.append({'Id': key_words[1], 'BlockType': 'WORD', 'Text': ':'})
+        blocks.append({'Id': value_words[0], 'BlockType': 'WORD', 'Text': f"value{n}"})
+        blocks.append({'Id': value_words[1], 'BlockType': 'WORD', 'Text': "USD"})
+        blocks.append({'Id': f"l{n}", 'BlockType': 'LINE', 'Text': f"{label}: value{n} USD"})
+        n += 1
+    return blocks[:target_size]
+
+
+def time_parse(blocks, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        extract_fields(blocks)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    print(f"{'blocks':>8} {'best (ms)':>10} {'us/block':>9}")
+    for size, repeat in ((1_000, 20), (10_000, 10), (100_000, 3)):
+        blocks = make_blocks(size)
+        elapsed = time_parse(blocks, repeat)
+        print(f"{size:>8} {elapsed * 1000:>10.2f} {elapsed * 1e6 / size:>9.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+import os
+import threading
+from chalicelib import telemetry
+
+# One place that creates boto3 clients. Every client shares a session and a
+# tuned botocore config (bigger connection pool for the thread pools,
+# adaptive retries, short connect timeouts, TCP keep-alive), is created on
+# first use rather than at import, is reused by everything in the process
+# and has telemetry hooks timing each call. boto3 itself is only imported
+# when the first client is built, which keeps it off the import path of
+# cold starts that never touch AWS.
+
+DEFAULT_REGION = os.environ.get('AWS_REGION') or os.environ.get('AWS_DEFAULT_REGION') or 'us-east-1'
+
+# Matches the widest thread pool that issues AWS calls (batch workers,
+# invoice fetches, reminder fan-out) with headroom
+MAX_POOL_CONNECTIONS = int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', '32'))
+MAX_ATTEMPTS = 5
+CONNECT_TIMEOUT = 2
+
+# Read timeouts per service; AnalyzeDocument on a dense page can take a while
+READ_TIMEOUTS = {
+    's3': 15,
+    'textract': 60,
+    'cognito-idp': 5,
+    'ses': 10,
+}
+DEFAULT_READ_TIMEOUT = 15
+
+_session = None
+_clients = {}
+_lock = threading.Lock()
+
+
+def client_config(service):
+    from botocore.config import Config
+    return Config(
+        max_pool_connections=MAX_POOL_CONNECTIONS,
+        retries={'max_attempts': MAX_ATTEMPTS, 'mode': 'adaptive'},
+        connect_timeout=CONNECT_TIMEOUT,
+        read_timeout=READ_TIMEOUTS.get(service, DEFAULT_READ_TIMEOUT),
+        tcp_keepalive=True
+    )
+
+
+# The shared client for `service`, created on first call. boto3 clients are
+# thread-safe; sessions aren't, hence the lock around creation.
+def get_client(service, region=None):
+    key = (service, region or DEFAULT_REGION)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _get_session().client(service, region_name=key[1], config=client_config(service))
+                telemetry.instrument_client(client)
+                _clients[key] = client
+    return client
+
+
+def _get_session():
+    global _session
+    if _session is None:
+        import boto3
+        _session = boto3.session.Session()
+    return _session
+
+
+# Stands in for a client until it is first used, so services can be wired
+# up at import without paying for client creation.
+class LazyClient:
+    def __init__(self, service, region=None):
+        self._service = service
+        self._region = region
+
+    def __getattr__(self, name):
+        return getattr(get_client(self._service, self._region), name)
+
+
+def lazy_client(service, region=None):
+    return LazyClient(service, region)
@@ -0,0 +1,60 @@
+from chalicelib.storage_service import StorageService
+from chalicelib.email_directory import EmailDirectory
+from chalicelib.aws_clients import lazy_client
+
+# Cognito user pool triggers, deployed as their own Lambda and attached to
+# the pool's Pre sign-up and Post confirmation triggers.
+#
+# Pre sign-up confirms the user and marks their email verified inside the
+# sign_up call itself, so signup is a single Cognito round trip instead of
+# sign_up + admin_confirm_sign_up + admin_update_user_attributes. Post
+# confirmation records the new user's sub -> email in the email directory
+# so the reminder job never has to look it up. Signup itself doesn't touch the
+# directory; this trigger is the only writer for new users.
+
+# Constants
+BUCKET_NAME = 'contentcen301247017.aws.ai'
+USER_POOL_ID = 'us-east-1_uQZV1V7mr'
+
+storage_service = StorageService(BUCKET_NAME)
+email_directory = EmailDirectory(
+    storage_service, lazy_client('cognito-idp', region='us-east-1'), USER_POOL_ID
+)
+
+
+def pre_sign_up(event, context):
+    attributes = event['request'].get('userAttributes', {})
+    response = event.setdefault('response', {})
+    response['autoConfirmUser'] = True
+    if attributes.get('email'):
+        response['autoVerifyEmail'] = True
+    return event
+
+
+def post_confirmation(event, context):
+    attributes = event['request'].get('userAttributes', {})
+    user_id = attributes.get('sub')
+    email = attributes.get('email')
+    # A failure here would fail the user's signup, and the directory can
+    # always fall back to Cognito, so just log it
+    if user_id and email:
+        try:
+            email_directory.record(user_id, email)
+            email_directory.save()
+        except Exception as e:
+            print(f"[WARN] Could not record email for {user_id}: {e}")
+    return event
+
+
+TRIGGERS = {
+    'PreSignUp_SignUp': pre_sign_up,
+    'PostConfirmation_ConfirmSignUp': post_confirmation,
+}
+
+
+# Cognito expects the event back, with any response fields set
+def lambda_handler(event, context):
+    handler = TRIGGERS.get(event.get('triggerSource'))
+    if handler is None:
+        return event
+    return handler(event, context)
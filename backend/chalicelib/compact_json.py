@@ -0,0 +1,93 @@
+import gzip
+import json
+import os
+
+# Compact encoding for the JSON documents kept in storage. Documents over
+# MIN_COMPACT_BYTES are written as gzip-compressed JSON (Content-Encoding:
+# gzip) inside a {"$v": FORMAT_VERSION, "$d": ...} envelope, with every list
+# of objects turned into a table: the field names once under "$c" and one
+# array of values per object under "$r". Lists whose objects don't all have
+# the same fields use "$m" instead, where each row starts with a bit mask of
+# the columns it has. Smaller documents stay plain JSON. The objects get 5-16x
+# smaller, but parsing the compact form takes up to about 2x the CPU of plain
+# JSON (data.json at 10k invoices in benchmarks/bench_compact_json.py).
+#
+# decode() reads both, plus the plain JSON written before this existed, so
+# old objects are upgraded the next time they are written. Set
+# COMPACT_JSON=0 to keep writing plain JSON (e.g. while older code that
+# can't read the compact form is still deployed).
+
+FORMAT_VERSION = 1
+ENABLED = os.environ.get('COMPACT_JSON', '1') != '0'
+MIN_COMPACT_BYTES = 1024
+COMPRESS_LEVEL = 3   # most of level 6's ratio at about half the CPU
+CONTENT_ENCODING = 'gzip'
+
+_GZIP_MAGIC = b'\x1f\x8b'
+_ENVELOPE_START = b'{"$v":'
+_SEPARATORS = (',', ':')
+
+
+def _pack(value):
+    if isinstance(value, dict):
+        return {k: _pack(v) for k, v in value.items()}
+    if isinstance(value, list):
+        if len(value) > 1 and all(isinstance(item, dict) for item in value):
+            return _pack_table(value)
+        return [_pack(v) for v in value]
+    return value
+
+
+def _pack_table(items):
+    columns = list(dict.fromkeys(k for item in items for k in item))
+    if all(len(item) == len(columns) for item in items):
+        return {"$c": columns, "$r": [[_pack(item[c]) for c in columns] for item in items]}
+
+    rows = []
+    for item in items:
+        mask, values = 0, []
+        for bit, column in enumerate(columns):
+            if column in item:
+                mask |= 1 << bit
+                values.append(_pack(item[column]))
+        rows.append([mask] + values)
+    return {"$c": columns, "$m": rows}
+
+
+# json object_hook: runs innermost first, so row values are already decoded
+def _unpack_table(obj):
+    if "$c" not in obj or len(obj) != 2:
+        return obj
+    columns = obj["$c"]
+    if "$r" in obj:
+        return [dict(zip(columns, row)) for row in obj["$r"]]
+    if "$m" in obj:
+        items = []
+        for row in obj["$m"]:
+            mask, values = row[0], iter(row[1:])
+            items.append({c: next(values) for bit, c in enumerate(columns) if mask & (1 << bit)})
+        return items
+    return obj
+
+
+# (body, content_encoding) for `doc`; content_encoding is None for plain JSON
+def encode(doc):
+    if ENABLED:
+        packed = json.dumps({"$v": FORMAT_VERSION, "$d": _pack(doc)}, separators=_SEPARATORS).encode('utf-8')
+        if len(packed) >= MIN_COMPACT_BYTES:
+            # mtime=0 keeps the bytes (and so the ETag) a function of the content
+            return gzip.compress(packed, compresslevel=COMPRESS_LEVEL, mtime=0), CONTENT_ENCODING
+    return json.dumps(doc).encode('utf-8'), None
+
+
+# Accepts the envelope compressed or not (an HTTP client may already have
+# undone the Content-Encoding), and plain JSON
+def decode(body):
+    if body.startswith(_GZIP_MAGIC):
+        body = gzip.decompress(body)
+    elif not body.startswith(_ENVELOPE_START):
+        return json.loads(body)
+    envelope = json.loads(body, object_hook=_unpack_table)
+    if envelope.get("$v", 0) > FORMAT_VERSION:
+        raise ValueError(f"Unsupported compact JSON version {envelope['$v']}")
+    return envelope["$d"]
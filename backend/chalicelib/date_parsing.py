@@ -0,0 +1,175 @@
+import re
+import threading
+from collections import OrderedDict
+from datetime import date
+
+# Multi-format date parser for the dates Textract reads off invoices
+# ("2025-03-05", "March 5, 2025", "05/03/2025", "5. März 2025", ...). Month
+# names are English, French and German.
+#
+# Each shape is one precompiled regex; strptime is far too slow to try format
+# by format. The only real ambiguity is numeric day/month order, which is
+# settled by, in order: an explicit hint, what was last detected for the same
+# vendor, a hint derived from the locale or currency, and finally the parser
+# default (month first). Whenever a date is unambiguous (a part above 12) the
+# order it reveals is remembered for that vendor, and so is the shape that
+# matched, which is tried first next time.
+
+_MONTHS = {name: number for number, names in enumerate((
+    ('jan', 'january', 'janv', 'janvier', 'januar', 'jän', 'jänner'),
+    ('feb', 'february', 'fev', 'fevr', 'février', 'févr', 'februar'),
+    ('mar', 'march', 'mars', 'märz', 'maerz', 'mär', 'mrz'), ('apr', 'april', 'avr', 'avril'), ('may', 'mai'),
+    ('jun', 'june', 'juin', 'juni'), ('jul', 'july', 'juil', 'juillet', 'juli'),
+    ('aug', 'august', 'août', 'aout'), ('sep', 'sept', 'september', 'septembre'),
+    ('oct', 'october', 'octobre', 'okt', 'oktober'), ('nov', 'november', 'novembre'),
+    ('dec', 'december', 'déc', 'décembre', 'dez', 'dezember')
+), start=1) for name in names}
+
+_WEEKDAY_PREFIX = re.compile(r'^(?:mon|tue|tues|wed|thu|thur|thurs|fri|sat|sun)[a-z]*\.?,?\s+')
+_ORDINAL = r'(?:st|nd|rd|th|er)?'
+
+# (name, regex, field order); 'n?' orders are numeric with ambiguous day/month
+SHAPES = (
+    ('iso', re.compile(r'(\d{4})-(\d{1,2})-(\d{1,2})(?:[t\s].*)?$'), 'ymd'),
+    ('ymd', re.compile(r'(\d{4})[/.](\d{1,2})[/.](\d{1,2})$'), 'ymd'),
+    ('compact', re.compile(r'(\d{4})(\d{2})(\d{2})$'), 'ymd'),
+    ('numeric', re.compile(r'(\d{1,2})([-/.])(\d{1,2})\2(\d{4}|\d{2})$'), 'n?'),
+    ('month_day', re.compile(r'([a-zäéû]+)\.?[\s-]+(\d{1,2})' + _ORDINAL + r',?[\s-]+(\d{4})$'), 'Mdy'),
+    ('day_month', re.compile(r'(\d{1,2})' + _ORDINAL + r'\.?[\s-]+(?:of\s+)?([a-zäéû]+)\.?,?[\s-]+(\d{4})$'), 'dMy'),
+)
+_SHAPES_BY_NAME = {shape[0]: shape for shape in SHAPES}
+
+# Locales that write numeric dates month first; any other locale with a
+# region is taken as day first
+MONTH_FIRST_LOCALES = {'en_us', 'es_us', 'en_ph', 'en_ca', 'en_fm', 'en_mh', 'en_pw'}
+MONTH_FIRST_CURRENCIES = {'USD'}
+DAY_FIRST_CURRENCIES = {'EUR', 'GBP', 'INR', 'AUD', 'NZD', 'CHF', 'MXN'}
+
+
+def day_first_for_locale(locale):
+    if not locale:
+        return None
+    locale = locale.replace('-', '_').lower()
+    if locale in MONTH_FIRST_LOCALES:
+        return False
+    return True if '_' in locale else None
+
+
+def day_first_for_currency(currency):
+    if currency in MONTH_FIRST_CURRENCIES:
+        return False
+    if currency in DAY_FIRST_CURRENCIES:
+        return True
+    return None
+
+
+def _vendor_key(vendor):
+    return " ".join(vendor.lower().split()) if vendor else None
+
+
+class DateParser:
+    MAX_VENDORS = 2048
+
+    def __init__(self, day_first=False, max_vendors=MAX_VENDORS):
+        self.day_first = day_first
+        self.max_vendors = max_vendors
+        # vendor -> {"shape": name, "day_first": bool|None}
+        self._vendors = OrderedDict()
+        self._lock = threading.Lock()
+
+    def vendor_profile(self, vendor):
+        key = _vendor_key(vendor)
+        if key is None:
+            return None
+        with self._lock:
+            profile = self._vendors.get(key)
+            if profile is not None:
+                self._vendors.move_to_end(key)
+            return profile
+
+    def _remember(self, vendor, shape, day_first):
+        key = _vendor_key(vendor)
+        if key is None:
+            return
+        with self._lock:
+            profile = self._vendors.setdefault(key, {"shape": None, "day_first": None})
+            profile["shape"] = shape
+            if day_first is not None:
+                profile["day_first"] = day_first
+            self._vendors.move_to_end(key)
+            while len(self._vendors) > self.max_vendors:
+                self._vendors.popitem(last=False)
+
+    # Returns a datetime.date or None. `day_first` forces the numeric order;
+    # `locale` ("en_GB", "fr-CA") and `currency` ("EUR") are weaker hints.
+    def parse(self, text, vendor=None, day_first=None, locale=None, currency=None):
+        if not text:
+            return None
+        text = _WEEKDAY_PREFIX.sub('', text.strip().lower())
+        profile = self.vendor_profile(vendor)
+
+        shapes = SHAPES
+        if profile and profile["shape"] in _SHAPES_BY_NAME:
+            preferred = _SHAPES_BY_NAME[profile["shape"]]
+            shapes = (preferred,) + tuple(s for s in SHAPES if s is not preferred)
+
+        for name, pattern, order in shapes:
+            match = pattern.match(text)
+            if match is None:
+                continue
+            if order == 'n?':
+                first, separator, second, year = match.groups()
+                first, second = int(first), int(second)
+                if first > 12 and second <= 12:
+                    detected = True
+                elif second > 12 and first <= 12:
+                    detected = False
+                else:
+                    detected = None
+                hint = day_first
+                if hint is None and profile is not None:
+                    hint = profile["day_first"]
+                if hint is None:
+                    hint = day_first_for_locale(locale)
+                if hint is None:
+                    hint = day_first_for_currency(currency)
+                if hint is None and separator == '.':
+                    hint = True   # 05.03.2025 is a European convention
+                if hint is None:
+                    hint = self.day_first
+                use_day_first = detected if detected is not None else hint
+                day, month = (first, second) if use_day_first else (second, first)
+                year = int(year)
+            else:
+                a, b, c = match.groups()[:3]
+                detected = None
+                if order == 'ymd':
+                    year, month, day = int(a), int(b), int(c)
+                elif order == 'Mdy':
+                    year, month, day = int(c), _MONTHS.get(a), int(b)
+                else:
+                    year, month, day = int(c), _MONTHS.get(b), int(a)
+            if year < 100:
+                year += 2000
+            try:
+                parsed = date(year, month, day)
+            except (TypeError, ValueError):
+                return None
+            self._remember(vendor, name, detected)
+            return parsed
+        return None
+
+    def parse_iso(self, text, **hints):
+        parsed = self.parse(text, **hints)
+        return parsed.isoformat() if parsed else None
+
+
+default_parser = DateParser()
+
+
+def parse_date(text, **hints):
+    return default_parser.parse(text, **hints)
+
+
+def parse_date_iso(text, **hints):
+    return default_parser.parse_iso(text, **hints)
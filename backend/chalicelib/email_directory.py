@@ -0,0 +1,129 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+
+
+# user id (Cognito sub) -> email, persisted in S3 so the reminder job doesn't
+# call Cognito's admin API for every user on every run. Each user has their
+# own small object at system/emails/{user_id}.json, so recording one user
+# never contends with another. Users recorded before that are read from the
+# old shared system/email_directory.json. Entries older than `ttl` are looked
+# up again. When many users are unknown at once, prefetch() pages through
+# ListUsers instead of one AdminGetUser per user. The Cognito post
+# confirmation trigger records new users as they sign up.
+class EmailDirectory:
+    PREFIX = 'system/emails/'
+    LEGACY_KEY = 'system/email_directory.json'
+    TTL = 7 * 24 * 60 * 60
+    BULK_THRESHOLD = 25   # unknown users before a ListUsers sweep is cheaper
+    WORKERS = 8
+
+    def __init__(self, storage_service, cognito_client, user_pool_id, ttl=TTL):
+        self.storage = storage_service
+        self.cognito = cognito_client
+        self.user_pool_id = user_pool_id
+        self.ttl = ttl
+        self._entries = {}
+        self._legacy = None
+        self._dirty = {}
+        self._lock = threading.Lock()
+
+    def _key(self, user_id):
+        return f"{self.PREFIX}{user_id}.json"
+
+    def _entry(self, user_id):
+        with self._lock:
+            if user_id in self._entries:
+                return self._entries[user_id]
+        entry = self.storage.get_json(self._key(user_id)) or self._legacy_entry(user_id)
+        with self._lock:
+            self._entries.setdefault(user_id, entry)
+            return self._entries[user_id]
+
+    def _legacy_entry(self, user_id):
+        if self._legacy is None:
+            self._legacy = self.storage.get_json(self.LEGACY_KEY, {"users": {}})["users"]
+        return self._legacy.get(user_id)
+
+    def _fresh(self, entry):
+        return entry is not None and time.time() - entry["updated_at"] < self.ttl
+
+    def record(self, user_id, email):
+        entry = {"email": email, "updated_at": time.time()}
+        with self._lock:
+            self._entries[user_id] = entry
+            self._dirty[user_id] = entry
+
+    def get(self, user_id):
+        entry = self._entry(user_id)
+        if self._fresh(entry):
+            return entry["email"]
+
+        email = self._lookup(user_id)
+        if email:
+            self.record(user_id, email)
+            return email
+        # Fall back to a stale address rather than skipping the user
+        return entry["email"] if entry else None
+
+    # Load `user_ids`' entries, and make sure they are resolvable with one
+    # ListUsers sweep when enough of them are unknown or stale.
+    def prefetch(self, user_ids):
+        user_ids = list(user_ids)
+        if not user_ids:
+            return
+        with ThreadPoolExecutor(max_workers=min(self.WORKERS, len(user_ids))) as pool:
+            entries = list(pool.map(self._entry, user_ids))
+        missing = [e for e in entries if not self._fresh(e)]
+        if len(missing) >= self.BULK_THRESHOLD:
+            self.warm()
+
+    def warm(self):
+        paginator = self.cognito.get_paginator('list_users')
+        count = 0
+        for page in paginator.paginate(UserPoolId=self.user_pool_id, AttributesToGet=['sub', 'email']):
+            for user in page.get('Users', []):
+                attrs = {a['Name']: a['Value'] for a in user.get('Attributes', [])}
+                if attrs.get('sub') and attrs.get('email'):
+                    self.record(attrs['sub'], attrs['email'])
+                    count += 1
+        print(f"[INFO] Email directory warmed with {count} user(s)")
+        return count
+
+    def _lookup(self, user_id):
+        try:
+            response = self.cognito.admin_get_user(
+                UserPoolId=self.user_pool_id,
+                Username=user_id
+            )
+            for attr in response['UserAttributes']:
+                if attr['Name'] == 'email':
+                    return attr['Value']
+            return None
+        except ClientError as e:
+            print(f"[ERROR] Fetching email for {user_id}: {e}")
+            return None
+
+    # Write the entries recorded since the last save, one object per user
+    def save(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        if not dirty:
+            return
+
+        def write(item):
+            user_id, entry = item
+            try:
+                self.storage.put_json(self._key(user_id), entry)
+                return True
+            except Exception as e:
+                print(f"[WARN] Could not save email for {user_id}: {e}")
+                with self._lock:
+                    self._dirty.setdefault(user_id, entry)
+                return False
+
+        with ThreadPoolExecutor(max_workers=min(self.WORKERS, len(dirty))) as pool:
+            saved = sum(pool.map(write, dirty.items()))
+        if saved < len(dirty):
+            print(f"[WARN] Email directory: {len(dirty) - saved} entr(ies) left unsaved")
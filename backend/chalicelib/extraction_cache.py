@@ -0,0 +1,56 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from chalicelib.storage_service import ObjectNotFound
+
+# Extraction results keyed by the document's content (its S3 ETag) and the
+# parser version that produced them. Entries live in S3 as small sidecar
+# objects under cache/extractions/ with an in-process LRU in front, so a
+# document that was already analyzed is never sent to Textract again until
+# the parser changes.
+class ExtractionCache:
+    PREFIX = 'cache/extractions'
+
+    def __init__(self, storage_service, parser_version, max_entries=512):
+        self.storage = storage_service
+        self.parser_version = parser_version
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key_for(self, file_name):
+        head = self.storage.head(file_name)
+        if head is None:
+            raise ObjectNotFound(file_name)
+        etag = head['etag'].strip('"')
+        return f"{self.PREFIX}/v{self.parser_version}/{etag}.json"
+
+    def get(self, cache_key):
+        with self._lock:
+            if cache_key in self._entries:
+                self._entries.move_to_end(cache_key)
+                return dict(self._entries[cache_key])
+
+        entry = self.storage.get_json(cache_key)
+        if entry is None:
+            return None
+        extracted = entry['extracted']
+        self._remember(cache_key, extracted)
+        return dict(extracted)
+
+    def put(self, cache_key, extracted, file_name=None):
+        entry = {
+            "extracted": extracted,
+            "parser_version": self.parser_version,
+            "source": file_name,
+            "cached_at": datetime.now(timezone.utc).isoformat()
+        }
+        self.storage.put_json(cache_key, entry)
+        self._remember(cache_key, extracted)
+
+    def _remember(self, cache_key, extracted):
+        with self._lock:
+            self._entries[cache_key] = extracted
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
@@ -0,0 +1,201 @@
+import re
+from decimal import Decimal, InvalidOperation
+from chalicelib.date_parsing import default_parser, parse_date_iso
+
+# Table-driven mapping of Textract key/value pairs onto invoice fields.
+#
+# Each field has an ordered synonym list compiled into a single regex, plus
+# optional exclusions and a normalizer. A key is offered to the fields in
+# table order and taken by the first one whose synonyms match, whose
+# exclusions don't, and whose normalizer accepts the value (so "Payment Due"
+# with a dollar value falls through from DueDate to Amount). When several
+# pairs land on the same field, the earlier synonym wins, then the higher
+# Textract confidence.
+
+_CURRENCY_SYMBOLS = {'C$': 'CAD', 'CA$': 'CAD', 'US$': 'USD', 'A$': 'AUD',
+                     '$': 'USD', '€': 'EUR', '£': 'GBP', '¥': 'JPY', '₹': 'INR'}
+_CURRENCY_CODES = ('USD', 'CAD', 'EUR', 'GBP', 'AUD', 'JPY', 'INR', 'CHF', 'CNY', 'MXN', 'NZD')
+_CURRENCY_CODE_RE = re.compile(r'\b(' + '|'.join(_CURRENCY_CODES) + r')\b', re.IGNORECASE)
+_CURRENCY_SYMBOL_RE = re.compile('|'.join(
+    re.escape(s) for s in sorted(_CURRENCY_SYMBOLS, key=len, reverse=True)
+))
+_NUMBER_RE = re.compile(r'\d[\d,.\s]*')
+_CENTS = Decimal('0.01')
+
+
+def normalize_text(text):
+    text = " ".join(text.split())
+    return text or None
+
+
+def normalize_amount(text):
+    if not text:
+        return None
+    match = _NUMBER_RE.search(text)
+    if not match:
+        return None
+    number = "".join(match.group().split()).rstrip('.,')
+    # The last separator followed by one or two digits is the decimal point;
+    # every other separator groups thousands ("1.234,50" and "1,234.50").
+    last = max(number.rfind('.'), number.rfind(','))
+    if last != -1 and len(number) - last - 1 in (1, 2):
+        number = number[:last].replace('.', '').replace(',', '') + '.' + number[last + 1:]
+    else:
+        number = number.replace('.', '').replace(',', '')
+    try:
+        value = Decimal(number).quantize(_CENTS)
+    except InvalidOperation:
+        return None
+    stripped = text.strip()
+    if stripped.startswith('-') or stripped.endswith('-') or (stripped.startswith('(') and stripped.endswith(')')):
+        value = -value
+    return value
+
+
+def normalize_currency(text):
+    if not text:
+        return None
+    match = _CURRENCY_CODE_RE.search(text)
+    if match:
+        return match.group(1).upper()
+    match = _CURRENCY_SYMBOL_RE.search(text)
+    if match:
+        return _CURRENCY_SYMBOLS[match.group()]
+    return None
+
+
+def _amount_string(text):
+    value = normalize_amount(text)
+    return None if value is None else str(value)
+
+
+class FieldSpec:
+    def __init__(self, name, synonyms, normalize=normalize_text, exclude=()):
+        self.name = name
+        self.synonyms = tuple(synonyms)
+        self.normalize = normalize
+        self.pattern = re.compile('|'.join(
+            f'(?P<s{rank}>{re.escape(s)})' for rank, s in enumerate(self.synonyms)
+        ))
+        self.exclude = re.compile('|'.join(re.escape(e) for e in exclude)) if exclude else None
+
+    # Rank of the matching synonym (lower is better), or None
+    def rank(self, key_lower):
+        match = self.pattern.search(key_lower)
+        if match is None or (self.exclude is not None and self.exclude.search(key_lower)):
+            return None
+        return int(match.lastgroup[1:])
+
+
+DEFAULT_FIELDS = (
+    FieldSpec('InvoiceNumber', ['invoice number', 'invoice no', 'invoice #', 'invoice num',
+                                'invoice id', 'inv #', 'inv no', 'bill number', 'reference number']),
+    FieldSpec('Vendor', ['vendor', 'supplier', 'biller', 'sold by', 'payee', 'remit to']),
+    FieldSpec('DueDate', ['due date', 'payment due', 'due by', 'due on', 'pay by'],
+              normalize=parse_date_iso),
+    FieldSpec('Tax', ['sales tax', 'tax', 'vat', 'gst', 'hst', 'pst'], normalize=_amount_string,
+              exclude=['tax id', 'tax number', 'tax no', 'tax reg', 'incl', 'before tax', 'excl']),
+    FieldSpec('Currency', ['currency'], normalize=normalize_currency),
+    FieldSpec('Amount', ['amount due', 'balance due', 'total due', 'grand total', 'total amount',
+                         'amount payable', 'invoice total', 'payment due', 'total'],
+              normalize=_amount_string, exclude=['subtotal', 'sub total', 'sub-total']),
+)
+
+# Lines that can't be part of a vendor name in the fallback below
+_NOT_VENDOR_RE = re.compile(r'\d|invoice|total|due|date|amount|number', re.IGNORECASE)
+
+
+class FieldExtractor:
+    VENDOR_FALLBACK_LINES = 10   # the vendor name is printed near the top
+
+    def __init__(self, fields=DEFAULT_FIELDS, date_parser=default_parser):
+        self.fields = tuple(fields)
+        self.date_parser = date_parser
+        self._candidates = {}
+
+    # [(field, rank), ...] in table order for a key; memoized because the
+    # same few labels repeat across nearly every invoice
+    def candidates(self, key_text):
+        key_lower = key_text.lower()
+        found = self._candidates.get(key_lower)
+        if found is None:
+            found = []
+            for field in self.fields:
+                rank = field.rank(key_lower)
+                if rank is not None:
+                    found.append((field, rank))
+            if len(self._candidates) < 4096:
+                self._candidates[key_lower] = found
+        return found
+
+    # `parsed` is the (pairs, lines) result of textract_service.parse_blocks
+    def extract(self, parsed):
+        return self.extract_batch([parsed])[0]
+
+    # Extract many parsed documents in one pass: each distinct key label in
+    # the batch is classified once, then every document is resolved against
+    # that table.
+    def extract_batch(self, documents):
+        labels = {}
+        for pairs, _ in documents:
+            for key_text, _, _ in pairs:
+                if key_text not in labels:
+                    labels[key_text] = self.candidates(key_text)
+        return [self._resolve(pairs, lines, labels) for pairs, lines in documents]
+
+    def _resolve(self, pairs, lines, labels):
+        best = {}
+        for key_text, value_text, confidence in pairs:
+            for field, rank in labels[key_text]:
+                value = field.normalize(value_text)
+                if value is None:
+                    continue
+                score = (rank, -(confidence or 0.0))
+                if field.name not in best or score < best[field.name][0]:
+                    best[field.name] = (score, value, confidence, value_text)
+                break
+
+        extracted = {name: value for name, (_, value, _, _) in best.items()}
+        confidence = {name: _round(conf) for name, (_, _, conf, _) in best.items()}
+
+        if 'Currency' not in extracted:
+            for name in ('Amount', 'Tax'):
+                currency = normalize_currency(best[name][3]) if name in best else None
+                if currency:
+                    extracted['Currency'] = currency
+                    confidence['Currency'] = confidence[name]
+                    break
+
+        # Smart fallback: combine up to two leading text-only lines to form the vendor name
+        if 'Vendor' not in extracted:
+            vendor_lines = []
+            for text, line_confidence in lines[:self.VENDOR_FALLBACK_LINES]:
+                clean = text.strip()
+                if clean and not _NOT_VENDOR_RE.search(clean):
+                    vendor_lines.append((clean.title(), line_confidence))
+                    if len(vendor_lines) == 2:
+                        break
+            if vendor_lines:
+                extracted['Vendor'] = " ".join(text for text, _ in vendor_lines)
+                confidence['Vendor'] = _round(min(c or 0.0 for _, c in vendor_lines))
+
+        # Re-read the due date now that the vendor and currency are known, so
+        # 05/03/2025 follows the vendor's (or the currency's) day/month order
+        if 'DueDate' in best:
+            due_date = self.date_parser.parse_iso(
+                best['DueDate'][3], vendor=extracted.get('Vendor'), currency=extracted.get('Currency')
+            )
+            if due_date:
+                extracted['DueDate'] = due_date
+
+        extracted['Confidence'] = confidence
+        # Every LINE, kept for full-text search
+        extracted['Text'] = "\n".join(text for text, _ in lines)
+        return extracted
+
+
+def _round(confidence):
+    return None if confidence is None else round(confidence, 1)
+
+
+default_extractor = FieldExtractor()
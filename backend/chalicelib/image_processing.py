@@ -0,0 +1,67 @@
+import io
+import os
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # without Pillow uploads are stored and analyzed as sent
+    Image = None
+
+# Upload pre-processing. Phone photos of invoices are often 8-12 MB, far more
+# than Textract needs to read a page and over the synchronous API's limit, so
+# images are downscaled to MAX_DIMENSION on the long side, converted to
+# grayscale and recompressed as JPEG before analysis. The format comes from
+# the file's magic bytes, not the extension the client claims.
+#
+# Set IMAGE_PREPROCESSING=0 to store and analyze uploads untouched.
+
+ENABLED = os.environ.get('IMAGE_PREPROCESSING', '1') != '0'
+# ~200 DPI for a letter/A4 page, comfortably above what Textract needs
+MAX_DIMENSION = int(os.environ.get('IMAGE_MAX_DIMENSION', '2200'))
+JPEG_QUALITY = 80
+
+# (leading bytes, extension)
+SIGNATURES = (
+    (b'%PDF-', 'pdf'),
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'II*\x00', 'tiff'),
+    (b'MM\x00*', 'tiff'),
+)
+
+
+# Extension for what `data` actually is, or None if it isn't a document type
+# we know
+def detect_format(data):
+    for signature, file_ext in SIGNATURES:
+        if data.startswith(signature):
+            return file_ext
+    return None
+
+
+# A smaller copy of an image for analysis. Returns (bytes, extension), or
+# None when the upload should be used as is: PDFs, multi-page TIFFs, images
+# Pillow can't read, or when the result wouldn't be smaller.
+def optimize(data, file_ext):
+    if not ENABLED or Image is None or file_ext == 'pdf':
+        return None
+    try:
+        image = Image.open(io.BytesIO(data))
+        if getattr(image, 'n_frames', 1) > 1:
+            return None
+        # Lets the JPEG decoder scale down while decoding, which is much
+        # cheaper than decoding the full photo and resizing afterwards
+        image.draft('L', (MAX_DIMENSION, MAX_DIMENSION))
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('L')
+        image.thumbnail((MAX_DIMENSION, MAX_DIMENSION))
+
+        out = io.BytesIO()
+        image.save(out, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+    except Exception as e:
+        print(f"[WARN] Could not pre-process {file_ext} image: {e}")
+        return None
+
+    optimized = out.getvalue()
+    if len(optimized) >= len(data):
+        return None
+    return optimized, 'jpg'
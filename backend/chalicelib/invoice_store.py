@@ -0,0 +1,547 @@
+import base64
+import bisect
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from chalicelib.storage_service import ConcurrentUpdateError
+from chalicelib.field_extraction import normalize_amount
+from chalicelib.date_parsing import parse_date_iso
+from chalicelib.search_index import document_text
+
+INDEX_VERSION = 2
+
+# Fields kept in the index; listings that only ask for these never touch the
+# per-invoice objects.
+SUMMARY_FIELDS = ('invoice_id', 'file_name', 'created_at', 'vendor', 'amount', 'due_date')
+
+
+# Raised when an index document kept changing under every retry
+IndexConflictError = ConcurrentUpdateError
+
+
+def invoice_id_for(file_name):
+    return os.path.splitext(file_name.rsplit('/', 1)[-1])[0]
+
+
+def parse_amount(text):
+    value = normalize_amount(text)
+    return None if value is None else float(value)
+
+
+def parse_due_date(text, vendor=None):
+    return parse_date_iso(text, vendor=vendor)
+
+
+def summarize(record):
+    extracted = record.get("extracted") or {}
+    return {
+        "invoice_id": record["invoice_id"],
+        "file_name": record["file_name"],
+        "created_at": record["created_at"],
+        "vendor": extracted.get("Vendor"),
+        "amount": parse_amount(extracted.get("Amount")),
+        "due_date": parse_due_date(extracted.get("DueDate"), extracted.get("Vendor"))
+    }
+
+
+def _sort_key(entry):
+    return (entry["created_at"], entry["invoice_id"])
+
+
+def _month(entry):
+    return entry["created_at"][:7]
+
+
+def encode_cursor(entry):
+    raw = json.dumps(list(_sort_key(entry))).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        created_at, invoice_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor.")
+    return (created_at, invoice_id)
+
+
+# Filters (all optional): vendor (case-insensitive substring), created_from /
+# created_to and due_from / due_to (ISO dates, inclusive), min_amount /
+# max_amount, invoice_ids (a set, e.g. search hits).
+def _matches(entry, filters):
+    invoice_ids = filters.get('invoice_ids')
+    if invoice_ids is not None and entry["invoice_id"] not in invoice_ids:
+        return False
+
+    vendor = filters.get('vendor')
+    if vendor and vendor.lower() not in (entry.get('vendor') or '').lower():
+        return False
+
+    created = entry["created_at"][:10]
+    if filters.get('created_from') and created < filters['created_from']:
+        return False
+    if filters.get('created_to') and created > filters['created_to']:
+        return False
+
+    due = entry.get('due_date')
+    if filters.get('due_from') and (not due or due < filters['due_from']):
+        return False
+    if filters.get('due_to') and (not due or due > filters['due_to']):
+        return False
+
+    amount = entry.get('amount')
+    if filters.get('min_amount') is not None and (amount is None or amount < filters['min_amount']):
+        return False
+    if filters.get('max_amount') is not None and (amount is None or amount > filters['max_amount']):
+        return False
+    return True
+
+
+def _month_in_range(month, filters):
+    if filters.get('created_from') and month < filters['created_from'][:7]:
+        return False
+    if filters.get('created_to') and month > filters['created_to'][:7]:
+        return False
+    return True
+
+
+# One small object per invoice under uploads/{user}/invoices/, and a sorted
+# summary index split into one segment per upload month
+# (invoices/index/{YYYY-MM}.json) with a manifest (invoices/index.json)
+# listing the segments. Records are created with IfNoneMatch and index
+# documents are updated with IfMatch + retry, so concurrent uploads can't
+# overwrite each other. A listing page reads the manifest and only the
+# newest segments it needs, and invoices/latest.json always holds the newest
+# record. The first read of a user without a manifest imports their legacy
+# data.json. An optional SpendingSummary and SearchIndex are kept up to date
+# with new and reanalyzed records.
+#
+# Once a record is stored the upload has succeeded: if its index entry still
+# can't be written after INDEX_RETRIES, the entry is parked under
+# invoices/index-pending/ and merged into the index by the next read.
+class InvoiceStore:
+    INDEX_RETRIES = 12
+    FETCH_WORKERS = 8
+    # Documents under invoices/ that aren't invoice records
+    RESERVED_NAMES = ('index.json', 'latest.json', 'spending.json')
+
+    def __init__(self, storage_service, spending=None, search=None):
+        self.storage = storage_service
+        self.spending = spending
+        self.search = search
+
+    def _prefix(self, user_id):
+        return f"uploads/{user_id}/invoices/"
+
+    def _record_key(self, user_id, invoice_id):
+        return f"{self._prefix(user_id)}{invoice_id}.json"
+
+    def _manifest_key(self, user_id):
+        return f"{self._prefix(user_id)}index.json"
+
+    def _segment_key(self, user_id, month):
+        return f"{self._prefix(user_id)}index/{month}.json"
+
+    def _pending_prefix(self, user_id):
+        return f"{self._prefix(user_id)}index-pending/"
+
+    def _latest_key(self, user_id):
+        return f"{self._prefix(user_id)}latest.json"
+
+    def _legacy_key(self, user_id):
+        return f"uploads/{user_id}/data.json"
+
+    def record_key(self, user_id, file_name):
+        return self._record_key(user_id, invoice_id_for(file_name))
+
+    def add(self, user_id, file_name, extracted, created_at=None):
+        return self.add_many(user_id, [(file_name, extracted)], created_at=created_at)[0]
+
+    # Store several analyzed uploads with one index update per touched
+    # segment, one manifest update and one latest-pointer update.
+    # `items` is a list of (file_name, extracted).
+    def add_many(self, user_id, items, created_at=None):
+        created_at = created_at or datetime.now(timezone.utc).isoformat()
+        records = [
+            {
+                "invoice_id": invoice_id_for(file_name),
+                "file_name": file_name,
+                "extracted": extracted,
+                "created_at": created_at,
+                "reminders_enabled": True
+            }
+            for file_name, extracted in items
+        ]
+        if not records:
+            return []
+
+        created = []
+
+        def create(record):
+            if self._create(self._record_key(user_id, record["invoice_id"]), record):
+                created.append(record)
+                return record
+            # Already stored (e.g. a retried job completion); make sure it is indexed
+            return self.get(user_id, record["invoice_id"])
+
+        with ThreadPoolExecutor(max_workers=min(self.FETCH_WORKERS, len(records))) as pool:
+            records = list(pool.map(create, records))
+
+        entries = [summarize(r) for r in records]
+        try:
+            self._load_manifest(user_id, repair=False)
+            self._index_entries(user_id, entries)
+        except ConcurrentUpdateError as e:
+            print(f"[WARN] Index for {user_id} not updated ({e}); repairing on next read")
+            self._mark_pending(user_id, entries)
+        newest = max(records, key=_sort_key)
+        try:
+            self.update_latest(user_id, newest)
+        except ConcurrentUpdateError as e:
+            print(f"[WARN] Latest invoice for {user_id} not updated ({e}); repairing on next read")
+            self._mark_pending(user_id, [summarize(newest)])
+        # Only records created here, so a retried add isn't counted twice
+        if self.spending and created:
+            self.spending.apply(user_id, added=[summarize(r) for r in created])
+        if self.search:
+            self._update_search(user_id, added=[(r["invoice_id"], document_text(r["extracted"])) for r in records])
+        return records
+
+    # Replace the extraction of a stored invoice (after reanalysis) and carry
+    # the change into its index entry, the latest pointer and the spending
+    # summary. Returns the updated record, or None if the file was never
+    # saved as an invoice.
+    def update_extracted(self, user_id, file_name, extracted):
+        previous = {}
+
+        def replace(doc):
+            if not doc:
+                return False
+            previous.clear()
+            previous.update(doc)
+            doc["extracted"] = extracted
+            doc["updated_at"] = datetime.now(timezone.utc).isoformat()
+            return True
+
+        record = self.storage.update_json(
+            self.record_key(user_id, file_name), replace, default=dict, retries=self.INDEX_RETRIES
+        )
+        if not previous:
+            return None
+
+        old_entry, new_entry = summarize(previous), summarize(record)
+        if old_entry != new_entry:
+            found = []
+
+            def replace_entry(doc):
+                found.clear()
+                for i, entry in enumerate(doc["entries"]):
+                    if entry["invoice_id"] == new_entry["invoice_id"]:
+                        found.append(i)
+                        doc["entries"][i] = new_entry
+                        return True
+                return False
+
+            try:
+                self._update_doc(self._segment_key(user_id, _month(new_entry)), replace_entry,
+                                 lambda: self._segment_doc([]))
+            except ConcurrentUpdateError as e:
+                print(f"[WARN] Index for {user_id} not updated ({e}); repairing on next read")
+                found.clear()
+            if not found:
+                # Not indexed (yet): park the new entry so a pending add can't bring back the old one
+                self._mark_pending(user_id, [new_entry])
+            if self.spending:
+                self.spending.apply(user_id, added=[new_entry], removed=[old_entry])
+        if self.search:
+            self._update_search(
+                user_id,
+                added=[(record["invoice_id"], document_text(record["extracted"]))],
+                removed=[(record["invoice_id"], document_text(previous["extracted"]))]
+            )
+
+        def replace_latest(doc):
+            if doc.get("invoice_id") != record["invoice_id"]:
+                return False
+            doc.clear()
+            doc.update(record)
+            return True
+
+        try:
+            self._update_doc(self._latest_key(user_id), replace_latest, dict)
+        except ConcurrentUpdateError as e:
+            print(f"[WARN] Latest invoice for {user_id} not updated ({e})")
+        return record
+
+    # A search index that missed an update is flagged and rebuilt by the
+    # next search rather than failing the upload
+    def _update_search(self, user_id, added=(), removed=()):
+        try:
+            self.search.update(user_id, added=added, removed=removed)
+        except Exception as e:
+            print(f"[WARN] Search index for {user_id} not updated ({e}); marking it stale")
+            try:
+                self.search.mark_stale(user_id)
+            except Exception as e:
+                print(f"[ERROR] Could not mark search index stale for {user_id}: {e}")
+
+    # Every index entry of the user, oldest first
+    def summaries(self, user_id):
+        for month in self._load_manifest(user_id):
+            yield from self._load_segment(user_id, month)
+
+    # Every stored record of the user, oldest first
+    def records(self, user_id):
+        return self.get_many(user_id, [entry["invoice_id"] for entry in self.summaries(user_id)])
+
+    def get(self, user_id, invoice_id):
+        record, _ = self._get_json(self._record_key(user_id, invoice_id))
+        return record
+
+    # The most recently created record, kept in invoices/latest.json
+    def latest(self, user_id):
+        record, _ = self._get_json(self._latest_key(user_id))
+        return record
+
+    def update_latest(self, user_id, record):
+        def replace_if_newer(doc):
+            if doc and _sort_key(doc) >= _sort_key(record):
+                return False
+            doc.clear()
+            doc.update(record)
+            return True
+
+        self._update_doc(self._latest_key(user_id), replace_if_newer, dict)
+
+    # Records in the same order as `invoice_ids`; missing ones are skipped
+    def get_many(self, user_id, invoice_ids):
+        if not invoice_ids:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.FETCH_WORKERS, len(invoice_ids))) as pool:
+            records = list(pool.map(lambda invoice_id: self.get(user_id, invoice_id), invoice_ids))
+        return [r for r in records if r is not None]
+
+    # Newest first. `cursor` is the opaque token returned with the previous
+    # page; `fields` restricts each item to those keys.
+    def list_page(self, user_id, limit=50, cursor=None, filters=None, fields=None):
+        filters = filters or {}
+        after = decode_cursor(cursor) if cursor else None
+
+        matched = []
+        for month in reversed(self._load_manifest(user_id)):
+            if after and month > after[0][:7]:
+                continue
+            if not _month_in_range(month, filters):
+                continue
+            for entry in reversed(self._load_segment(user_id, month)):
+                if after and _sort_key(entry) >= after:
+                    continue
+                if _matches(entry, filters):
+                    matched.append(entry)
+                    if len(matched) > limit:
+                        break
+            if len(matched) > limit:
+                break
+
+        page = matched[:limit]
+        next_cursor = encode_cursor(page[-1]) if len(matched) > limit else None
+        return self._project(user_id, page, fields), next_cursor
+
+    def _project(self, user_id, entries, fields):
+        if fields and set(fields) <= set(SUMMARY_FIELDS):
+            return [{f: entry.get(f) for f in fields} for entry in entries]
+
+        records = self.get_many(user_id, [e["invoice_id"] for e in entries])
+        if not fields:
+            return records
+        summaries = {e["invoice_id"]: e for e in entries}
+        return [
+            {f: record.get(f, summaries[record["invoice_id"]].get(f)) for f in fields}
+            for record in records
+        ]
+
+    # Recompute every index segment and the manifest from the per-invoice
+    # objects. Segments and the manifest are written conditionally, and
+    # entries for invoices created after the rebuild started (which the
+    # listing may have missed) are kept rather than overwritten.
+    def rebuild_index(self, user_id):
+        started = datetime.now(timezone.utc).isoformat()
+        prefix = self._prefix(user_id)
+        invoice_ids = []
+        for obj in self.storage.list(prefix):
+            name = obj['key'][len(prefix):]
+            if '/' not in name and name not in self.RESERVED_NAMES:
+                invoice_ids.append(invoice_id_for(name))
+
+        segments = {}
+        newest = None
+        for record in self.get_many(user_id, invoice_ids):
+            entry = summarize(record)
+            segments.setdefault(_month(entry), []).append(entry)
+            if newest is None or _sort_key(record) > _sort_key(newest):
+                newest = record
+
+        def replace_segment(entries):
+            def mutate(doc):
+                rebuilt = {e["invoice_id"] for e in entries}
+                newer = [
+                    e for e in doc.get("entries", ())
+                    if e["invoice_id"] not in rebuilt and e["created_at"] >= started
+                ] if doc.get("version") == INDEX_VERSION else []
+                doc.clear()
+                doc.update(self._segment_doc(sorted(entries + newer, key=_sort_key)))
+            return mutate
+
+        for month, entries in segments.items():
+            self._update_doc(self._segment_key(user_id, month), replace_segment(entries),
+                             lambda: self._segment_doc([]))
+
+        def replace_manifest(doc):
+            months = set(segments)
+            if doc.get("version") == INDEX_VERSION:
+                # Months a concurrent add just created
+                months.update(m for m in doc["segments"] if m >= started[:7])
+            doc.clear()
+            doc.update(self._manifest_doc(sorted(months)))
+
+        manifest = self.storage.update_json(self._manifest_key(user_id), replace_manifest, default=dict,
+                                            retries=self.INDEX_RETRIES)
+        months = manifest["segments"]
+        if newest:
+            self.update_latest(user_id, newest)
+        return months
+
+    # Segment months from the manifest, migrating first if it is missing or
+    # outdated and (with `repair`) merging any parked entries
+    def _load_manifest(self, user_id, repair=True):
+        manifest, _ = self._get_json(self._manifest_key(user_id))
+        if manifest is None or manifest.get("version") != INDEX_VERSION:
+            try:
+                return self._migrate(user_id)
+            except ConcurrentUpdateError:
+                # Another request migrated it at the same time
+                manifest, _ = self._get_json(self._manifest_key(user_id))
+                if manifest is None or manifest.get("version") != INDEX_VERSION:
+                    raise
+                return manifest["segments"]
+        if repair and self._repair_pending(user_id):
+            manifest, _ = self._get_json(self._manifest_key(user_id))
+        return manifest["segments"]
+
+    # Park index entries that couldn't be written; see _repair_pending
+    def _mark_pending(self, user_id, entries):
+        for entry in entries:
+            try:
+                self._put_json(f"{self._pending_prefix(user_id)}{entry['invoice_id']}.json", entry)
+            except Exception as e:
+                print(f"[ERROR] Could not mark index entry {entry['invoice_id']} for {user_id}: {e}")
+
+    # Merge parked entries into the index. True if any were merged; ones
+    # that still conflict stay parked for the next read.
+    def _repair_pending(self, user_id):
+        prefix = self._pending_prefix(user_id)
+        keys = [obj['key'] for obj in self.storage.list(prefix)]
+        if not keys:
+            return False
+        entries = [doc for doc, _ in map(self._get_json, keys) if doc]
+        try:
+            self._index_entries(user_id, entries, replace=True)
+        except ConcurrentUpdateError as e:
+            print(f"[WARN] Pending index entries for {user_id} not merged yet ({e})")
+            return False
+        newest = self.get(user_id, max(entries, key=_sort_key)["invoice_id"]) if entries else None
+        if newest:
+            try:
+                self.update_latest(user_id, newest)
+            except ConcurrentUpdateError as e:
+                # Entries are merged; keep them parked until the pointer is too
+                print(f"[WARN] Pending latest invoice for {user_id} not updated yet ({e})")
+                return True
+        for key in keys:
+            self.storage.delete(key)
+        print(f"[INFO] Merged {len(entries)} pending index entr(ies) for {user_id}")
+        return True
+
+    def _load_segment(self, user_id, month):
+        segment, _ = self._get_json(self._segment_key(user_id, month))
+        return segment["entries"] if segment else []
+
+    def _segment_doc(self, entries):
+        return {"version": INDEX_VERSION, "entries": entries}
+
+    def _manifest_doc(self, months):
+        return {
+            "version": INDEX_VERSION,
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+            "segments": months
+        }
+
+    # Insert `new_entries` into their segments; with `replace`, entries
+    # already indexed are overwritten instead of skipped.
+    def _index_entries(self, user_id, new_entries, replace=False):
+        by_month = {}
+        for entry in new_entries:
+            by_month.setdefault(_month(entry), []).append(entry)
+
+        def insert(entries_for_month):
+            def mutate(doc):
+                entries = doc["entries"]
+                known = {e["invoice_id"] for e in entries}
+                changed = False
+                if replace:
+                    updated = {e["invoice_id"]: e for e in entries_for_month}
+                    for i, entry in enumerate(entries):
+                        if entry["invoice_id"] in updated and entry != updated[entry["invoice_id"]]:
+                            entries[i] = updated[entry["invoice_id"]]
+                            changed = True
+                for entry in sorted(entries_for_month, key=_sort_key):
+                    if entry["invoice_id"] in known:
+                        continue
+                    if not entries or _sort_key(entry) >= _sort_key(entries[-1]):
+                        entries.append(entry)
+                    else:
+                        keys = [_sort_key(e) for e in entries]
+                        entries.insert(bisect.bisect_right(keys, _sort_key(entry)), entry)
+                    changed = True
+                return changed
+            return mutate
+
+        def add_segments(doc):
+            missing = [m for m in by_month if m not in doc["segments"]]
+            if not missing:
+                return False
+            doc["segments"] = sorted(doc["segments"] + missing)
+            doc["updated_at"] = datetime.now(timezone.utc).isoformat()
+            return True
+
+        for month, entries in by_month.items():
+            self._update_doc(self._segment_key(user_id, month), insert(entries), lambda: self._segment_doc([]))
+        self._update_doc(self._manifest_key(user_id), add_segments, lambda: self._manifest_doc([]))
+
+    # Optimistic read-modify-write of one index document. `mutate` edits the
+    # document in place and returns False when there is nothing to write.
+    def _update_doc(self, key, mutate, empty):
+        self.storage.update_json(key, mutate, default=empty, retries=self.INDEX_RETRIES)
+
+    # Import legacy data.json records (if any) and build the index from the
+    # per-invoice objects. Also upgrades indexes from older versions.
+    def _migrate(self, user_id):
+        legacy, _ = self._get_json(self._legacy_key(user_id))
+        for record in legacy or []:
+            record = dict(record, invoice_id=invoice_id_for(record["file_name"]))
+            self._create(self._record_key(user_id, record["invoice_id"]), record)
+
+        months = self.rebuild_index(user_id)
+        if legacy:
+            print(f"[INFO] Migrated {len(legacy)} invoice(s) from data.json for {user_id}")
+        return months
+
+    def _create(self, key, doc):
+        return self.storage.create_json(key, doc)
+
+    def _get_json(self, key):
+        return self.storage.get_json_with_etag(key)
+
+    def _put_json(self, key, doc, if_match=None, if_none_match=False):
+        self.storage.put_json(key, doc, if_match=if_match, if_none_match=if_none_match)
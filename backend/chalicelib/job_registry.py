@@ -0,0 +1,99 @@
+import time
+from datetime import datetime, timezone
+from chalicelib.storage_service import PreconditionFailed
+
+# Job states. IN_PROGRESS mirrors Textract's own status; COMPLETING is held
+# by whichever handler (SNS notification or /jobs poll) claimed the job first,
+# for up to CLAIM_LEASE seconds; after that another handler may reclaim it,
+# so a finisher that crashed or timed out doesn't leave the job stuck.
+IN_PROGRESS = 'IN_PROGRESS'
+COMPLETING = 'COMPLETING'
+SUCCEEDED = 'SUCCEEDED'
+FAILED = 'FAILED'
+CLAIM_LEASE = 5 * 60
+
+
+# A COMPLETING job whose finisher hasn't finished within CLAIM_LEASE
+def claim_expired(job, now=None):
+    return (job["status"] == COMPLETING
+            and (now or time.time()) - job.get("claimed_at", 0) > CLAIM_LEASE)
+
+
+class JobRegistry:
+    def __init__(self, storage_service):
+        self.storage = storage_service
+
+    def _key(self, user_id, job_id):
+        return f"uploads/{user_id}/jobs/{job_id}.json"
+
+    # Points a document at its most recent job of one kind, for callers that
+    # only know the file name (direct uploads started by the S3 event
+    # handler). Keyed by kind so an /extract-invoice job on the same file
+    # doesn't hide the upload job /upload-status is waiting for.
+    def _file_key(self, user_id, file_name, kind):
+        return f"uploads/{user_id}/jobs/files/{kind}/{file_name.rsplit('/', 1)[-1]}.json"
+
+    # Where the pointer for any kind used to live
+    def _legacy_file_key(self, user_id, file_name):
+        return f"uploads/{user_id}/jobs/files/{file_name.rsplit('/', 1)[-1]}.json"
+
+    def create(self, user_id, job_id, file_name, kind):
+        now = datetime.now(timezone.utc).isoformat()
+        job = {
+            "job_id": job_id,
+            "user_id": user_id,
+            "file_name": file_name,
+            "kind": kind,
+            "status": IN_PROGRESS,
+            "created_at": now,
+            "updated_at": now
+        }
+        self._put(user_id, job_id, job)
+        self.storage.put_json(self._file_key(user_id, file_name, kind), {"job_id": job_id})
+        return job
+
+    def get_for_file(self, user_id, file_name, kind):
+        pointer = self.storage.get_json(self._file_key(user_id, file_name, kind))
+        if pointer is not None:
+            return self.get(user_id, pointer["job_id"])
+        pointer = self.storage.get_json(self._legacy_file_key(user_id, file_name))
+        job = pointer and self.get(user_id, pointer["job_id"])
+        return job if job and job.get("kind") == kind else None
+
+    def get(self, user_id, job_id):
+        job, _ = self._get(user_id, job_id)
+        return job
+
+    def update(self, user_id, job_id, **fields):
+        job, _ = self._get(user_id, job_id)
+        if job is None:
+            return None
+        job.update(fields)
+        job["updated_at"] = datetime.now(timezone.utc).isoformat()
+        self._put(user_id, job_id, job)
+        return job
+
+    # Move an IN_PROGRESS job (or one whose claim lease ran out) to
+    # COMPLETING with a conditional write, so the SNS handler and a
+    # concurrent /jobs poll never both finalize it. Returns the claimed job,
+    # or None if it was already claimed/finished.
+    def claim(self, user_id, job_id):
+        job, etag = self._get(user_id, job_id)
+        if job is None or not (job["status"] == IN_PROGRESS or claim_expired(job)):
+            return None
+        if job["status"] == COMPLETING:
+            print(f"[WARN] Reclaiming job {job_id}; its previous claim expired")
+        job["status"] = COMPLETING
+        job["claimed_at"] = time.time()
+        job["updated_at"] = datetime.now(timezone.utc).isoformat()
+        try:
+            self._put(user_id, job_id, job, if_match=etag)
+        except PreconditionFailed:
+            return None
+        return job
+
+    def _get(self, user_id, job_id):
+        return self.storage.get_json_with_etag(self._key(user_id, job_id))
+
+    def _put(self, user_id, job_id, job, if_match=None):
+        self.storage.put_json(self._key(user_id, job_id), job, if_match=if_match)
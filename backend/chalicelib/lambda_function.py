@@ -1,119 +1,80 @@
-import boto3
-import json
-from datetime import datetime, timezone
-from botocore.exceptions import ClientError
+from chalicelib import telemetry
+from chalicelib.storage_service import StorageService
+from chalicelib.reminder_index import ReminderDueIndex
+from chalicelib.invoice_store import InvoiceStore
+from chalicelib.spending_summary import SpendingSummary
+from chalicelib.search_index import SearchIndex, document_text
+from chalicelib.reminder_dispatcher import ReminderDispatcher
+from chalicelib.email_directory import EmailDirectory
+from chalicelib.aws_clients import lazy_client
 
 # Initialize clients
-ses = boto3.client('ses', region_name='us-east-1')
-s3 = boto3.client('s3')
-cognito = boto3.client('cognito-idp', region_name='us-east-1')
+ses = lazy_client('ses', region='us-east-1')
+cognito = lazy_client('cognito-idp', region='us-east-1')
 
 # Constants
 BUCKET_NAME = 'contentcen301247017.aws.ai'
 USER_POOL_ID = 'us-east-1_uQZV1V7mr'
+SENDER = 'ethan@szabadka.ca'
 
-def get_user_ids_from_s3():
-    try:
-        response = s3.list_objects_v2(Bucket=BUCKET_NAME, Prefix='uploads/', Delimiter='/')
-        prefixes = response.get('CommonPrefixes', [])
-        return [prefix['Prefix'].split('/')[1] for prefix in prefixes]
-    except Exception as e:
-        print(f"[ERROR] Failed to list user folders in S3: {e}")
-        return []
-
-def get_user_email(user_id):
-    try:
-        response = cognito.admin_get_user(
-            UserPoolId=USER_POOL_ID,
-            Username=user_id
-        )
-        for attr in response['UserAttributes']:
-            if attr['Name'] == 'email':
-                return attr['Value']
-        return None
-    except ClientError as e:
-        print(f"[ERROR] Fetching email for {user_id}: {e}")
-        return None
-
-def send_email(to_address, subject, body):
-    try:
-        response = ses.send_email(
-            Source='ethan@szabadka.ca',
-            Destination={'ToAddresses': [to_address]},
-            Message={
-                'Subject': {'Data': subject},
-                'Body': {'Text': {'Data': body}},
-            },
-        )
-        print(f"[INFO] Email sent to {to_address}! Message ID: {response['MessageId']}")
-    except ClientError as e:
-        print(f"[ERROR] Sending email to {to_address}: {e.response['Error']['Message']}")
+storage_service = StorageService(BUCKET_NAME)
+due_index = ReminderDueIndex(storage_service)
+spending_summary = SpendingSummary(storage_service)
+search_index = SearchIndex(storage_service)
+invoice_store = InvoiceStore(storage_service, spending=spending_summary, search=search_index)
+email_directory = EmailDirectory(storage_service, cognito, USER_POOL_ID)
+dispatcher = ReminderDispatcher(
+    storage_service=storage_service,
+    ses_client=ses,
+    email_directory=email_directory,
+    sender=SENDER,
+    due_index=due_index
+)
 
+# Invoke with {"backfill": true} once to index reminders scheduled before the
+# due index existed, {"warm_emails": true} to refresh every cached address
+# from Cognito in one ListUsers sweep, {"rebuild_spending": true} to
+# recompute every user's invoice index and spending summary, and
+# {"rebuild_search": true} to re-index every user's invoices for search. A run
+# that hits the Lambda timeout leaves its checkpoint open and the next
+# invocation resumes it.
 def check_reminders(event, context):
-    user_ids = get_user_ids_from_s3()
-    now = datetime.now(timezone.utc)
+    event = event or {}
+    with telemetry.trace('check_reminders') as current:
+        if event.get('backfill'):
+            dispatcher.backfill_due_index()
+        if event.get('warm_emails'):
+            email_directory.warm()
+        if event.get('rebuild_spending'):
+            rebuild_spending()
+        if event.get('rebuild_search'):
+            rebuild_search()
 
-    if not user_ids:
-        print("[INFO] No user folders found under uploads/")
-        return {"status": "No users found."}
+        summary = dispatcher.run(context=context)
+        current.properties.update(
+            {key: value for key, value in summary.items() if isinstance(value, (int, float))}
+        )
+    return {"status": "Processed reminders", **summary}
 
+def rebuild_spending():
+    user_ids = dispatcher.get_user_ids()
     for user_id in user_ids:
-        print(f"\n[INFO] Processing user: {user_id}")
-        reminder_key = f"uploads/{user_id}/reminders.json"
-
         try:
-            obj = s3.get_object(Bucket=BUCKET_NAME, Key=reminder_key)
-            reminders = json.loads(obj['Body'].read())
-            print(f"[INFO] Found {len(reminders)} reminder(s) for user {user_id}")
-        except s3.exceptions.NoSuchKey:
-            print(f"[INFO] No reminders.json for user {user_id}")
-            continue
+            invoice_store.rebuild_index(user_id)
+            spending_summary.rebuild(user_id, lambda: invoice_store.summaries(user_id))
         except Exception as e:
-            print(f"[ERROR] Failed to read reminder file for {user_id}: {e}")
-            continue
-
-        user_email = get_user_email(user_id)
-        if not user_email:
-            print(f"[WARN] No email for user {user_id}. Skipping.")
-            continue
-
-        updated_reminders = []
-        for reminder in reminders:
-            try:
-                reminder_time = datetime.fromisoformat(reminder["reminder_time"].replace("Z", "+00:00"))
-                if reminder_time <= now:
-                    print(f"[INFO] Sending reminder for file: {reminder['file_name']} to {user_email}")
-                    subject = f"📬 Reminder: {reminder['file_name']} is due!"
-                    body = f"""
-                        Hello,
-                        
-                        This is a reminder that your document **{reminder['file_name']}** is due on {reminder_time.strftime('%Y-%m-%d %H:%M:%S')} UTC.
-                        
-                        Please take any necessary actions.
-                        
-                        Thanks,
-                        Your Reminder App
-                    """
-                    send_email(user_email, subject, body)
-                    # ❗ Remove after sending
-                else:
-                    updated_reminders.append(reminder)
-            except Exception as e:
-                print(f"[ERROR] Processing a reminder for user {user_id}: {e}")
-                updated_reminders.append(reminder)
+            print(f"[ERROR] Rebuilding spending summary for {user_id}: {e}")
+    print(f"[INFO] Rebuilt spending summaries for {len(user_ids)} user(s)")
 
+def rebuild_search():
+    user_ids = dispatcher.get_user_ids()
+    for user_id in user_ids:
         try:
-            s3.put_object(
-                Bucket=BUCKET_NAME,
-                Key=reminder_key,
-                Body=json.dumps(updated_reminders).encode('utf-8'),
-                ContentType='application/json'
-            )
-            print(f"[INFO] Updated reminders.json for {user_id}. Remaining: {len(updated_reminders)}")
+            records = invoice_store.records(user_id)
+            search_index.rebuild(user_id, [(r["invoice_id"], document_text(r["extracted"])) for r in records])
         except Exception as e:
-            print(f"[ERROR] Updating reminders.json for {user_id}: {e}")
-
-    return {"status": "Processed reminders"}
+            print(f"[ERROR] Rebuilding search index for {user_id}: {e}")
+    print(f"[INFO] Rebuilt search indexes for {len(user_ids)} user(s)")
 
 def lambda_handler(event, context):
     return check_reminders(event, context)
@@ -0,0 +1,373 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from botocore.exceptions import ClientError
+from chalicelib import telemetry
+from chalicelib.rate_limiter import RateLimiter
+from chalicelib.reminders import new_reminder_id, reminder_id
+from chalicelib.storage_service import PreconditionFailed
+
+
+def parse_reminder_time(reminder):
+    return datetime.fromisoformat(reminder["reminder_time"].replace("Z", "+00:00"))
+
+
+def is_due(reminder, now):
+    try:
+        return parse_reminder_time(reminder) <= now
+    except (KeyError, TypeError, ValueError):
+        return False
+
+
+# One email per user per run, listing every reminder that came due
+def build_digest(reminders):
+    if len(reminders) == 1:
+        reminder = reminders[0]
+        subject = f"📬 Reminder: {reminder['file_name']} is due!"
+        intro = (f"This is a reminder that your document **{reminder['file_name']}** is due on "
+                 f"{parse_reminder_time(reminder).strftime('%Y-%m-%d %H:%M:%S')} UTC.")
+    else:
+        subject = f"📬 Reminder: {len(reminders)} documents are due!"
+        lines = "\n".join(
+            f"  - {r['file_name']} (due {parse_reminder_time(r).strftime('%Y-%m-%d %H:%M:%S')} UTC)"
+            for r in reminders
+        )
+        intro = f"This is a reminder that the following documents are due:\n\n{lines}"
+
+    body = f"""Hello,
+
+{intro}
+
+Please take any necessary actions.
+
+Thanks,
+Your Reminder App
+"""
+    return subject, body
+
+
+# Progress of the current reminder run, so a run cut short by the Lambda
+# timeout is picked up by the next invocation with the same reference time
+# and without revisiting users it already finished. A checkpoint older than
+# RESUME_WINDOW is abandoned and a fresh run starts.
+#
+# The run document itself only changes at the start and end of a run, with
+# conditional writes so two overlapping runs don't overwrite each other's
+# checkpoint. Each finished user gets its own empty marker under
+# reminders/checkpoint/{run_id}/, so completing a user is one small put that
+# doesn't wait on the other workers. Markers of finished runs should be
+# expired by a bucket lifecycle rule on reminders/checkpoint/.
+class RunCheckpoint:
+    KEY = 'reminders/checkpoint.json'
+    MARKER_PREFIX = 'reminders/checkpoint/'
+    RESUME_WINDOW = 60 * 60
+
+    def __init__(self, storage_service, resume_window=RESUME_WINDOW):
+        self.storage = storage_service
+        self.resume_window = resume_window
+        self.doc = None
+        self.etag = None
+        self.completed = set()
+
+    def begin(self, now=None):
+        previous, etag = self.storage.get_json_with_etag(self.KEY)
+
+        if self._resumable(previous):
+            return self._resume(previous, etag)
+
+        doc = {
+            "run_id": new_reminder_id(),
+            "status": "running",
+            "started_at": time.time(),
+            "now": (now or datetime.now(timezone.utc)).isoformat()
+        }
+        try:
+            self.etag = self.storage.put_json(self.KEY, doc, if_match=etag, if_none_match=etag is None)
+        except PreconditionFailed:
+            # Another invocation started a run in between; carry on with that one
+            previous, etag = self.storage.get_json_with_etag(self.KEY)
+            if self._resumable(previous):
+                return self._resume(previous, etag)
+            raise
+        self.doc = doc
+        self.completed = set()
+        return self.doc
+
+    def _resumable(self, doc):
+        return (doc is not None and doc.get("status") == "running"
+                and time.time() - doc["started_at"] < self.resume_window)
+
+    def _resume(self, doc, etag):
+        self.doc, self.etag = doc, etag
+        prefix = self._marker_prefix()
+        self.completed = {obj['key'][len(prefix):] for obj in self.storage.list(prefix)}
+        # Checkpoints written before the markers kept the list in the document
+        self.completed.update(doc.get("completed", ()))
+        print(f"[INFO] Resuming reminder run {doc['run_id']} "
+              f"({len(self.completed)} user(s) already done)")
+        return self.doc
+
+    def _marker_prefix(self):
+        return f"{self.MARKER_PREFIX}{self.doc['run_id']}/"
+
+    @property
+    def now(self):
+        return datetime.fromisoformat(self.doc["now"])
+
+    def is_completed(self, user_id):
+        return user_id in self.completed
+
+    def complete(self, user_id):
+        self.storage.put_bytes(f"{self._marker_prefix()}{user_id}", b'')
+        self.completed.add(user_id)
+
+    def finish(self):
+        doc = dict(self.doc, status="done", finished_at=time.time())
+        try:
+            self.etag = self.storage.put_json(self.KEY, doc, if_match=self.etag)
+            self.doc = doc
+        except PreconditionFailed:
+            print(f"[WARN] Reminder run {self.doc['run_id']} was superseded; leaving the newer checkpoint")
+
+
+# Fans the reminder job out over the users found in the due index. Users are
+# processed on a bounded thread pool and isolated from each other: a failure
+# leaves that user's due markers in place for the next run and doesn't stop
+# the others. All SES sends share one rate limiter and addresses come from
+# the cached EmailDirectory. Clients are passed in so the dispatcher can run
+# against stubs.
+#
+# Delivery is exactly-once per reminder id as far as S3 allows: before
+# sending, each due reminder is claimed with a create-only marker at
+# reminders/sent/{user_id}/{reminder_id}, flipped to "sent" once SES accepts
+# the email, and only then removed from reminders.json with a conditional
+# write, so a run that dies at any point never mails the same reminder twice
+# and never drops a reminder created concurrently. The one gap is a crash
+# between SES accepting the email and the marker flipping; such a claim is
+# retried after CLAIM_LEASE. Sent markers are small and should be expired by
+# a bucket lifecycle rule on reminders/sent/.
+class ReminderDispatcher:
+    MAX_WORKERS = 8
+    SES_RATE = 14          # SES default maximum send rate (emails/second)
+    CLAIM_LEASE = 15 * 60  # seconds before an unfinished claim can be retaken
+    SENT_PREFIX = 'reminders/sent/'
+    TIME_MARGIN = 30 * 1000  # stop starting new users this close to the Lambda timeout (ms)
+
+    def __init__(self, storage_service, ses_client, email_directory, sender, due_index,
+                 max_workers=MAX_WORKERS, ses_rate=SES_RATE, checkpoint=None):
+        self.storage = storage_service
+        self.ses = ses_client
+        self.email_directory = email_directory
+        self.sender = sender
+        self.due_index = due_index
+        self.max_workers = max_workers
+        self.ses_limiter = RateLimiter(ses_rate)
+        self.checkpoint = checkpoint or RunCheckpoint(storage_service)
+
+    # `context` is the Lambda context; when given, users not started before
+    # the timeout margin are left for the next invocation to resume.
+    def run(self, now=None, context=None):
+        started = time.monotonic()
+        self.checkpoint.begin(now)
+        now = self.checkpoint.now
+        run_id = self.checkpoint.doc["run_id"]
+        due_users = {
+            user_id: buckets
+            for user_id, buckets in self.due_index.due_users(now).items()
+            if not self.checkpoint.is_completed(user_id)
+        }
+
+        summary = {
+            "run_id": run_id,
+            "users_scanned": len(due_users),
+            "users_notified": 0,
+            "users_failed": 0,
+            "users_deferred": 0,
+            "emails_sent": 0,
+            "reminders_sent": 0,
+            "reminders_skipped": 0,
+            "reminders_pending": 0
+        }
+        if due_users:
+            self.email_directory.prefetch(list(due_users))
+            current_bucket = self.due_index.bucket_for(now)
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(due_users))) as pool:
+                outcomes = pool.map(
+                    lambda item: self._run_user(item[0], item[1], now, current_bucket, run_id, context),
+                    due_users.items()
+                )
+                for outcome in outcomes:
+                    if outcome is None:
+                        summary["users_failed"] += 1
+                        continue
+                    if outcome.get("deferred"):
+                        summary["users_deferred"] += 1
+                        continue
+                    summary["reminders_sent"] += outcome["sent"]
+                    summary["reminders_skipped"] += outcome["skipped"]
+                    summary["reminders_pending"] += outcome["pending"]
+                    if outcome["sent"]:
+                        summary["users_notified"] += 1
+                        summary["emails_sent"] += 1
+            self.email_directory.save()
+
+        if not summary["users_deferred"]:
+            self.checkpoint.finish()
+        summary["duration_seconds"] = round(time.monotonic() - started, 3)
+        print(f"[INFO] Reminder run summary: {json.dumps(summary)}")
+        return summary
+
+    def _out_of_time(self, context):
+        return context is not None and context.get_remaining_time_in_millis() < self.TIME_MARGIN
+
+    def _run_user(self, user_id, buckets, now, current_bucket, run_id, context):
+        if self._out_of_time(context):
+            return {"deferred": True}
+        try:
+            outcome = self.process_user(user_id, now, run_id)
+            if outcome is None:
+                return None
+            # Markers for the current hour stay: later reminders in it aren't due yet
+            self.due_index.clear(user_id, [b for b in buckets if b != current_bucket])
+            if outcome["pending"]:
+                self.due_index.mark(user_id, now)
+            self.checkpoint.complete(user_id)
+            return outcome
+        except Exception as e:
+            print(f"[ERROR] Processing reminders for {user_id}: {e}")
+            return None
+
+    # Sends one digest for the user's due reminders that no other run has
+    # claimed or sent, then removes every delivered reminder from
+    # reminders.json. Returns {"sent": n, "skipped": k, "pending": m}, or None
+    # if the user's reminders couldn't be read or written.
+    def process_user(self, user_id, now, run_id=None):
+        run_id = run_id or new_reminder_id()
+        try:
+            reminders = self.load_reminders(user_id)
+        except Exception as e:
+            print(f"[ERROR] Failed to read reminder file for {user_id}: {e}")
+            return None
+
+        due = [r for r in reminders if is_due(r, now)]
+        if not due:
+            return {"sent": 0, "skipped": 0, "pending": 0}
+
+        user_email = self.email_directory.get(user_id)
+        if not user_email:
+            print(f"[WARN] No email for user {user_id}. Skipping.")
+            return {"sent": 0, "skipped": 0, "pending": len(due)}
+
+        claimed, already_sent, busy = [], [], []
+        for reminder in due:
+            state = self.claim(user_id, reminder_id(reminder), run_id)
+            {"claimed": claimed, "sent": already_sent, "busy": busy}[state].append(reminder)
+
+        delivered = list(already_sent)
+        if claimed:
+            subject, body = build_digest(claimed)
+            if self.send_email(user_email, subject, body):
+                for reminder in claimed:
+                    self.mark_sent(user_id, reminder_id(reminder), run_id)
+                delivered.extend(claimed)
+            else:
+                for reminder in claimed:
+                    self.release(user_id, reminder_id(reminder))
+                busy.extend(claimed)
+                claimed = []
+
+        if delivered:
+            delivered_ids = {reminder_id(r) for r in delivered}
+
+            def remove_delivered(doc):
+                before = len(doc)
+                doc[:] = [r for r in doc if reminder_id(r) not in delivered_ids]
+                return len(doc) != before
+
+            try:
+                remaining = self.storage.update_json(
+                    f"uploads/{user_id}/reminders.json", remove_delivered, default=list
+                )
+            except Exception as e:
+                # Delivery is recorded in the sent markers; the next run drops them
+                print(f"[ERROR] Updating reminders.json for {user_id}: {e}")
+                return None
+            telemetry.debug(f"Sent {len(claimed)} reminder(s) to {user_id}. Remaining: {len(remaining)}")
+        return {"sent": len(claimed), "skipped": len(already_sent), "pending": len(busy)}
+
+    def _sent_key(self, user_id, rid):
+        return f"{self.SENT_PREFIX}{user_id}/{rid}"
+
+    def _put_marker(self, user_id, rid, marker, **conditions):
+        self.storage.put_json(self._sent_key(user_id, rid), marker, **conditions)
+
+    # "claimed" if this run now owns the reminder, "sent" if it was already
+    # delivered, "busy" if another run holds a live claim on it
+    def claim(self, user_id, rid, run_id):
+        marker = {"state": "sending", "run_id": run_id, "claimed_at": time.time()}
+        try:
+            self._put_marker(user_id, rid, marker, if_none_match=True)
+            return "claimed"
+        except PreconditionFailed:
+            pass
+
+        existing, etag = self.storage.get_json_with_etag(self._sent_key(user_id, rid))
+        if existing is None:
+            return "busy"   # released in between; retry next run
+        if existing.get("state") == "sent":
+            return "sent"
+        if time.time() - existing.get("claimed_at", 0) < self.CLAIM_LEASE:
+            return "busy"
+        try:
+            self._put_marker(user_id, rid, marker, if_match=etag)
+            return "claimed"
+        except PreconditionFailed:
+            return "busy"
+
+    def mark_sent(self, user_id, rid, run_id):
+        self._put_marker(user_id, rid, {"state": "sent", "run_id": run_id, "sent_at": time.time()})
+
+    def release(self, user_id, rid):
+        self.storage.delete(self._sent_key(user_id, rid))
+
+    def load_reminders(self, user_id):
+        return self.storage.get_json(f"uploads/{user_id}/reminders.json", [])
+
+    def send_email(self, to_address, subject, body):
+        self.ses_limiter.acquire()
+        try:
+            response = self.ses.send_email(
+                Source=self.sender,
+                Destination={'ToAddresses': [to_address]},
+                Message={
+                    'Subject': {'Data': subject},
+                    'Body': {'Text': {'Data': body}},
+                },
+            )
+            telemetry.debug(f"Email sent to {to_address}, message ID {response['MessageId']}")
+            return True
+        except ClientError as e:
+            print(f"[ERROR] Sending email to {to_address}: {e.response['Error']['Message']}")
+            return False
+
+    def get_user_ids(self):
+        return [prefix.split('/')[1] for prefix in self.storage.list_prefixes('uploads/')]
+
+    # One-off: index reminders that were scheduled before the due index existed
+    def backfill_due_index(self):
+        marked = 0
+        for user_id in self.get_user_ids():
+            reminders = self.load_reminders(user_id)
+            buckets = {}
+            for reminder in reminders:
+                try:
+                    reminder_time = parse_reminder_time(reminder)
+                except (KeyError, TypeError, ValueError):
+                    continue
+                buckets.setdefault(self.due_index.bucket_for(reminder_time), reminder_time)
+            for reminder_time in buckets.values():
+                self.due_index.mark(user_id, reminder_time)
+                marked += 1
+        print(f"[INFO] Backfilled {marked} due-index marker(s)")
+        return marked
@@ -0,0 +1,48 @@
+from datetime import timezone
+
+# Hourly due-time index for reminders. Scheduling a reminder drops an empty
+# marker object at reminders/due/{YYYY-MM-DDTHH}/{user_id}; the scheduler
+# lists only the buckets whose hour has started and only opens the
+# reminders.json of users found there. Keys sort chronologically, so the
+# bucket listing stops at the first future hour.
+class ReminderDueIndex:
+    PREFIX = 'reminders/due/'
+    BUCKET_FORMAT = '%Y-%m-%dT%H'
+
+    def __init__(self, storage_service):
+        self.storage = storage_service
+
+    def bucket_for(self, when):
+        return when.astimezone(timezone.utc).strftime(self.BUCKET_FORMAT)
+
+    def _marker_key(self, bucket, user_id):
+        return f"{self.PREFIX}{bucket}/{user_id}"
+
+    def mark(self, user_id, reminder_time):
+        self.storage.put_bytes(self._marker_key(self.bucket_for(reminder_time), user_id), b'')
+
+    # Buckets up to and including the current hour, oldest first
+    def due_buckets(self, now):
+        current = self.bucket_for(now)
+        for prefix in self.storage.list_prefixes(self.PREFIX):
+            bucket = prefix[len(self.PREFIX):-1]
+            if bucket > current:
+                return
+            yield bucket
+
+    def users_in(self, bucket):
+        prefix = f"{self.PREFIX}{bucket}/"
+        for obj in self.storage.list(prefix):
+            yield obj['key'][len(prefix):]
+
+    # {user_id: [bucket, ...]} for every user with a marker in a due bucket
+    def due_users(self, now):
+        users = {}
+        for bucket in self.due_buckets(now):
+            for user_id in self.users_in(bucket):
+                users.setdefault(user_id, []).append(bucket)
+        return users
+
+    def clear(self, user_id, buckets):
+        for bucket in buckets:
+            self.storage.delete(self._marker_key(bucket, user_id))
@@ -0,0 +1,60 @@
+import hashlib
+import uuid
+from datetime import date, datetime, time, timedelta, timezone
+from chalicelib.date_parsing import parse_date
+
+# How reminders are scheduled, shared by uploads and /create-reminder:
+# REMINDER_LEAD before the due date, or MIN_DELAY from now if that moment has
+# already passed. Without a usable due date the reminder goes out after
+# DEFAULT_DELAY.
+REMINDER_LEAD = timedelta(hours=24)
+DEFAULT_DELAY = timedelta(hours=24)
+MIN_DELAY = timedelta(minutes=15)
+
+
+# Reminders get a random id when they're created; ones written before that
+# get a stable id derived from what identifies them.
+def reminder_id(reminder):
+    if reminder.get("id"):
+        return reminder["id"]
+    source = f"{reminder.get('file_name')}|{reminder.get('reminder_time')}"
+    return hashlib.sha1(source.encode('utf-8')).hexdigest()[:16]
+
+
+def new_reminder_id():
+    return uuid.uuid4().hex
+
+
+def format_time(when):
+    return when.astimezone(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+# Returns (due_at, reminder_time); due_at is None when `due_date` (a date or
+# any string date_parsing understands) is missing or unreadable.
+def reminder_time_for(due_date, now=None, vendor=None):
+    now = now or datetime.now(timezone.utc)
+    if isinstance(due_date, str):
+        due_date = parse_date(due_date, vendor=vendor)
+    if not isinstance(due_date, date):
+        return None, now + DEFAULT_DELAY
+
+    due_at = datetime.combine(due_date, time.min, tzinfo=timezone.utc)
+    reminder_time = due_at - REMINDER_LEAD
+    if reminder_time < now:
+        reminder_time = now + MIN_DELAY
+    return due_at, reminder_time
+
+
+# Returns (reminder, reminder_time) for a new reminders.json entry
+def build_reminder(file_name, due_date=None, vendor=None, now=None):
+    now = now or datetime.now(timezone.utc)
+    due_at, reminder_time = reminder_time_for(due_date, now, vendor)
+    reminder = {
+        "id": new_reminder_id(),
+        "file_name": file_name,
+        "created_at": now.isoformat(),
+        "reminder_time": format_time(reminder_time)
+    }
+    if due_at is not None:
+        reminder["due_date"] = format_time(due_at)
+    return reminder, reminder_time
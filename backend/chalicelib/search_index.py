@@ -0,0 +1,268 @@
+import re
+import time
+import unicodedata
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from chalicelib.storage_service import ConcurrentUpdateError
+
+SEARCH_VERSION = 1
+MAX_TOKENS_PER_DOCUMENT = 2000
+
+# Words, and numbers with their separators kept ("143.22", "1,234.50")
+_TOKEN_RE = re.compile(r"[^\W_]+(?:[.,][^\W_]+)*")
+_SHARD_CHARS = set('abcdefghijklmnopqrstuvwxyz0123456789')
+
+
+# Apply one posting to `loaded` ({shard: {token: ids}}), in place, for the
+# tokens that fall in `only`
+def _apply_posting(loaded, posting, only):
+    invoice_id = posting["invoice_id"]
+    for token in posting["added"]:
+        shard = shard_for(token)
+        if shard in only:
+            ids = loaded[shard].get(token, [])
+            if invoice_id not in ids:
+                loaded[shard][token] = sorted(ids + [invoice_id])
+    for token in posting["removed"]:
+        shard = shard_for(token)
+        if shard in only and invoice_id in loaded[shard].get(token, ()):
+            remaining = [i for i in loaded[shard][token] if i != invoice_id]
+            if remaining:
+                loaded[shard][token] = remaining
+            else:
+                del loaded[shard][token]
+
+
+# Lower-cased, accent-free tokens of `text`, in order of appearance
+def tokenize(text):
+    text = unicodedata.normalize('NFKD', text.casefold())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return _TOKEN_RE.findall(text)
+
+
+def shard_for(token):
+    return token[0] if token[0] in _SHARD_CHARS else '_'
+
+
+# What gets indexed for an invoice: every line Textract read plus the
+# extracted field values (older records only have the fields)
+def document_text(extracted):
+    extracted = extracted or {}
+    parts = [extracted.get('Text') or '']
+    parts.extend(v for k, v in extracted.items() if k != 'Text' and isinstance(v, str))
+    return "\n".join(parts)
+
+
+# Distinct tokens, capped to the first MAX_TOKENS_PER_DOCUMENT
+def _document_tokens(text):
+    distinct = dict.fromkeys(tokenize(text or ''))
+    return set(list(distinct)[:MAX_TOKENS_PER_DOCUMENT])
+
+
+# Query terms as (token, is_prefix). A term ending in '*' matches every token
+# starting with it; other terms match whole tokens. All terms must match.
+def parse_query(query):
+    terms = []
+    for word in query.split():
+        tokens = tokenize(word)
+        if not tokens:
+            continue
+        for token in tokens[:-1]:
+            terms.append((token, False))
+        terms.append((tokens[-1], word.endswith('*')))
+    return terms
+
+
+# Lines of `text` containing one of the query's terms
+def matching_lines(text, query, limit=3):
+    terms = parse_query(query)
+    found = []
+    for line in (text or '').splitlines():
+        tokens = tokenize(line)
+        if any(t == term or (prefix and t.startswith(term)) for term, prefix in terms for t in tokens):
+            found.append(line.strip())
+            if len(found) == limit:
+                break
+    return found
+
+
+# Per-user inverted index over invoice text: token -> sorted invoice ids,
+# split into one shard per leading character at
+# uploads/{user}/search/{c}.json, so a query reads only the shards of its
+# terms and searching never touches invoice records.
+#
+# Uploads and reanalysis don't rewrite shards: each writes one small posting
+# (the tokens an invoice gained and lost) under search/postings/, named so
+# they list oldest first. A search folds the outstanding postings into what
+# it read, and once there are more than COMPACT_AT of them merges them into
+# the shards with conditional writes and deletes them. Updating the index
+# therefore costs one put per invoice however large the index grows, and
+# concurrent uploads never conflict on it.
+class SearchIndex:
+    UPDATE_RETRIES = 12
+    WORKERS = 8
+    COMPACT_AT = 50
+
+    def __init__(self, storage_service):
+        self.storage = storage_service
+
+    def _prefix(self, user_id):
+        return f"uploads/{user_id}/search/"
+
+    def _shard_key(self, user_id, shard):
+        return f"{self._prefix(user_id)}{shard}.json"
+
+    def _postings_prefix(self, user_id):
+        return f"{self._prefix(user_id)}postings/"
+
+    def _stale_key(self, user_id):
+        return f"{self._prefix(user_id)}stale.json"
+
+    def _empty(self):
+        return {"version": SEARCH_VERSION, "tokens": {}}
+
+    # `added` and `removed` are (invoice_id, text) pairs. For an invoice in
+    # both (a reanalysis) only the tokens that changed are recorded.
+    def update(self, user_id, added=(), removed=()):
+        removed_tokens = {}
+        for invoice_id, text in removed:
+            removed_tokens.setdefault(invoice_id, set()).update(_document_tokens(text))
+        added_tokens = {}
+        for invoice_id, text in added:
+            added_tokens.setdefault(invoice_id, set()).update(_document_tokens(text))
+
+        postings = []
+        for invoice_id in added_tokens.keys() | removed_tokens.keys():
+            new = added_tokens.get(invoice_id, set())
+            old = removed_tokens.get(invoice_id, set())
+            if new - old or old - new:
+                postings.append({
+                    "version": SEARCH_VERSION,
+                    "invoice_id": invoice_id,
+                    "added": sorted(new - old),
+                    "removed": sorted(old - new)
+                })
+        if not postings:
+            return
+
+        def write(posting):
+            key = f"{self._postings_prefix(user_id)}{time.time_ns():020d}-{uuid.uuid4().hex[:8]}.json"
+            self.storage.put_json(key, posting)
+
+        with ThreadPoolExecutor(max_workers=min(self.WORKERS, len(postings))) as pool:
+            list(pool.map(write, postings))
+
+    # Flag the index as missing updates; the next search rebuilds it
+    def mark_stale(self, user_id):
+        self.storage.put_json(self._stale_key(user_id), {"marked_at": time.time()})
+
+    def is_stale(self, user_id):
+        return self.storage.exists(self._stale_key(user_id))
+
+    # Ids of the invoices matching every term of `query`
+    def search(self, user_id, query):
+        terms = parse_query(query)
+        if not terms:
+            return set()
+
+        postings = self._load_postings(user_id)
+        if len(postings) > self.COMPACT_AT:
+            try:
+                self.compact(user_id, postings)
+                postings = []
+            except ConcurrentUpdateError as e:
+                print(f"[WARN] Search index for {user_id} not compacted ({e})")
+
+        shards = {shard_for(token) for token, _ in terms}
+        with ThreadPoolExecutor(max_workers=min(self.WORKERS, len(shards))) as pool:
+            loaded = dict(zip(shards, pool.map(lambda s: self._load_shard(user_id, s), shards)))
+        for _, posting in postings:
+            _apply_posting(loaded, posting, only=shards)
+
+        matched = None
+        for token, prefix in terms:
+            tokens = loaded[shard_for(token)]
+            if prefix:
+                ids = set()
+                for candidate, candidate_ids in tokens.items():
+                    if candidate.startswith(token):
+                        ids.update(candidate_ids)
+            else:
+                ids = set(tokens.get(token, ()))
+            matched = ids if matched is None else matched & ids
+            if not matched:
+                return set()
+        return matched
+
+    # Merge `postings` ((key, posting) pairs, oldest first) into the shards,
+    # then delete them. A failed shard write leaves every posting in place;
+    # applying one again is harmless.
+    def compact(self, user_id, postings=None):
+        if postings is None:
+            postings = self._load_postings(user_id)
+        if not postings:
+            return 0
+
+        shards = {}
+        for _, posting in postings:
+            for token in posting["added"] + posting["removed"]:
+                shards.setdefault(shard_for(token), None)
+
+        def apply(shard):
+            def mutate(doc):
+                if doc.get("version") != SEARCH_VERSION:
+                    doc.clear()
+                    doc.update(self._empty())
+                before = {t: list(ids) for t, ids in doc["tokens"].items()}
+                loaded = {shard: doc["tokens"]}
+                for _, posting in postings:
+                    _apply_posting(loaded, posting, only={shard})
+                return doc["tokens"] != before
+
+            self.storage.update_json(self._shard_key(user_id, shard), mutate, default=self._empty,
+                                     retries=self.UPDATE_RETRIES)
+
+        with ThreadPoolExecutor(max_workers=min(self.WORKERS, len(shards))) as pool:
+            list(pool.map(apply, shards))
+        for key, _ in postings:
+            self.storage.delete(key)
+        return len(postings)
+
+    def _load_postings(self, user_id):
+        keys = [obj['key'] for obj in self.storage.list(self._postings_prefix(user_id))]
+        if not keys:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.WORKERS, len(keys))) as pool:
+            docs = list(pool.map(self.storage.get_json, keys))
+        return [(key, doc) for key, doc in zip(keys, docs) if doc and doc.get("version") == SEARCH_VERSION]
+
+    def _load_shard(self, user_id, shard):
+        doc = self.storage.get_json(self._shard_key(user_id, shard))
+        if doc is None or doc.get("version") != SEARCH_VERSION:
+            return {}
+        return doc["tokens"]
+
+    # Rewrite every shard from `documents`, (invoice_id, text) pairs for all
+    # of the user's invoices, and drop shards nothing maps to any more.
+    # Postings are left alone: folding them in again is harmless, and they
+    # may carry updates the documents were read too early to include.
+    def rebuild(self, user_id, documents):
+        shards = {}
+        for invoice_id, text in documents:
+            for token in _document_tokens(text):
+                shards.setdefault(shard_for(token), {}).setdefault(token, set()).add(invoice_id)
+
+        for shard, tokens in shards.items():
+            doc = self._empty()
+            doc["tokens"] = {token: sorted(ids) for token, ids in sorted(tokens.items())}
+            self.storage.put_json(self._shard_key(user_id, shard), doc)
+
+        prefix = self._prefix(user_id)
+        for obj in list(self.storage.list(prefix)):
+            name = obj['key'][len(prefix):]
+            if '/' in name or name == 'stale.json':
+                continue
+            if name.rsplit('.', 1)[0] not in shards:
+                self.storage.delete(obj['key'])
+        self.storage.delete(self._stale_key(user_id))
+        return len(shards)
@@ -0,0 +1,246 @@
+import random
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from chalicelib.storage_service import BACKOFF_BASE, BACKOFF_CAP, ConcurrentUpdateError, PreconditionFailed
+
+SUMMARY_VERSION = 1
+UNKNOWN_VENDOR = 'Unknown'
+DUE_WINDOWS = (7, 30)   # days ahead reported as upcoming
+
+
+def _today():
+    return datetime.now(timezone.utc).date()
+
+
+def _cents(amount):
+    return None if amount is None else int(round(amount * 100))
+
+
+def _amount(cents):
+    return round(cents / 100, 2)
+
+
+# Add (sign=1) or take back (sign=-1) one invoice in a {key: {count, cents}}
+# group. Taking back from a bucket that was pruned is a no-op.
+def _bump(group, key, cents, sign):
+    bucket = group.get(key)
+    if bucket is None:
+        if sign < 0:
+            return
+        bucket = group[key] = {"count": 0, "cents": 0}
+    bucket["count"] += sign
+    bucket["cents"] += sign * cents
+    if bucket["count"] <= 0:
+        del group[key]
+
+
+def _add_entry(doc, entry, sign):
+    amount = _cents(entry.get("amount"))
+    cents = amount or 0
+    doc["invoice_count"] += sign
+    if amount is None:
+        doc["unpriced_count"] += sign
+    doc["total_cents"] += sign * cents
+    _bump(doc["by_vendor"], entry.get("vendor") or UNKNOWN_VENDOR, cents, sign)
+    _bump(doc["by_month"], entry["created_at"][:7], cents, sign)
+    if entry.get("due_date"):
+        _bump(doc["by_due_date"], entry["due_date"], cents, sign)
+
+
+# A parked change is already in the index summaries `entries` (by invoice
+# id) when every invoice it added is there unchanged, or, for a removal,
+# when the invoice is gone
+def _reflected(change, entries):
+    if change["added"]:
+        return all(entries.get(e["invoice_id"]) == e for e in change["added"])
+    return all(e["invoice_id"] not in entries for e in change["removed"])
+
+
+def _group_list(group, name):
+    return [
+        {name: key, "total": _amount(bucket["cents"]), "count": bucket["count"]}
+        for key, bucket in group.items()
+    ]
+
+
+# Per-user spending totals (overall, by vendor, by upload month and by due
+# date) in uploads/{user}/invoices/spending.json, built from the invoice
+# index summaries. Uploads and reanalysis apply their change to the totals
+# with a conditional write, so /spending-summary is one small read no matter
+# how many invoices a user has. Amounts are kept in cents so adding and
+# taking back never drifts, and due dates in the past are pruned as the
+# document is written. A user without the document gets it built from the
+# index on the first read. A change that still conflicts after
+# UPDATE_RETRIES is parked under invoices/spending-pending/ and folded in by
+# the next read; the document remembers the last APPLIED_KEPT parked changes
+# it applied so two readers can't count one twice. A rebuild marks the
+# document first and writes its result only if nothing changed it since, so
+# a change landing while the totals are recomputed is never lost.
+class SpendingSummary:
+    UPDATE_RETRIES = 12
+    APPLIED_KEPT = 200
+
+    def __init__(self, storage_service):
+        self.storage = storage_service
+
+    def _key(self, user_id):
+        return f"uploads/{user_id}/invoices/spending.json"
+
+    def _pending_prefix(self, user_id):
+        return f"uploads/{user_id}/invoices/spending-pending/"
+
+    def _empty(self):
+        return {
+            "version": SUMMARY_VERSION,
+            "invoice_count": 0,
+            "unpriced_count": 0,
+            "total_cents": 0,
+            "by_vendor": {},
+            "by_month": {},
+            "by_due_date": {}
+        }
+
+    # `added` and `removed` are invoice index summaries
+    def apply(self, user_id, added=(), removed=()):
+        if not added and not removed:
+            return
+        try:
+            self._update(user_id, [(None, {"added": list(added), "removed": list(removed)})])
+        except ConcurrentUpdateError as e:
+            print(f"[WARN] Spending summary for {user_id} not updated ({e}); applying on next read")
+            name = f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}"
+            self.storage.put_json(f"{self._pending_prefix(user_id)}{name}.json",
+                                  {"added": list(added), "removed": list(removed)})
+
+    # Apply (name, change) pairs to the document; `name` is the parked
+    # change's name, or None for one applied directly
+    def _update(self, user_id, changes):
+        today = _today().isoformat()
+
+        def mutate(doc):
+            # Nothing to update until the first read builds the document
+            if doc.get("version") != SUMMARY_VERSION:
+                return False
+            if "total_cents" not in doc:
+                # The first rebuild is under way; touching the document
+                # makes it recompute with this change in the index
+                doc["touched_at"] = datetime.now(timezone.utc).isoformat()
+                return True
+            applied = doc.get("applied", [])
+            for name, change in changes:
+                if name in applied:
+                    continue
+                for entry in change["removed"]:
+                    _add_entry(doc, entry, -1)
+                for entry in change["added"]:
+                    _add_entry(doc, entry, 1)
+                if name:
+                    applied.append(name)
+            doc["applied"] = applied[-self.APPLIED_KEPT:]
+            doc["by_due_date"] = {d: b for d, b in doc["by_due_date"].items() if d >= today}
+            doc["updated_at"] = datetime.now(timezone.utc).isoformat()
+            return True
+
+        return self.storage.update_json(self._key(user_id), mutate, default=dict, retries=self.UPDATE_RETRIES)
+
+    # Fold parked changes into the document and delete them
+    def _apply_pending(self, user_id, doc):
+        prefix = self._pending_prefix(user_id)
+        keys = [obj['key'] for obj in self.storage.list(prefix)]
+        if not keys:
+            return doc
+        changes = [(key[len(prefix):], self.storage.get_json(key)) for key in keys]
+        try:
+            doc = self._update(user_id, [(name, change) for name, change in changes if change])
+        except ConcurrentUpdateError as e:
+            print(f"[WARN] Pending spending changes for {user_id} not applied yet ({e})")
+            return doc
+        for key in keys:
+            self.storage.delete(key)
+        return doc
+
+    # Recompute the totals from `load_entries()` (every index summary of the
+    # user). The document is marked as rebuilding first, so an update that
+    # lands meanwhile changes it and the write below, conditional on the
+    # marked ETag, fails and the totals are recomputed. Parked changes are
+    # listed after the entries are read: those the entries already reflect
+    # are only recorded as applied, the rest are folded in.
+    def rebuild(self, user_id, load_entries):
+        key = self._key(user_id)
+        prefix = self._pending_prefix(user_id)
+        for attempt in range(self.UPDATE_RETRIES):
+            if attempt:
+                time.sleep(random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt)))
+            current, etag = self.storage.get_json_with_etag(key)
+            current = current if current and current.get("version") == SUMMARY_VERSION else None
+            if attempt and current and "total_cents" in current and "rebuilding" not in current:
+                # Another rebuild finished while this one conflicted
+                return self._apply_pending(user_id, current)
+            if current is None or "rebuilding" not in current:
+                # Join a rebuild already under way rather than restarting it
+                current = current or {"version": SUMMARY_VERSION}
+                current["rebuilding"] = datetime.now(timezone.utc).isoformat()
+                try:
+                    etag = self.storage.put_json(key, current, if_match=etag, if_none_match=etag is None)
+                except PreconditionFailed:
+                    continue
+
+            entries = {entry["invoice_id"]: entry for entry in load_entries()}
+            parked = [obj['key'] for obj in self.storage.list(prefix)]
+            doc = self._empty()
+            for entry in entries.values():
+                _add_entry(doc, entry, 1)
+            applied = []
+            for parked_key in parked:
+                change = self.storage.get_json(parked_key)
+                if change is None:
+                    continue
+                if not _reflected(change, entries):
+                    for entry in change["removed"]:
+                        _add_entry(doc, entry, -1)
+                    for entry in change["added"]:
+                        _add_entry(doc, entry, 1)
+                applied.append(parked_key[len(prefix):])
+            today = _today().isoformat()
+            doc["applied"] = applied[-self.APPLIED_KEPT:]
+            doc["by_due_date"] = {d: b for d, b in doc["by_due_date"].items() if d >= today}
+            doc["updated_at"] = datetime.now(timezone.utc).isoformat()
+            try:
+                self.storage.put_json(key, doc, if_match=etag)
+            except PreconditionFailed:
+                continue
+            for parked_key in parked:
+                self.storage.delete(parked_key)
+            return doc
+        raise ConcurrentUpdateError(f"{key} kept changing; gave up rebuilding after {self.UPDATE_RETRIES} tries.")
+
+    def load(self, user_id):
+        doc = self.storage.get_json(self._key(user_id))
+        # Missing, outdated, or only marked by a first rebuild still running
+        if doc is None or doc.get("version") != SUMMARY_VERSION or "total_cents" not in doc:
+            return None
+        return self._apply_pending(user_id, doc)
+
+    # The response for /spending-summary. Vendors are largest total first,
+    # months oldest first, and due windows count from `today`.
+    def report(self, doc, today=None):
+        today = today or _today()
+        due = sorted(doc["by_due_date"].items())
+        upcoming = {}
+        for days in DUE_WINDOWS:
+            until = (today + timedelta(days=days)).isoformat()
+            window = [b for d, b in due if today.isoformat() <= d <= until]
+            upcoming[f"next_{days}_days"] = {
+                "total": _amount(sum(b["cents"] for b in window)),
+                "count": sum(b["count"] for b in window)
+            }
+        return {
+            "invoice_count": doc["invoice_count"],
+            "unpriced_count": doc["unpriced_count"],
+            "total": _amount(doc["total_cents"]),
+            "by_vendor": sorted(_group_list(doc["by_vendor"], "vendor"), key=lambda g: (-g["total"], g["vendor"])),
+            "by_month": sorted(_group_list(doc["by_month"], "month"), key=lambda g: g["month"]),
+            "upcoming": upcoming,
+            "updated_at": doc.get("updated_at")
+        }
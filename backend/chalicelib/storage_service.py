@@ -1,20 +1,491 @@
-import boto3
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from botocore.exceptions import ClientError
+from chalicelib import compact_json
+from chalicelib.aws_clients import lazy_client
 
+# Error codes S3 returns when an IfMatch / IfNoneMatch write loses a race
+CONDITIONAL_FAILURE_CODES = ('PreconditionFailed', 'ConditionalRequestConflict')
+NOT_FOUND_CODES = ('NoSuchKey', '404', 'NotFound')
+
+# update_json retries: full-jitter exponential backoff, in seconds
+UPDATE_RETRIES = 10
+BACKOFF_BASE = 0.02
+BACKOFF_CAP = 1.0
+
+
+def is_conditional_failure(error):
+    return error.response.get('Error', {}).get('Code') in CONDITIONAL_FAILURE_CODES
+
+
+class ObjectNotFound(Exception):
+    pass
+
+
+# An IfMatch / IfNoneMatch write lost a race
+class PreconditionFailed(Exception):
+    pass
+
+
+# The backend can't do this (browser uploads on the local backend)
+class UnsupportedOperation(NotImplementedError):
+    pass
+
+
+class ConcurrentUpdateError(Exception):
+    pass
+
+
+# Object I/O against an S3 bucket. Objects come back as dicts with body,
+# etag, size, content_type, content_encoding and metadata; listings come back
+# a page at a time as {"objects": [{key, size, etag, last_modified}],
+# "prefixes": [...]}.
+class S3Backend:
+    SUPPORTS_DIRECT_UPLOADS = True
+
+    def __init__(self, bucket_name, client=None):
+        self.bucket_name = bucket_name
+        self.client = client or lazy_client('s3')
+
+    def get(self, key):
+        try:
+            obj = self.client.get_object(Bucket=self.bucket_name, Key=key)
+        except self.client.exceptions.NoSuchKey:
+            raise ObjectNotFound(key)
+        body = obj['Body'].read()
+        return {
+            'body': body,
+            'etag': obj['ETag'],
+            'size': len(body),
+            'content_type': obj.get('ContentType'),
+            'content_encoding': obj.get('ContentEncoding'),
+            'metadata': obj.get('Metadata', {})
+        }
+
+    def head(self, key):
+        try:
+            head = self.client.head_object(Bucket=self.bucket_name, Key=key)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in NOT_FOUND_CODES:
+                raise ObjectNotFound(key)
+            raise
+        return {
+            'etag': head['ETag'],
+            'size': head.get('ContentLength'),
+            'content_type': head.get('ContentType'),
+            'content_encoding': head.get('ContentEncoding'),
+            'metadata': head.get('Metadata', {})
+        }
+
+    def put(self, key, body, content_type=None, content_encoding=None, metadata=None,
+            if_match=None, if_none_match=False):
+        params = {}
+        if content_type:
+            params['ContentType'] = content_type
+        if content_encoding:
+            params['ContentEncoding'] = content_encoding
+        if metadata:
+            params['Metadata'] = metadata
+        if if_match:
+            params['IfMatch'] = if_match
+        elif if_none_match:
+            params['IfNoneMatch'] = '*'
+        try:
+            response = self.client.put_object(Bucket=self.bucket_name, Key=key, Body=body, **params)
+        except ClientError as e:
+            if is_conditional_failure(e):
+                raise PreconditionFailed(key)
+            raise
+        return response.get('ETag')
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket_name, Key=key)
+
+    # Server-side copy, keeping content type, encoding and metadata
+    def copy(self, source_key, key):
+        try:
+            response = self.client.copy_object(
+                Bucket=self.bucket_name, Key=key, CopySource={'Bucket': self.bucket_name, 'Key': source_key}
+            )
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in NOT_FOUND_CODES:
+                raise ObjectNotFound(source_key)
+            raise
+        return response['CopyObjectResult']['ETag']
+
+    def list_pages(self, prefix='', delimiter=None, start_after=None):
+        params = {'Bucket': self.bucket_name, 'Prefix': prefix}
+        if delimiter:
+            params['Delimiter'] = delimiter
+        if start_after:
+            params['StartAfter'] = start_after
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(**params):
+            yield {
+                'objects': [
+                    {
+                        'key': obj['Key'],
+                        'size': obj.get('Size'),
+                        'etag': obj.get('ETag'),
+                        'last_modified': obj.get('LastModified')
+                    }
+                    for obj in page.get('Contents', [])
+                ],
+                'prefixes': [p['Prefix'] for p in page.get('CommonPrefixes', [])]
+            }
+
+    # Browser uploads straight to the bucket
+    def presigned_put_url(self, key, content_type, metadata, expires_in):
+        return self.client.generate_presigned_url(
+            'put_object',
+            Params={'Bucket': self.bucket_name, 'Key': key, 'ContentType': content_type, 'Metadata': metadata},
+            ExpiresIn=expires_in
+        )
+
+    def create_multipart_upload(self, key, content_type, metadata):
+        upload = self.client.create_multipart_upload(
+            Bucket=self.bucket_name, Key=key, ContentType=content_type, Metadata=metadata
+        )
+        return upload['UploadId']
+
+    def presigned_part_url(self, key, upload_id, part_number, expires_in):
+        return self.client.generate_presigned_url(
+            'upload_part',
+            Params={'Bucket': self.bucket_name, 'Key': key, 'UploadId': upload_id, 'PartNumber': part_number},
+            ExpiresIn=expires_in
+        )
+
+    def complete_multipart_upload(self, key, upload_id, parts):
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket_name,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={'Parts': [{'PartNumber': n, 'ETag': etag} for n, etag in parts]}
+        )
+
+
+# The same interface over a local directory, for running the app and the
+# benchmarks without AWS. Object bodies are plain files under `root`; ETag,
+# content type/encoding and metadata live in a sidecar tree under
+# root/.meta. Conditional writes are atomic within one process. Browser
+# (presigned and multipart) uploads need a URL S3 serves, so they raise
+# UnsupportedOperation; callers check SUPPORTS_DIRECT_UPLOADS first.
+class LocalBackend:
+    META_DIR = '.meta'
+    PAGE_SIZE = 1000
+    SUPPORTS_DIRECT_UPLOADS = False
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self._lock = threading.RLock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key):
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"Key escapes the storage root: {key}")
+        return path
+
+    def _meta_path(self, key):
+        return self._path(os.path.join(self.META_DIR, key)) + '.json'
+
+    def _read_meta(self, key):
+        try:
+            with open(self._meta_path(key)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    # The body and its ETag are read under the write lock so a conditional
+    # write can't succeed against a body older than the ETag it was read with
+    def get(self, key):
+        with self._lock:
+            try:
+                with open(self._path(key), 'rb') as f:
+                    body = f.read()
+            except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+                raise ObjectNotFound(key)
+            meta = self._read_meta(key)
+        return {
+            'body': body,
+            'etag': meta.get('etag') or _etag(body),
+            'size': len(body),
+            'content_type': meta.get('content_type'),
+            'content_encoding': meta.get('content_encoding'),
+            'metadata': meta.get('metadata', {})
+        }
+
+    def head(self, key):
+        obj = self.get(key)
+        del obj['body']
+        return obj
+
+    def put(self, key, body, content_type=None, content_encoding=None, metadata=None,
+            if_match=None, if_none_match=False):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        elif not isinstance(body, bytes):
+            body = body.read()
+        path = self._path(key)
+        etag = _etag(body)
+        meta = {'etag': etag, 'content_type': content_type, 'content_encoding': content_encoding,
+                'metadata': metadata or {}}
+        with self._lock:
+            exists = os.path.isfile(path)
+            if if_none_match and exists:
+                raise PreconditionFailed(key)
+            if if_match and (not exists or self.head(key)['etag'] != if_match):
+                raise PreconditionFailed(key)
+            _atomic_write(path, body)
+            _atomic_write(self._meta_path(key), json.dumps(meta).encode('utf-8'))
+        return etag
+
+    def delete(self, key):
+        with self._lock:
+            for path in (self._path(key), self._meta_path(key)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def copy(self, source_key, key):
+        obj = self.get(source_key)
+        return self.put(key, obj['body'], content_type=obj['content_type'],
+                        content_encoding=obj['content_encoding'], metadata=obj['metadata'])
+
+    def _keys(self, prefix):
+        # Only walk the directory the prefix points into
+        start = os.path.join(self.root, prefix.rsplit('/', 1)[0]) if '/' in prefix else self.root
+        keys = []
+        for dirpath, dirnames, filenames in os.walk(start):
+            if dirpath == self.root:
+                dirnames[:] = [d for d in dirnames if d != self.META_DIR]
+            for name in filenames:
+                if name.startswith('.tmp-'):
+                    continue
+                key = os.path.relpath(os.path.join(dirpath, name), self.root).replace(os.sep, '/')
+                if key.startswith(prefix):
+                    keys.append(key)
+        keys.sort()
+        return keys
+
+    def list_pages(self, prefix='', delimiter=None, start_after=None):
+        entries = []
+        seen_prefixes = set()
+        for key in self._keys(prefix):
+            if start_after and key <= start_after:
+                continue
+            rest = key[len(prefix):]
+            if delimiter and delimiter in rest:
+                common = prefix + rest.split(delimiter, 1)[0] + delimiter
+                if common not in seen_prefixes:
+                    seen_prefixes.add(common)
+                    entries.append(('prefix', common))
+                continue
+            entries.append(('object', key))
+
+        for i in range(0, max(len(entries), 1), self.PAGE_SIZE):
+            page = {'objects': [], 'prefixes': []}
+            for kind, value in entries[i:i + self.PAGE_SIZE]:
+                if kind == 'prefix':
+                    page['prefixes'].append(value)
+                    continue
+                stat = os.stat(self._path(value))
+                page['objects'].append({
+                    'key': value,
+                    'size': stat.st_size,
+                    'etag': self._read_meta(value).get('etag'),
+                    'last_modified': datetime.fromtimestamp(stat.st_mtime, timezone.utc)
+                })
+            yield page
+
+    def presigned_put_url(self, key, content_type, metadata, expires_in):
+        raise UnsupportedOperation("Presigned uploads need the S3 backend (STORAGE_BACKEND=s3).")
+
+    def create_multipart_upload(self, key, content_type, metadata):
+        raise UnsupportedOperation("Multipart uploads need the S3 backend (STORAGE_BACKEND=s3).")
+
+    def presigned_part_url(self, key, upload_id, part_number, expires_in):
+        raise UnsupportedOperation("Multipart uploads need the S3 backend (STORAGE_BACKEND=s3).")
+
+    def complete_multipart_upload(self, key, upload_id, parts):
+        raise UnsupportedOperation("Multipart uploads need the S3 backend (STORAGE_BACKEND=s3).")
+
+
+def _etag(body):
+    return '"' + hashlib.md5(body).hexdigest() + '"'
+
+
+def _atomic_write(path, data):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = os.path.join(directory, f".tmp-{os.getpid()}-{threading.get_ident()}-{os.path.basename(path)}")
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+# STORAGE_BACKEND=local keeps every object under LOCAL_STORAGE_DIR/<bucket>
+# instead of S3.
+def backend_from_environment(bucket_name):
+    if os.environ.get('STORAGE_BACKEND', 's3').lower() == 'local':
+        root = os.environ.get('LOCAL_STORAGE_DIR', '.local-storage')
+        return LocalBackend(os.path.join(root, bucket_name))
+    return S3Backend(bucket_name)
+
+
+# All object I/O goes through here, whatever the backend.
 class StorageService:
-    def __init__(self, storage_location):
-        self.client = boto3.client('s3')
+    def __init__(self, storage_location, backend=None):
         self.bucket_name = storage_location
+        self.backend = backend or backend_from_environment(storage_location)
+
+    # The underlying S3 client, or None for a local backend
+    @property
+    def client(self):
+        return getattr(self.backend, 'client', None)
 
     def get_storage_location(self):
         return self.bucket_name
 
     def list_files(self):
-        response = self.client.list_objects_v2(Bucket=self.bucket_name)
         files = []
-        for content in response.get('Contents', []):
+        for obj in self.list():
             files.append({
                 'location': self.bucket_name,
-                'file_name': content['Key'],
-                'url': f"https://{self.bucket_name}.s3.amazonaws.com/{content['Key']}"
+                'file_name': obj['key'],
+                'url': f"https://{self.bucket_name}.s3.amazonaws.com/{obj['key']}"
             })
         return files
+
+    # Raises ObjectNotFound
+    def get_object(self, key):
+        return self.backend.get(key)
+
+    def get_bytes(self, key):
+        return self.backend.get(key)['body']
+
+    def get_json(self, key, default=None):
+        doc, _ = self.get_json_with_etag(key)
+        return default if doc is None else doc
+
+    # (doc, etag), or (None, None) when the key doesn't exist
+    def get_json_with_etag(self, key):
+        try:
+            obj = self.backend.get(key)
+        except ObjectNotFound:
+            return None, None
+        return compact_json.decode(obj['body']), obj['etag']
+
+    # Metadata without the body, or None when the key doesn't exist
+    def head(self, key):
+        try:
+            return self.backend.head(key)
+        except ObjectNotFound:
+            return None
+
+    def exists(self, key):
+        return self.head(key) is not None
+
+    # Returns the new ETag. Raises PreconditionFailed when `if_match` (an
+    # ETag) doesn't match or `if_none_match` is set and the key exists.
+    def put_bytes(self, key, body, content_type=None, content_encoding=None, metadata=None,
+                  if_match=None, if_none_match=False):
+        return self.backend.put(
+            key, body,
+            content_type=content_type,
+            content_encoding=content_encoding,
+            metadata=metadata,
+            if_match=if_match,
+            if_none_match=if_none_match
+        )
+
+    # Written in the compact encoding when large enough (see compact_json)
+    def put_json(self, key, doc, if_match=None, if_none_match=False):
+        body, content_encoding = compact_json.encode(doc)
+        return self.put_bytes(
+            key, body,
+            content_type='application/json',
+            content_encoding=content_encoding,
+            if_match=if_match,
+            if_none_match=if_none_match
+        )
+
+    # Write only if the key doesn't exist yet; False if it already did
+    def create_json(self, key, doc):
+        try:
+            self.put_json(key, doc, if_none_match=True)
+            return True
+        except PreconditionFailed:
+            return False
+
+    def delete(self, key):
+        self.backend.delete(key)
+
+    # Copy within the bucket; False when `source_key` doesn't exist
+    def copy(self, source_key, key):
+        try:
+            self.backend.copy(source_key, key)
+            return True
+        except ObjectNotFound:
+            return False
+
+    # Every object under `prefix`, in key order
+    def list(self, prefix='', start_after=None):
+        for page in self.backend.list_pages(prefix, start_after=start_after):
+            yield from page['objects']
+
+    # The "directories" directly under `prefix`, in order
+    def list_prefixes(self, prefix='', delimiter='/'):
+        for page in self.backend.list_pages(prefix, delimiter=delimiter):
+            yield from page['prefixes']
+
+    # Objects and sub-prefixes directly under `prefix`, a page at a time
+    def list_pages(self, prefix='', delimiter=None, start_after=None):
+        return self.backend.list_pages(prefix, delimiter=delimiter, start_after=start_after)
+
+    # Optimistic read-modify-write of a JSON object. `mutate` edits the
+    # document in place (a fresh `default()` when the key doesn't exist) and
+    # may return False to skip the write. The write is conditional on the
+    # ETag that was read, and the whole cycle is retried if another writer
+    # got in between, so `mutate` must be safe to call more than once.
+    # Retries back off exponentially with full jitter so writers contending
+    # on one object spread out instead of colliding again straight away.
+    def update_json(self, key, mutate, default=dict, retries=UPDATE_RETRIES):
+        for attempt in range(retries):
+            doc, etag = self.get_json_with_etag(key)
+            if doc is None:
+                doc = default()
+
+            if mutate(doc) is False:
+                return doc
+            try:
+                self.put_json(key, doc, if_match=etag, if_none_match=etag is None)
+                return doc
+            except PreconditionFailed:
+                if attempt + 1 < retries:
+                    time.sleep(random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt)))
+        raise ConcurrentUpdateError(f"{key} kept changing; gave up after {retries} tries.")
+
+    # Direct browser uploads (S3 backend only)
+    @property
+    def supports_direct_uploads(self):
+        return getattr(self.backend, 'SUPPORTS_DIRECT_UPLOADS', False)
+
+    def presigned_put_url(self, key, content_type, metadata=None, expires_in=900):
+        return self.backend.presigned_put_url(key, content_type, metadata or {}, expires_in)
+
+    def create_multipart_upload(self, key, content_type, metadata=None):
+        return self.backend.create_multipart_upload(key, content_type, metadata or {})
+
+    def presigned_part_url(self, key, upload_id, part_number, expires_in=900):
+        return self.backend.presigned_part_url(key, upload_id, part_number, expires_in)
+
+    # `parts` is [(part_number, etag), ...] in order
+    def complete_multipart_upload(self, key, upload_id, parts):
+        self.backend.complete_multipart_upload(key, upload_id, parts)
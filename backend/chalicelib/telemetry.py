@@ -0,0 +1,183 @@
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Request tracing. Each route invocation (or Lambda run) is one trace; every
+# AWS call made while it is active is recorded as a span through botocore's
+# event hooks, and code can add its own spans with `span()`. When a trace
+# finishes it is printed as one CloudWatch Embedded Metric Format line, so
+# Duration, AwsCalls, AwsTime and per-service time become metrics by route
+# and the spans stay searchable in the log.
+#
+# Debug output goes through `debug()`, which only prints for a sampled
+# fraction of traces (TELEMETRY_DEBUG_SAMPLE_RATE, 1 to print everything).
+
+NAMESPACE = os.environ.get('TELEMETRY_NAMESPACE', 'InvoiceApp')
+ENABLED = os.environ.get('TELEMETRY_ENABLED', '1') != '0'
+DEBUG_SAMPLE_RATE = float(os.environ.get('TELEMETRY_DEBUG_SAMPLE_RATE', '0.01'))
+MAX_SPANS = 100   # per trace; the rest are only counted
+
+# botocore service ids that make awkward metric names
+SERVICE_NAMES = {'cognito-identity-provider': 'cognito'}
+
+_current = contextvars.ContextVar('telemetry_trace', default=None)
+# Worker threads don't inherit the context variable. A Lambda container runs
+# one invocation at a time, so they fall back to the trace that is active.
+_active = None
+
+
+class Trace:
+    def __init__(self, name, debug=None):
+        self.name = name
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.debug = random.random() < DEBUG_SAMPLE_RATE if debug is None else debug
+        self.properties = {}
+        self.spans = []
+        self.dropped_spans = 0
+        self.aws_calls = 0
+        self.service_ms = {}
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self._started) * 1000
+
+    def add_span(self, name, started, duration_ms, service=None, **fields):
+        span = {
+            "name": name,
+            "start_ms": round((started - self._started) * 1000, 2),
+            "ms": round(duration_ms, 2),
+            **fields
+        }
+        with self._lock:
+            if service:
+                self.aws_calls += 1
+                self.service_ms[service] = self.service_ms.get(service, 0.0) + duration_ms
+            if len(self.spans) < MAX_SPANS:
+                self.spans.append(span)
+            else:
+                self.dropped_spans += 1
+
+    def record(self):
+        duration = self.elapsed_ms()
+        with self._lock:
+            service_ms = dict(self.service_ms)
+            metrics = {
+                "Duration": round(duration, 2),
+                "AwsCalls": self.aws_calls,
+                "AwsTime": round(sum(service_ms.values()), 2),
+                **{f"{service}Time": round(ms, 2) for service, ms in service_ms.items()}
+            }
+            spans = list(self.spans)
+            dropped = self.dropped_spans
+        units = {"AwsCalls": "Count"}
+        record = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": NAMESPACE,
+                    "Dimensions": [["Route"]],
+                    "Metrics": [{"Name": name, "Unit": units.get(name, "Milliseconds")} for name in metrics]
+                }]
+            },
+            "Route": self.name,
+            "trace_id": self.trace_id,
+            **metrics,
+            **self.properties,
+            "spans": spans
+        }
+        if dropped:
+            record["spans_dropped"] = dropped
+        return record
+
+
+def current_trace():
+    return _current.get() or _active
+
+
+@contextmanager
+def trace(name, debug=None):
+    global _active
+    current = Trace(name, debug)
+    token = _current.set(current)
+    _active = current
+    try:
+        yield current
+    except Exception as e:
+        current.properties["Error"] = type(e).__name__
+        raise
+    finally:
+        _current.reset(token)
+        if _active is current:
+            _active = None
+        if ENABLED:
+            print(json.dumps(current.record(), default=str))
+
+
+# Time a block of our own code inside the current trace
+@contextmanager
+def span(name, **fields):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        current = current_trace()
+        if current is not None:
+            current.add_span(name, started, (time.perf_counter() - started) * 1000, **fields)
+
+
+def debug_enabled():
+    current = current_trace()
+    if current is not None:
+        return current.debug
+    return random.random() < DEBUG_SAMPLE_RATE
+
+
+def debug(message):
+    if debug_enabled():
+        current = current_trace()
+        trace_id = current.trace_id if current is not None else '-'
+        print(f"[DEBUG] {trace_id} {message}")
+
+
+# botocore hooks: time every API call a client makes
+def instrument_client(client):
+    events = client.meta.events
+    events.register('before-call', _before_call)
+    events.register('after-call', _after_call)
+    events.register('after-call-error', _after_call_error)
+
+
+def _before_call(context=None, **kwargs):
+    if context is not None:
+        context['telemetry_started'] = time.perf_counter()
+
+
+def _finish_call(event_name, context, **fields):
+    current = current_trace()
+    started = (context or {}).get('telemetry_started')
+    if current is None or started is None:
+        return
+    # event_name is e.g. "after-call.s3.GetObject"
+    _, service, operation = event_name.split('.', 2)
+    service = SERVICE_NAMES.get(service, service)
+    current.add_span(f"{service}.{operation}", started, (time.perf_counter() - started) * 1000,
+                     service=service, **fields)
+
+
+def _after_call(event_name=None, http_response=None, parsed=None, context=None, **kwargs):
+    metadata = (parsed or {}).get('ResponseMetadata', {})
+    _finish_call(
+        event_name, context,
+        status=getattr(http_response, 'status_code', None),
+        retries=metadata.get('RetryAttempts', 0)
+    )
+
+
+def _after_call_error(event_name=None, exception=None, context=None, **kwargs):
+    _finish_call(event_name, context, error=type(exception).__name__)
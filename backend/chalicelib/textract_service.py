@@ -1,110 +1,224 @@
-import boto3
 import time
 
-class TextractService:
-    def __init__(self, storage_service):
-        self.client = boto3.client('textract', region_name='us-east-1')
-        self.storage = storage_service
+from chalicelib import telemetry
+from chalicelib.aws_clients import lazy_client
+from chalicelib.field_extraction import default_extractor
+
+# Bump whenever parsing or field mapping changes so cached extractions made
+# by an older parser are not served.
+PARSER_VERSION = 3
+
+# Incremental key/value parser. Blocks can be fed a page at a time; only the
+# pieces needed to resolve text are kept (word text by id, the child/value ids
+# and confidence of KEY and VALUE blocks, and LINE text and confidence), so
+# the full block dicts with their geometry can be dropped as soon as a page
+# has been consumed.
+class BlockParser:
+    def __init__(self):
+        self.words = {}
+        self.keys = []
+        self.values = {}
+        self.lines = []
+
+    def feed(self, blocks):
+        for block in blocks:
+            block_type = block['BlockType']
+            if block_type == 'WORD':
+                self.words[block['Id']] = block['Text']
+            elif block_type == 'LINE':
+                self.lines.append((block['Text'], block.get('Confidence')))
+            elif block_type == 'KEY_VALUE_SET':
+                entity_types = block.get('EntityTypes', [])
+                child_ids, value_id = _relationship_ids(block)
+                confidence = block.get('Confidence')
+                if 'KEY' in entity_types:
+                    self.keys.append((child_ids, value_id, confidence))
+                if 'VALUE' in entity_types:
+                    self.values[block['Id']] = (child_ids, confidence)
+
+    # Returns ([(key_text, value_text, confidence), ...],
+    # [(line_text, confidence), ...]). A pair's confidence is the lower of
+    # its KEY and VALUE blocks'.
+    def result(self):
+        pairs = []
+        for child_ids, value_id, key_confidence in self.keys:
+            key_text = self._join_words(child_ids)
+            value_text = ""
+            confidence = key_confidence
+            if value_id is not None and value_id in self.values:
+                value_ids, value_confidence = self.values[value_id]
+                value_text = self._join_words(value_ids)
+                if value_confidence is not None:
+                    confidence = value_confidence if confidence is None else min(confidence, value_confidence)
+            pairs.append((key_text, value_text, confidence))
+        return pairs, self.lines
 
-    def analyze_document(self, file_name):
-        bucket = self.storage.get_storage_location()
-        print(f"DEBUG: Bucket = {bucket}, Key = {file_name}")
+    def _join_words(self, ids):
+        words = self.words
+        return " ".join(words[cid] for cid in ids if cid in words)
 
-        is_pdf = file_name.lower().endswith(".pdf")
 
-        if is_pdf:
-            # For PDFs (asynchronous)
-            response = self.client.start_document_analysis(
-                DocumentLocation={'S3Object': {'Bucket': bucket, 'Name': file_name}},
-                FeatureTypes=["FORMS"]
-            )
-            job_id = response['JobId']
-            print(f"Started Textract job: {job_id}")
-
-            # Wait until job completes
-            while True:
-                result = self.client.get_document_analysis(JobId=job_id)
-                status = result['JobStatus']
-                print(f"Job status: {status}")
-                if status == 'SUCCEEDED':
-                    break
-                elif status == 'FAILED':
-                    raise Exception("Textract PDF analysis failed.")
-                time.sleep(2)
-
-            blocks = result.get('Blocks', [])
+def _relationship_ids(block):
+    child_ids = []
+    value_id = None
+    for rel in block.get('Relationships', []):
+        if rel['Type'] == 'CHILD':
+            child_ids.extend(rel['Ids'])
+        elif rel['Type'] == 'VALUE' and rel['Ids']:
+            value_id = rel['Ids'][0]
+    return tuple(child_ids), value_id
+
+
+def parse_blocks(blocks):
+    parser = BlockParser()
+    parser.feed(blocks)
+    return parser.result()
+
+
+# Map the parsed key/value pairs onto the invoice fields we care about; see
+# field_extraction for the field table.
+def extract_fields(blocks, extractor=default_extractor):
+    with telemetry.span('textract.extract_fields'):
+        return extractor.extract(parse_blocks(blocks))
+
+
+# Same as extract_fields for many responses at once
+def extract_fields_batch(block_lists, extractor=default_extractor):
+    return extractor.extract_batch([parse_blocks(blocks) for blocks in block_lists])
+
 
+class TextractJobFailed(Exception):
+    pass
+
+
+class TextractService:
+    # Max blocks per get_document_analysis page (Textract's own ceiling).
+    RESULT_PAGE_SIZE = 1000
+
+    # Backoff used when a caller does block on a PDF job.
+    POLL_INITIAL_DELAY = 1.0
+    POLL_MAX_DELAY = 15.0
+    POLL_DEADLINE = 240.0
+
+    def __init__(self, storage_service, client=None, notification_channel=None, cache=None,
+                 rate_limiter=None):
+        self.client = client or lazy_client('textract', region='us-east-1')
+        self.storage = storage_service
+        # {'SNSTopicArn': ..., 'RoleArn': ...} when Textract should publish
+        # job completion to SNS.
+        self.notification_channel = notification_channel
+        # Optional ExtractionCache keyed by document content
+        self.cache = cache
+        # Optional RateLimiter shared by every thread calling Textract
+        self.rate_limiter = rate_limiter
+
+    @staticmethod
+    def is_async_document(file_name):
+        return file_name.lower().endswith(".pdf")
+
+    # Pass use_cache=False to force a fresh Textract run; the new result
+    # still replaces the cached one.
+    def analyze_document(self, file_name, use_cache=True):
+        bucket = self.storage.get_storage_location()
+        telemetry.debug(f"Analyzing s3://{bucket}/{file_name}")
+
+        cache_key = self.cache.key_for(file_name) if self.cache else None
+        if use_cache and cache_key:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        if self.is_async_document(file_name):
+            # For PDFs (asynchronous), blocking with backoff until done
+            job_id = self.start_analysis(file_name)
+            extracted = self.wait_for_analysis(job_id)
         else:
             # For images (synchronous)
+            self._throttle()
             response = self.client.analyze_document(
                 Document={'S3Object': {'Bucket': bucket, 'Name': file_name}},
                 FeatureTypes=["FORMS"]
             )
-            blocks = response.get('Blocks', [])
-
-        key_map = {}
-        value_map = {}
-        extracted = {}
-        full_text = []
-
-        for block in blocks:
-            if block['BlockType'] == 'KEY_VALUE_SET':
-                block_id = block['Id']
-                if 'KEY' in block.get('EntityTypes', []):
-                    key_map[block_id] = block
-                if 'VALUE' in block.get('EntityTypes', []):
-                    value_map[block_id] = block
-            elif block['BlockType'] == 'LINE':
-                full_text.append(block['Text'])
-
-        for key_id, key_block in key_map.items():
-            key_text = self._get_text(blocks, key_block)
-            value_text = ""
-            for rel in key_block.get('Relationships', []):
-                if rel['Type'] == 'VALUE':
-                    val_block = value_map.get(rel['Ids'][0])
-                    value_text = self._get_text(blocks, val_block)
-
-            print(f"KEY: {key_text} → VALUE: {value_text}")
-
-            key_lower = key_text.lower()
-            if any(k in key_lower for k in ["vendor", "supplier", "biller"]):
-                extracted['Vendor'] = value_text
-            elif "due date" in key_lower:
-                extracted['DueDate'] = value_text
-            elif any(k in key_lower for k in ["amount due", "total amount", "total"]):
-                extracted['Amount'] = value_text
-
-        # Smart fallback: combine multiple lines to form full vendor name
-        if 'Vendor' not in extracted:
-            vendor_lines = []
-            for line in full_text:
-                clean = line.strip()
-                lower = clean.lower()
-                words = clean.split()
-
-                if (
-                    len(words) >= 1 and
-                    not any(char.isdigit() for char in clean) and
-                    not any(w in lower for w in ['invoice', 'total', 'due', 'date', 'amount', 'number'])
-                ):
-                    vendor_lines.append(clean.title())
-
-                if len(vendor_lines) >= 2:
-                    break
-
-            if vendor_lines:
-                extracted['Vendor'] = " ".join(vendor_lines)
+            extracted = extract_fields(response.get('Blocks', []))
 
+        if cache_key:
+            self.cache.put(cache_key, extracted, file_name)
         return extracted
 
-    def _get_text(self, blocks, block):
-        text = ""
-        if 'Relationships' in block:
-            for rel in block['Relationships']:
-                if rel['Type'] == 'CHILD':
-                    for cid in rel['Ids']:
-                        word = next((b for b in blocks if b['Id'] == cid and b['BlockType'] == 'WORD'), None)
-                        if word:
-                            text += word['Text'] + " "
-        return text.strip()
+    def cached_analysis(self, file_name):
+        if not self.cache:
+            return None
+        return self.cache.get(self.cache.key_for(file_name))
+
+    def remember_analysis(self, file_name, extracted):
+        if self.cache:
+            self.cache.put(self.cache.key_for(file_name), extracted, file_name)
+
+    def start_analysis(self, file_name, job_tag=None):
+        params = {
+            'DocumentLocation': {
+                'S3Object': {'Bucket': self.storage.get_storage_location(), 'Name': file_name}
+            },
+            'FeatureTypes': ["FORMS"],
+        }
+        if job_tag:
+            params['JobTag'] = job_tag
+        if self.notification_channel:
+            params['NotificationChannel'] = self.notification_channel
+
+        self._throttle()
+        job_id = self.client.start_document_analysis(**params)['JobId']
+        telemetry.debug(f"Started Textract job {job_id} for {file_name}")
+        return job_id
+
+    def _throttle(self):
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+
+    # Single non-blocking status check. Returns (status, extracted) where
+    # extracted is only set once the job has SUCCEEDED.
+    def get_analysis(self, job_id):
+        result = self.client.get_document_analysis(
+            JobId=job_id, MaxResults=self.RESULT_PAGE_SIZE
+        )
+        status = result['JobStatus']
+        if status == 'SUCCEEDED':
+            return status, extract_fields(self.iter_result_blocks(job_id, result))
+        if status == 'FAILED':
+            raise TextractJobFailed(result.get('StatusMessage', "Textract PDF analysis failed."))
+        return status, None
+
+    def wait_for_analysis(self, job_id, deadline=None):
+        deadline = deadline if deadline is not None else self.POLL_DEADLINE
+        give_up_at = time.monotonic() + deadline
+        delay = self.POLL_INITIAL_DELAY
+
+        while True:
+            status, extracted = self.get_analysis(job_id)
+            telemetry.debug(f"Textract job {job_id} status: {status}")
+            if status == 'SUCCEEDED':
+                return extracted
+
+            remaining = give_up_at - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"Textract job {job_id} still {status} after {deadline}s.")
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, self.POLL_MAX_DELAY)
+
+    # Page through every result set of a finished job, yielding blocks one
+    # page at a time. `first_page` is the response that reported SUCCEEDED,
+    # which already carries the first page of blocks.
+    def iter_result_blocks(self, job_id, first_page=None):
+        page = first_page
+        if page is None:
+            page = self.client.get_document_analysis(
+                JobId=job_id, MaxResults=self.RESULT_PAGE_SIZE
+            )
+        while True:
+            yield from page.get('Blocks', [])
+            next_token = page.get('NextToken')
+            if not next_token:
+                return
+            page = self.client.get_document_analysis(
+                JobId=job_id, MaxResults=self.RESULT_PAGE_SIZE, NextToken=next_token
+            )
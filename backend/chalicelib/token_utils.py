@@ -1,3 +1,9 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
 import jwt
 import requests
 
@@ -6,29 +12,128 @@ USER_POOL_ID = 'us-east-1_uQZV1V7mr'
 COGNITO_ISSUER = f'https://cognito-idp.{COGNITO_REGION}.amazonaws.com/{USER_POOL_ID}'
 JWKS_URL = f'{COGNITO_ISSUER}/.well-known/jwks.json'
 
-# Cache keys
-_jwk_cache = None
+JWKS_TIMEOUT = 3            # seconds per JWKS request
+JWKS_TTL = 6 * 60 * 60      # refetch keys this often even if every kid is known
+JWKS_MIN_REFRESH = 60       # at most one refetch per minute for unknown kids
+
+VERIFIED_TOKEN_TTL = 300    # reuse a successful verification for up to 5 minutes
+VERIFIED_TOKEN_CACHE_SIZE = 2048
+
+
+# Parsed Cognito public keys by kid. Keys are fetched once and refetched when
+# they are older than `ttl` or a token arrives with an unknown kid (key
+# rotation), but never more than once per `min_refresh`. Set COGNITO_JWKS_FILE
+# (a path) or COGNITO_JWKS_JSON (the document) to preload the keys instead;
+# a preloaded store never goes to the network, which is what offline runs
+# and tests want.
+class JwksKeyStore:
+    def __init__(self, url=JWKS_URL, ttl=JWKS_TTL, min_refresh=JWKS_MIN_REFRESH,
+                 timeout=JWKS_TIMEOUT, jwks=None):
+        self.url = url
+        self.ttl = ttl
+        self.min_refresh = min_refresh
+        self.timeout = timeout
+        self._keys = {}
+        self._fetched_at = None
+        self._attempted_at = None
+        self._static = jwks is not None
+        self._lock = threading.Lock()
+        if jwks is not None:
+            self.load(jwks)
+
+    @classmethod
+    def from_environment(cls):
+        if os.environ.get('COGNITO_JWKS_FILE'):
+            with open(os.environ['COGNITO_JWKS_FILE']) as f:
+                return cls(jwks=json.load(f))
+        if os.environ.get('COGNITO_JWKS_JSON'):
+            return cls(jwks=json.loads(os.environ['COGNITO_JWKS_JSON']))
+        return cls()
+
+    def load(self, jwks):
+        keys = {k['kid']: jwt.algorithms.RSAAlgorithm.from_jwk(k) for k in jwks['keys']}
+        with self._lock:
+            self._keys = keys
+            self._fetched_at = time.monotonic()
+
+    def get_key(self, kid):
+        if not self._static:
+            now = time.monotonic()
+            stale = self._fetched_at is None or now - self._fetched_at > self.ttl
+            if stale or kid not in self._keys:
+                self._refresh(now)
+        return self._keys.get(kid)
+
+    def _refresh(self, now):
+        with self._lock:
+            if self._attempted_at is not None and now - self._attempted_at < self.min_refresh:
+                return
+            self._attempted_at = now
+        try:
+            response = requests.get(self.url, timeout=self.timeout)
+            response.raise_for_status()
+            self.load(response.json())
+        except (requests.RequestException, ValueError, KeyError) as e:
+            # Keep serving the keys we already have
+            print(f"JWKS refresh failed: {e}")
+
+
+# Claims of recently verified tokens, keyed by a hash of the token. An entry
+# never outlives the token's own exp.
+class VerifiedTokenCache:
+    def __init__(self, ttl=VERIFIED_TOKEN_TTL, max_entries=VERIFIED_TOKEN_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def get(self, token):
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            payload, expires_at = entry
+            if time.time() >= expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return payload
+
+    def put(self, token, payload):
+        expires_at = min(payload.get('exp', 0), time.time() + self.ttl)
+        with self._lock:
+            self._entries[self._key(token)] = (payload, expires_at)
+            self._entries.move_to_end(self._key(token))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+key_store = JwksKeyStore.from_environment()
+verified_tokens = VerifiedTokenCache()
 
-def get_jwk_keys():
-    global _jwk_cache
-    if _jwk_cache is None:
-        response = requests.get(JWKS_URL)
-        _jwk_cache = response.json()
-    return _jwk_cache
 
 def verify_token(token):
+    cached = verified_tokens.get(token)
+    if cached is not None:
+        return cached
+
     try:
-        jwks = get_jwk_keys()
         headers = jwt.get_unverified_header(token)
-        key = next(k for k in jwks['keys'] if k['kid'] == headers['kid'])
-
-        public_key = jwt.algorithms.RSAAlgorithm.from_jwk(key)
+        public_key = key_store.get_key(headers['kid'])
+        if public_key is None:
+            print(f"TOKEN VERIFICATION FAILED: unknown kid {headers['kid']}")
+            return None
 
         payload = jwt.decode(
             token,
             public_key,
             algorithms=['RS256'],
-            issuer=COGNITO_ISSUER, 
+            issuer=COGNITO_ISSUER,
             options={"verify_aud": False}
         )
 
@@ -37,10 +142,9 @@ def verify_token(token):
             print("Rejected: not an access token")
             return None
 
+        verified_tokens.put(token, payload)
         return payload
 
     except Exception as e:
         print(f"TOKEN VERIFICATION FAILED: {e}")
         return None
-
-
@@ -1,15 +1,16 @@
-import boto3
+from chalicelib.aws_clients import lazy_client
 
 class UserService:
     def __init__(self, user_pool_id, client_id, region='us-east-1'):
-        self.client = boto3.client('cognito-idp', region_name=region)
+        self.client = lazy_client('cognito-idp', region)
         self.user_pool_id = user_pool_id
         self.client_id = client_id
 
     def signup_user(self, email, password):
         try:
-            # Step 1: Create the user
-            self.client.sign_up(
+            # The pool's pre sign-up trigger (cognito_triggers.py) confirms
+            # the user and verifies their email within this one call
+            response = self.client.sign_up(
                 ClientId=self.client_id,
                 Username=email,
                 Password=password,
@@ -18,19 +19,9 @@ class UserService:
                 ]
             )
 
-            # By pass the email verification so that when testing and presenting we dont need to verify
-            self.client.admin_confirm_sign_up(
-                UserPoolId=self.user_pool_id,
-                Username=email
-            )
-
-            self.client.admin_update_user_attributes(
-                UserPoolId=self.user_pool_id,
-                Username=email,
-                UserAttributes=[
-                    {'Name': 'email_verified', 'Value': 'true'}
-                ]
-            )
+            # Pools without the trigger attached still need the admin calls
+            if not response.get('UserConfirmed'):
+                self._confirm_user(email)
 
             return {'status': 'ok', 'message': 'User signed up and auto-confirmed successfully.'}
 
@@ -39,6 +30,21 @@ class UserService:
         except Exception as e:
             return {'status': 'error', 'message': str(e)}
 
+    # By pass the email verification so that when testing and presenting we dont need to verify
+    def _confirm_user(self, email):
+        self.client.admin_confirm_sign_up(
+            UserPoolId=self.user_pool_id,
+            Username=email
+        )
+
+        self.client.admin_update_user_attributes(
+            UserPoolId=self.user_pool_id,
+            Username=email,
+            UserAttributes=[
+                {'Name': 'email_verified', 'Value': 'true'}
+            ]
+        )
+
     def login_user(self, email, password):
         try:
             response = self.client.initiate_auth(
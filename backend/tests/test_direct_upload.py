@@ -0,0 +1,63 @@
+# Direct (presigned) uploads go through the same image pre-processing as
+# /upload-image, against the local storage backend and a stubbed Textract.
+#
+#   python -m pytest tests
+import io
+import os
+import sys
+import tempfile
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['STORAGE_BACKEND'] = 'local'
+os.environ['LOCAL_STORAGE_DIR'] = tempfile.mkdtemp()
+
+from PIL import Image  # noqa: E402
+
+import app  # noqa: E402
+from chalicelib import image_processing  # noqa: E402
+
+
+# Records which objects AnalyzeDocument was asked to read
+class StubTextract:
+    def __init__(self):
+        self.analyzed = []
+
+    def analyze_document(self, Document, FeatureTypes):
+        self.analyzed.append(Document['S3Object']['Name'])
+        return {'Blocks': []}
+
+
+def photo(width, height):
+    out = io.BytesIO()
+    Image.effect_noise((width, height), 64).convert('RGB').save(out, 'JPEG', quality=95)
+    return out.getvalue()
+
+
+def run_event(key):
+    handler = getattr(app.process_direct_upload, 'func', app.process_direct_upload)
+    handler(SimpleNamespace(key=key))
+
+
+def test_oversized_direct_upload_is_analyzed_from_the_optimized_copy():
+    textract = StubTextract()
+    app.textract_service.client = textract
+    storage = app.storage_service
+    data = photo(4000, 3000)
+    # Claimed as PNG; the magic bytes say JPEG
+    storage.put_bytes('incoming/user-1/abc123.png', data, content_type='image/png')
+
+    run_event('incoming/user-1/abc123.png')
+
+    assert textract.analyzed == ['uploads/user-1/abc123.jpg']
+    stored = storage.get_object('uploads/user-1/abc123.jpg')
+    assert len(stored['body']) < len(data)
+    assert max(Image.open(io.BytesIO(stored['body'])).size) <= image_processing.MAX_DIMENSION
+    assert stored['metadata']['original-key'] == 'originals/user-1/abc123.jpg'
+    assert storage.get_bytes('originals/user-1/abc123.jpg') == data
+    assert not storage.exists('incoming/user-1/abc123.png')
+    assert app.invoice_store.get('user-1', 'abc123') is not None
+
+    # A redelivered event finds the upload already stored
+    run_event('incoming/user-1/abc123.png')
+    assert textract.analyzed == ['uploads/user-1/abc123.jpg']
@@ -0,0 +1,36 @@
+# Looking up a document's running Textract job by kind, against the local
+# storage backend.
+#
+#   python -m pytest tests
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chalicelib.job_registry import JobRegistry  # noqa: E402
+from chalicelib.storage_service import LocalBackend, StorageService  # noqa: E402
+
+FILE_NAME = 'uploads/u/invoice.pdf'
+
+
+def registry():
+    return JobRegistry(StorageService('b', backend=LocalBackend(tempfile.mkdtemp())))
+
+
+def test_extract_job_does_not_hide_upload_job():
+    jobs = registry()
+    jobs.create('u', 'upload-job', FILE_NAME, 'upload')
+    jobs.create('u', 'extract-job', FILE_NAME, 'extract')
+    assert jobs.get_for_file('u', FILE_NAME, 'upload')['job_id'] == 'upload-job'
+    assert jobs.get_for_file('u', FILE_NAME, 'extract')['job_id'] == 'extract-job'
+    assert jobs.get_for_file('u', FILE_NAME, 'reanalyze') is None
+
+
+def test_pointer_written_before_kinds_is_still_found():
+    jobs = registry()
+    jobs.create('u', 'old-job', FILE_NAME, 'upload')
+    jobs.storage.delete(jobs._file_key('u', FILE_NAME, 'upload'))
+    jobs.storage.put_json(jobs._legacy_file_key('u', FILE_NAME), {"job_id": 'old-job'})
+    assert jobs.get_for_file('u', FILE_NAME, 'upload')['job_id'] == 'old-job'
+    assert jobs.get_for_file('u', FILE_NAME, 'extract') is None
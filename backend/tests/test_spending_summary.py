@@ -0,0 +1,72 @@
+# Rebuilding the spending summary while uploads land, against the local
+# storage backend.
+#
+#   python -m pytest tests
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chalicelib.invoice_store import InvoiceStore, summarize  # noqa: E402
+from chalicelib.spending_summary import SpendingSummary  # noqa: E402
+from chalicelib.storage_service import LocalBackend, StorageService  # noqa: E402
+
+
+def stores():
+    storage = StorageService('b', backend=LocalBackend(tempfile.mkdtemp()))
+    spending = SpendingSummary(storage)
+    return storage, spending, InvoiceStore(storage, spending=spending)
+
+
+def add(store, user_id, n):
+    return store.add(user_id, f"uploads/{user_id}/{n}.jpg", {'Vendor': 'ACME', 'Amount': '1.00'})
+
+
+def test_upload_during_first_rebuild_is_counted():
+    storage, spending, store = stores()
+    add(store, 'u', 0)
+    calls = []
+
+    # The first time the entries are read, another upload lands right after
+    def load_entries():
+        entries = list(store.summaries('u'))
+        if not calls:
+            calls.append(add(store, 'u', 1))
+        return entries
+
+    doc = spending.rebuild('u', load_entries)
+    assert doc['invoice_count'] == 2
+    assert spending.load('u')['total_cents'] == 200
+
+
+def test_upload_during_rebuild_of_existing_summary_is_counted():
+    storage, spending, store = stores()
+    add(store, 'u', 0)
+    spending.rebuild('u', lambda: store.summaries('u'))
+    calls = []
+
+    def load_entries():
+        entries = list(store.summaries('u'))
+        if not calls:
+            calls.append(add(store, 'u', 1))
+        return entries
+
+    spending.rebuild('u', load_entries)
+    assert spending.load('u')['invoice_count'] == 2
+
+
+def test_parked_changes_are_counted_once():
+    storage, spending, store = stores()
+    spending.rebuild('u', lambda: store.summaries('u'))
+    indexed = add(store, 'u', 0)
+    # One parked change already in the index, one whose index entry isn't
+    prefix = spending._pending_prefix('u')
+    storage.put_json(f"{prefix}1-a.json", {"added": [summarize(indexed)], "removed": []})
+    missing = dict(summarize(indexed), invoice_id='other')
+    storage.put_json(f"{prefix}2-b.json", {"added": [missing], "removed": []})
+
+    doc = spending.rebuild('u', lambda: store.summaries('u'))
+    assert doc['invoice_count'] == 2
+    assert list(storage.list(prefix)) == []
+    assert spending.load('u')['invoice_count'] == 2
@@ -0,0 +1,63 @@
+# Result paging of async Textract jobs, against a stubbed client.
+#
+#   python -m pytest tests
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chalicelib.textract_service import TextractService  # noqa: E402
+
+
+def line(text, page):
+    return {'BlockType': 'LINE', 'Id': f"line-{page}", 'Text': text, 'Page': page}
+
+
+# Serves `pages` of GetDocumentAnalysis results chained by NextToken
+class StubTextract:
+    def __init__(self, pages):
+        self.pages = pages
+        self.calls = []
+
+    def get_document_analysis(self, JobId, MaxResults, NextToken=None):
+        self.calls.append(NextToken)
+        index = 0 if NextToken is None else int(NextToken.split('-')[1])
+        page = {'JobStatus': 'SUCCEEDED', 'Blocks': self.pages[index]}
+        if index + 1 < len(self.pages):
+            page['NextToken'] = f"token-{index + 1}"
+        return page
+
+
+PAGES = [[line(f"Page {n} of 4", n)] for n in range(1, 5)]
+
+
+def test_iter_result_blocks_follows_next_token():
+    client = StubTextract(PAGES)
+    service = TextractService(storage_service=None, client=client)
+
+    blocks = list(service.iter_result_blocks('job-1'))
+
+    assert [b['Text'] for b in blocks] == ["Page 1 of 4", "Page 2 of 4", "Page 3 of 4", "Page 4 of 4"]
+    assert client.calls == [None, 'token-1', 'token-2', 'token-3']
+
+
+def test_iter_result_blocks_reuses_first_page():
+    client = StubTextract(PAGES)
+    service = TextractService(storage_service=None, client=client)
+    first_page = client.get_document_analysis(JobId='job-1', MaxResults=1000)
+
+    blocks = list(service.iter_result_blocks('job-1', first_page))
+
+    assert len(blocks) == 4
+    assert client.calls == [None, 'token-1', 'token-2', 'token-3']
+
+
+def test_get_analysis_reads_every_page():
+    client = StubTextract(PAGES)
+    service = TextractService(storage_service=None, client=client)
+
+    status, extracted = service.get_analysis('job-1')
+
+    assert status == 'SUCCEEDED'
+    assert "Page 4 of 4" in extracted['Text']
+    assert client.calls == [None, 'token-1', 'token-2', 'token-3']
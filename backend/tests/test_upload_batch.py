@@ -0,0 +1,54 @@
+# /upload-batch only starts items that can still finish within the time
+# budget, against the local storage backend and a slow stubbed Textract.
+#
+#   python -m pytest tests
+import base64
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['STORAGE_BACKEND'] = 'local'
+os.environ.setdefault('LOCAL_STORAGE_DIR', tempfile.mkdtemp())
+
+from chalice.test import Client  # noqa: E402
+from PIL import Image  # noqa: E402
+
+import app  # noqa: E402
+
+ANALYZE_SECONDS = 0.4
+
+
+class SlowTextract:
+    def analyze_document(self, Document, FeatureTypes):
+        time.sleep(ANALYZE_SECONDS)
+        return {'Blocks': []}
+
+
+def image():
+    out = io.BytesIO()
+    Image.effect_noise((64, 64), 64).convert('RGB').save(out, 'JPEG')
+    return base64.b64encode(out.getvalue()).decode('ascii')
+
+
+def test_items_that_cannot_finish_in_time_are_deferred(monkeypatch):
+    monkeypatch.setattr(app.textract_service, 'client', SlowTextract())
+    monkeypatch.setattr(app, 'verify_token', lambda token: {'sub': 'batch-user'})
+    monkeypatch.setattr(app, 'BATCH_WORKERS', 1)
+    # Two items start within the 0.6 s window; each could take up to 1 s
+    monkeypatch.setattr(app, 'BATCH_ITEM_BUDGET', 1.0)
+    monkeypatch.setattr(app, 'BATCH_TIME_BUDGET', 1.6)
+
+    with Client(app.app) as client:
+        response = client.http.post(
+            '/upload-batch',
+            headers={'Authorization': 'Bearer token', 'Content-Type': 'application/json'},
+            body=json.dumps({'items': [{'image': image()} for _ in range(4)]})
+        )
+
+    body = json.loads(response.body)
+    assert [item['status'] for item in body['items']] == [app.SUCCEEDED, app.SUCCEEDED, app.DEFERRED, app.DEFERRED]
+    assert (body['succeeded'], body['deferred']) == (2, 2)